@@ -6,18 +6,28 @@ import streamlit as st
 import os
 import json
 import base64
-import zipfile
-from dataclasses import dataclass, asdict
-from typing import List, Optional, Dict
+from dataclasses import dataclass, asdict, replace
+from typing import List, Dict
 from datetime import datetime
-from io import BytesIO
 from PIL import Image
 from dotenv import load_dotenv
 import prompt_engine
 import importlib
 importlib.reload(prompt_engine) # Force reload
-from prompt_engine import PromptGenerator, BrandStyle, ShotListGenerator
+from prompt_engine import BrandStyle
+from speculative_planner import SpeculativePlanner
+from image_utils import base64_to_image, pil_to_png_bytes
+from image_index import HashIndex, PaletteIndex, dhash_b64, palette_b64, fill_missing_palettes, DUPLICATE_DISTANCE
+from studio_engine import StudioEngine, GeminiBackend, ShootRefs, IMAGE_MODEL, DRAFT_MODEL, RESOLUTION_SIZES, COST_PER_IMAGE
+from quality_gate import QualityGate
 import db_manager as db
+import storage
+import tracing
+import vault_import
+import maintenance
+import backup
+import static_assets
+import memory_budget
 
 # Initialize DB
 db.init_db()
@@ -33,6 +43,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+GALLERY_PAGE_SIZE = 24  # Archive search results per page
+
 # Sessions
 if "user_id" not in st.session_state:
     st.session_state.user_id = None
@@ -108,44 +120,47 @@ def image_to_base64(uploaded_file) -> str:
         st.error(f"Error processing image: {e}")
         return ""
 
-def base64_to_image(base64_string: str) -> Optional[Image.Image]:
-    """Convert base64 string to PIL Image."""
-    try:
-        if not base64_string:
-            return None
-        # Handle data:image/png;base64, prefix if present
-        if "," in base64_string:
-            base64_string = base64_string.split(",")[1]
-        image_data = base64.b64decode(base64_string)
-        return Image.open(BytesIO(image_data))
-    except Exception:
-        return None
-
-def load_and_resize(b64_str, max_size=None):
-    """Load base64 image and optionally resize it."""
-    if not b64_str: return None
-    img = base64_to_image(b64_str)
-    if img:
-        # Convert to RGB to ensure compatibility
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        # Resize if max_size is provided (tuple)
-        if max_size:
-            img.thumbnail(max_size)
-    return img
-
+# Dialogs take the gallery id, not a decoded image: Streamlit keeps dialog arguments alive
+# for as long as the dialog can rerun
 @st.dialog("High Resolution Preview")
-def show_image_preview(image, prompt):
-    st.image(image, use_container_width=True)
+def show_image_preview(item_id, prompt):
+    rows = db.get_gallery_items([item_id])
+    if rows:
+        st.markdown(static_assets.img_tag(static_assets.full_url('gallery', rows[0]), prompt[:30], css_class="preview-img"),
+                    unsafe_allow_html=True)
     st.caption(prompt)
 
 @st.dialog("Magic Editor")
-def render_edit_dialog(image, original_prompt, category_type='apparel'):
+def render_edit_dialog(item_id, original_prompt, category_type='apparel'):
+    rows = db.get_gallery_items([item_id])
+    image = base64_to_image(rows[0]['image_base64']) if rows else None
+    if image is None:
+        st.error("Image not found.")
+        return
+    # Remix session: continues the chain if this frame is the latest edit of an earlier session
+    session = None
+    if engine and item_id is not None:
+        # Keyed by the frame the dialog was opened on; the head moves forward with every edit
+        remix_sessions = st.session_state.setdefault("remix_sessions", {})
+        session = remix_sessions.get(item_id)
+        if session is None:
+            session = remix_sessions[item_id] = engine.open_remix_session(st.session_state.user_id, category_type, item_id, original_prompt)
+        if session.head_item_id != item_id:
+            head = db.get_gallery_items([session.head_item_id])
+            if head:
+                image = base64_to_image(head[0]['image_base64'])
+
     col1, col2 = st.columns([1, 1])
     with col1:
-        st.image(image, caption="base", use_container_width=True)
+        st.image(image, caption=f"after {len(session.turns)} edits" if session and session.turns else "base", use_container_width=True)
     with col2:
         st.caption(f"Original: {original_prompt[:100]}...")
+        if session and session.turns:
+            for n, turn in enumerate(session.turns, start=1):
+                st.caption(f"{n}. {turn['instruction']}")
+            if st.button("Start Over", key="remix_new_session", help="New session from the frame you opened"):
+                remix_sessions[item_id] = engine.open_remix_session(st.session_state.user_id, category_type, item_id, original_prompt, new=True)
+                st.rerun(scope="fragment")
     
     st.markdown("#### Remix Instructions")
     edit_instr = st.text_input("What should we change?", placeholder="E.g., Change background to a beach, Make the dress red...")
@@ -158,50 +173,26 @@ def render_edit_dialog(image, original_prompt, category_type='apparel'):
             st.error("Please describe your edit.")
             return
 
-        with st.spinner("Applying magic..."):
+        with st.spinner("Applying magic..."), tracing.trace("remix", user=st.session_state.studio_name, model=IMAGE_MODEL):
              try:
-                # payload
-                final_prompt = PromptGenerator.generate_edit_payload(
-                    base_desc=original_prompt,
-                    edit_instruction=edit_instr
-                )
-                
-                contents = [final_prompt, image]
-                if ref_file:
-                    ref_img = Image.open(ref_file)
-                    contents.append(ref_img)
+                ref_img = Image.open(ref_file) if ref_file else None
                     
                 # Call API
-                if client:
-                    response = client.models.generate_content(
-                        model='gemini-3-pro-image-preview',
-                        contents=contents,
-                         config=types.GenerateContentConfig(
-                            safety_settings=[types.SafetySetting(
-                                category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                                threshold="BLOCK_ONLY_HIGH"
-                            )]
-                        )
-                    )
-                    
-                    # Decode
-                    generated_pil = None
-                    if response.parts:
-                         for part in response.parts:
-                              if part.inline_data:
-                                   if isinstance(part.inline_data.data, bytes):
-                                        generated_pil = Image.open(BytesIO(part.inline_data.data))
-                                   else:
-                                        generated_pil = Image.open(BytesIO(base64.b64decode(part.inline_data.data)))
-                                   break
+                if session:
+                    # Follow-ups only send the new instruction; the session keeps the image context
+                    result = engine.remix_turn(session, image, edit_instr, ref_image=ref_img, user_id=st.session_state.user_id)
+                    if result.image:
+                        st.success("Saved to Gallery!")
+                        st.rerun(scope="fragment")
+                    else:
+                        st.error("No image returned.")
+                elif engine:
+                    request = engine.remix_request(image, original_prompt, edit_instr, ref_image=ref_img)
+                    result = engine.generate(request, user_id=st.session_state.user_id)
                     
-                    if generated_pil:
+                    if result.image:
                          # Save
-                         res_buffer = BytesIO()
-                         generated_pil.save(res_buffer, format="PNG")
-                         b64_res = base64.b64encode(res_buffer.getvalue()).decode('utf-8')
-                         
-                         db.add_gallery_item(st.session_state.user_id, category_type, f"Remix: {edit_instr}", b64_res)
+                         engine.save(st.session_state.user_id, category_type, f"Remix: {edit_instr}", result.image)
                          st.success("Saved to Gallery!")
                          st.rerun()
                     else:
@@ -217,10 +208,10 @@ def render_edit_dialog(image, original_prompt, category_type='apparel'):
 
 # GenAI Client
 api_key = os.getenv("GOOGLE_API_KEY") 
+ADMIN_USER = os.getenv("ADMIN_USER")  # Studio allowed to set every studio's retention policy
 
 try:
     from google import genai
-    from google.genai import types
     from google.genai.types import HttpOptions
     
     if api_key:
@@ -236,6 +227,51 @@ except ImportError:
     st.error("`google-genai` library not installed. Please install it.")
     client = None
 
+# Studio Engine (shared with the headless tools)
+engine = StudioEngine(GeminiBackend(client), gate=QualityGate.from_env()) if client else None
+
+# Metrics endpoint (Prometheus text format), opt-in
+if os.getenv("METRICS_PORT"):
+    tracing.start_metrics_server(int(os.getenv("METRICS_PORT")))
+
+# Scheduled online backups, opt-in
+if os.getenv("BACKUP_EVERY_H") and not storage.is_postgres():
+    backup.start_scheduler(float(os.getenv("BACKUP_EVERY_H")) * 3600)
+
+def record_stage(stage, latency, cost):
+    """Accumulate latency/cost for the draft and final stages in the session."""
+    if "stage_metrics" not in st.session_state:
+        st.session_state.stage_metrics = {}
+    m = st.session_state.stage_metrics.setdefault(stage, {"renders": 0, "latency": 0.0, "cost": 0.0})
+    m["renders"] += 1
+    m["latency"] += latency
+    m["cost"] += cost
+
+def session_id():
+    """Streamlit's id for the browser session running this script."""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "local"
+
+def download_all(items, prefix, file_name, key):
+    """Download All: the ZIP is written to a static file on request and linked; no archive bytes stay in the session."""
+    fingerprint = hash(tuple(item['id'] for item in items))
+    built = st.session_state.get(key)
+    if built and built[0] == fingerprint and static_assets.download_available(built[1]):
+        st.markdown(static_assets.download_link(built[1], file_name, "Download All"), unsafe_allow_html=True)
+    elif st.button("Prepare ZIP", key=f"{key}_build", use_container_width=True):
+        with st.spinner("Packing archive..."):
+            st.session_state[key] = (fingerprint, static_assets.publish_archive(items, prefix))
+        st.rerun()
+
+def tile_download(item, file_name, key):
+    """Per-tile download: the full image is only read and published once the link is asked for."""
+    if st.session_state.get("download_ready") == item['id']:
+        st.markdown(static_assets.download_link(static_assets.full_url('gallery', item), file_name), unsafe_allow_html=True)
+    elif st.button("⬇", key=key, help="Download"):
+        st.session_state.download_ready = item['id']
+        st.rerun()
+
 # Styles
 st.markdown("""
 <style>
@@ -330,6 +366,30 @@ st.markdown("""
         margin-bottom: 10px;
         text-align: center;
     }
+    .tile-img {
+        width: 100%;
+        display: block;
+        margin-bottom: 5px;
+    }
+    .preview-img {
+        width: 100%;
+        display: block;
+    }
+    .dl-link {
+        display: block;
+        text-align: center;
+        border: 1px solid var(--accent-color);
+        color: var(--text-color) !important;
+        text-decoration: none !important;
+        text-transform: uppercase;
+        letter-spacing: 0.1em;
+        font-size: 0.8em;
+        padding: 6px 0;
+    }
+    .dl-link:hover {
+        background-color: var(--accent-color);
+        color: var(--bg-color) !important;
+    }
     .asset-img {
         width: 100%;
         height: 150px;
@@ -373,6 +433,106 @@ with st.sidebar.expander("ADMIN CONSOLE", expanded=False):
     else:
         st.info("No users yet.")
 
+    st.caption("Pipeline Timings (mean per phase)")
+    phase_stats = tracing.REGISTRY.summary()
+    if phase_stats:
+        for label, stat in sorted(phase_stats.items()):
+            st.caption(f"{label}: {stat['mean_s'] * 1000:.0f} ms × {stat['count']}")
+    else:
+        st.caption("No traced requests yet.")
+
+    st.caption("Generation Ledger")
+    ledger = db.get_generation_stats()
+    if ledger["models"]:
+        for m in ledger["models"]:
+            p95 = f"{m['p95_latency']:.1f}s" if m['p95_latency'] is not None else "-"
+            st.caption(f"{m['model']}: {m['calls']} calls | p95 {p95} | failures {m['failure_rate']:.0%}")
+        for s in ledger["studios"]:
+            st.caption(f"{s['username'] or 'headless'}: ${s['spend']:.2f} over {s['calls']} calls")
+        for f in ledger["flows"]:
+            st.caption(f"{f['flow']} prompt: {f['avg_tokens']:.0f} tokens avg | {f['max_tokens']} max over {f['calls']} calls")
+    else:
+        st.caption("No generations recorded yet.")
+
+    st.caption("Storage")
+    for studio, total in maintenance.usage_by_studio(maintenance.storage_usage()).items():
+        st.caption(f"{studio}: {total['items']} items | {total['bytes'] / 1e6:.1f} MB")
+    page_stats = db.get_page_stats()
+    if page_stats:
+        st.caption(f"studio.db: {page_stats['file_bytes'] / 1e6:.1f} MB, "
+                   f"{page_stats['freelist_count'] * page_stats['page_size'] / 1e6:.1f} MB free pages")
+    # Studios manage their own retention; only ADMIN_USER may set other studios' policies
+    is_admin = bool(ADMIN_USER) and st.session_state.studio_name == ADMIN_USER
+    ret_users = all_users if is_admin else [u for u in all_users if u['username'] == st.session_state.studio_name]
+    if ret_users:
+        policies = {p['user_id']: p for p in db.get_retention_policies()}
+        ret_user = st.selectbox("Retention for", ret_users, format_func=lambda u: u['username'], key="ret_user")
+        current = policies.get(ret_user['id'], {})
+        ret_c1, ret_c2 = st.columns(2)
+        with ret_c1:
+            keep_last = st.number_input("Keep last N", min_value=0, value=current.get('keep_last') or 0, step=50,
+                                        key=f"ret_last_{ret_user['id']}", help="Per category. 0 = no limit.")
+        with ret_c2:
+            keep_days = st.number_input("Keep days", min_value=0, value=current.get('keep_days') or 0, step=30,
+                                        key=f"ret_days_{ret_user['id']}", help="0 = no limit.")
+        if st.button("Save Policy", key="ret_save", use_container_width=True):
+            db.set_retention_policy(ret_user['id'], keep_last or None, keep_days or None)
+            st.success("Policy saved. Older shoots are archived on the next maintenance run.")
+    # Archiving, sweeping and vacuuming are destructive: they run from cron, not from a session
+    st.caption("Archive/vacuum runs: `python maintenance.py`"
+               + (" (once with `--enable-incremental-vacuum`)" if page_stats and page_stats['auto_vacuum'] != 2 else ""))
+    for run in db.get_maintenance_runs(3):
+        reclaimed = (run['vacuum_bytes'] + run['orphan_bytes']) / 1e6
+        st.caption(f"{run['started_at'][:16]}: {run['archived_items']} archived | {reclaimed:.1f} MB reclaimed")
+
+    if not storage.is_postgres():
+        st.caption(f"Backups (keep {backup.BACKUP_KEEP})")
+        if st.button("Backup Now", key="backup_now", use_container_width=True):
+            with st.spinner("Snapshotting..."):
+                result = backup.create_backup()
+            if result.status == "ok":
+                st.success(result.summary())
+            else:
+                st.error(result.summary())
+        for run in db.get_backup_runs(3):
+            st.caption(f"{run['name']}: {run['status']} | {run['db_bytes'] / 1e6:.1f} MB | {run['seconds']:.1f}s"
+                       + (f" | {run['restarts']} restarts" if run['restarts'] else ""))
+
+    st.caption(f"Memory: process RSS {memory_budget.process_rss() / 1e6:.0f} MB | "
+               f"budget {memory_budget.SESSION_MEM_BUDGET / 1e6:.0f} MB per session")
+    for s in memory_budget.REGISTRY.sessions():
+        top = ", ".join(f"{key} {size / 1e6:.1f}" for key, size in s['top'] if size >= 100_000)
+        st.caption(f"{s['user'] or 'login'} [{s['session'][:8]}]: {s['bytes'] / 1e6:.1f} MB"
+                   + (f" ({top})" if top else "") + (" ⚠️ over budget" if s['over_budget'] else "")
+                   + (f" | {s['released']} released" if s['released'] else ""))
+    profiling = st.toggle("Allocation Profiling", value=memory_budget.is_profiling(), key="tracemalloc",
+                          help="tracemalloc: slows every allocation while on.")
+    if profiling and not memory_budget.is_profiling():
+        memory_budget.start_profiling()
+    elif not profiling and memory_budget.is_profiling():
+        memory_budget.stop_profiling()
+    if profiling and st.button("Take Snapshot", key="mem_snapshot", use_container_width=True):
+        snap = memory_budget.snapshot()
+        st.caption(f"Traced {snap['traced'] / 1e6:.1f} MB (peak {snap['peak'] / 1e6:.1f} MB)")
+        for site, size, count in snap["top"]:
+            st.caption(f"{os.path.basename(site)}: {size / 1e6:.1f} MB in {count} blocks")
+        for site, delta in snap["growth"]:
+            st.caption(f"📈 {os.path.basename(site)}: +{delta / 1e6:.1f} MB since last snapshot")
+
+    if db.DB_PROFILE:
+        st.caption(f"DB Query Profile (slow > {db.SLOW_QUERY_MS:.0f} ms)")
+        profile = db.PROFILER.snapshot()
+        for fn, stat in sorted(profile["functions"].items(), key=lambda kv: -kv[1]["total_s"]):
+            st.caption(f"{fn}: {stat['calls']} calls | avg {stat['total_s'] / stat['calls'] * 1000:.1f} ms | "
+                       f"max {stat['max_s'] * 1000:.1f} ms | {stat['rows']} rows | {stat['bytes'] / 1e6:.1f} MB")
+        for q in reversed(profile["slow_queries"][-5:]):
+            st.caption(f"🐢 {q['function']} {q['ms']} ms: {q['sql'][:80]}")
+        for sql, plan in profile["full_scans"].items():
+            st.caption(f"⚠️ Full scan ({'; '.join(plan)}): {sql[:80]}")
+        if st.button("Reset DB Profile"):
+            db.PROFILER.reset()
+            st.rerun()
+
 st.sidebar.markdown("---")
 st.sidebar.caption("© 2025 Steven Lansangan")
 
@@ -393,7 +553,7 @@ def render_model_tab(tab_name):
                     face_b64 = image_to_base64(face_file)
                     body_b64 = image_to_base64(body_file)
                     
-                    db.add_model(st.session_state.user_id, new_name, face_b64, body_b64)
+                    db.add_model(st.session_state.user_id, new_name, face_b64, body_b64, phash=dhash_b64(face_b64), palette=palette_b64(body_b64))
                     st.success("Saved.")
                     st.rerun()
                 else:
@@ -425,12 +585,29 @@ def render_asset_tab(tab_name, category_code, label_singular):
             if st.button(f"Save {label_singular}", key=f"save_{category_code}"):
                 if new_name and new_file:
                     b64 = image_to_base64(new_file)
-                    db.add_asset(st.session_state.user_id, category_code, new_name, b64)
+                    db.add_asset(st.session_state.user_id, category_code, new_name, b64, phash=dhash_b64(b64), palette=palette_b64(b64))
                     st.success("Saved.")
                     st.rerun()
                 else:
                     st.error("Name and Image required.")
 
+        # Bulk Import
+        with st.expander(f"Bulk Import {label_singular}s (ZIP)", expanded=False):
+            st.caption("ZIP of images. Names come from file names, or from a CSV inside the ZIP with filename,name columns.")
+            zip_file = st.file_uploader("Archive", type=['zip'], key=f"zip_{category_code}")
+            if st.button("Import All", key=f"import_{category_code}") and zip_file:
+                try:
+                    with st.spinner("Importing..."):
+                        report = vault_import.import_files(st.session_state.user_id, category_code,
+                                                           vault_import.iter_zip(zip_file.getvalue()))
+                    st.success(report.summary())
+                    for filename, reason in report.duplicates:
+                        st.caption(f"Skipped {filename}: {reason}")
+                    for filename, message in report.errors:
+                        st.warning(f"{filename}: {message}")
+                except Exception as e:
+                    st.error(f"Import error: {e}")
+
         # List
         st.markdown(f"#### Existing {label_singular}s")
         if not assets:
@@ -459,7 +636,16 @@ models = db.get_models(st.session_state.user_id)
 apparel = db.get_assets(st.session_state.user_id, "closet")
 locations = db.get_assets(st.session_state.user_id, "location")
 
-def selection_card(col, title, assets, key_prefix):
+def rank_by_palette(assets, reference):
+    """Reorder vault rows by colour similarity to the reference asset. Returns (rows, {id: score})."""
+    if not reference or not reference.get('palette') or not assets:
+        return assets, {}
+    ranked = PaletteIndex.from_rows(assets).rank(reference['palette'])
+    scores = dict(ranked)
+    by_id = {a['id']: a for a in assets}
+    return [by_id[i] for i, _ in ranked] + [a for a in assets if a['id'] not in scores], scores
+
+def selection_card(col, title, assets, key_prefix, scores=None):
     selected = None
     with col:
         st.markdown(f"### {title}")
@@ -471,9 +657,11 @@ def selection_card(col, title, assets, key_prefix):
             asset_data = next((a for a in assets if a['name'] == choice), None)
             if asset_data:
                 selected = asset_data
-                img = base64_to_image(asset_data['image_base64'])
-                if img:
-                    st.image(img, use_container_width=True)
+                url = static_assets.thumbnail_url('assets', asset_data)
+                if url:
+                    st.markdown(static_assets.img_tag(url, choice), unsafe_allow_html=True)
+                if scores and asset_data['id'] in scores:
+                    st.caption(f"Palette match: {scores[asset_data['id']]:.0%}")
         else:
             st.markdown(f"""
             <div style="height:200px; border:1px dashed #333; display:flex; align-items:center; justify-content:center; color:#555;">
@@ -483,7 +671,7 @@ def selection_card(col, title, assets, key_prefix):
             
     return selected
 
-def selection_card_model(col, title, assets):
+def selection_card_model(col, title, assets, scores=None):
     selected = None
     with col:
         st.markdown(f"### {title}")
@@ -495,12 +683,13 @@ def selection_card_model(col, title, assets):
             asset_data = next((a for a in assets if a['name'] == choice), None)
             if asset_data:
                 selected = asset_data
-                # Display logic: Prefer Face Ref, fallback to old image_base64
-                img_key = 'face_base64' if 'face_base64' in asset_data else 'image_base64'
-                if img_key in asset_data:
-                    img = base64_to_image(asset_data[img_key])
-                    if img:
-                        st.image(img, use_container_width=True)
+                # Display logic: Prefer Face Ref, fallback to Body Ref
+                img_key = 'face_base64' if asset_data.get('face_base64') else 'body_base64'
+                url = static_assets.thumbnail_url('models', asset_data, img_key)
+                if url:
+                    st.markdown(static_assets.img_tag(url, choice), unsafe_allow_html=True)
+                if scores and asset_data['id'] in scores:
+                    st.caption(f"Palette match: {scores[asset_data['id']]:.0%}")
         else:
             st.markdown(f"""
             <div style="height:200px; border:1px dashed #333; display:flex; align-items:center; justify-content:center; color:#555;">
@@ -514,10 +703,19 @@ main_tab1, main_tab2 = st.tabs(["Apparel Shoot", "Accessories"])
 
 with main_tab1:
     # -- Selection Row --
+    palette_match = st.toggle("Match to Apparel", key="palette_match", help="Order models and locations by colour palette similarity to the selected apparel.")
     col_m, col_a, col_l = st.columns(3)
-    selected_model = selection_card_model(col_m, "MODEL", models)
+    # Apparel first: it is the reference the other two are ranked against
     selected_apparel = selection_card(col_a, "APPAREL", apparel, "apparel")
-    selected_location = selection_card(col_l, "LOCATION", locations, "location")
+    model_scores, location_scores = {}, {}
+    if palette_match and selected_apparel:
+        fill_missing_palettes(apparel, 'assets', 'image_base64')
+        fill_missing_palettes(locations, 'assets', 'image_base64')
+        fill_missing_palettes(models, 'models', 'body_base64')
+        locations, location_scores = rank_by_palette(locations, selected_apparel)
+        models, model_scores = rank_by_palette(models, selected_apparel)
+    selected_model = selection_card_model(col_m, "MODEL", models, model_scores)
+    selected_location = selection_card(col_l, "LOCATION", locations, "location", location_scores)
 
     st.markdown("---")
 
@@ -525,30 +723,52 @@ with main_tab1:
     st.markdown("### CREATIVE BRIEF")
     user_prompt = st.text_area("Enter your vision...", height=100, placeholder="E.g., High fashion portrait, dynamic pose, moody lighting...")
     ref_image = st.file_uploader("Moodboard (Optional)", type=['png', 'jpg', 'jpeg'], key="cruella_ref")
+    ref_bytes = ref_image.getvalue() if ref_image else None
     
     # Session State for Planned Shots
     if "shot_plan" not in st.session_state:
         st.session_state.shot_plan = ["", "", ""]
 
+    # Speculative Planning: start Cruella in the background while the brief settles
+    speculative_mode = st.toggle("Speculative Planning", key="spec_mode", help="Plan in the background while you edit. Superseded runs are counted as wasted calls.")
+    if "spec_planner" not in st.session_state:
+        st.session_state.spec_planner = SpeculativePlanner(engine, user_id=st.session_state.user_id) if engine else None
+    spec_planner = st.session_state.spec_planner
+
+    if spec_planner:
+        if speculative_mode and (user_prompt or ref_bytes):
+            spec_planner.submit(user_prompt, ref_bytes)
+        elif not speculative_mode:
+            spec_planner.cancel()
+        if speculative_mode:
+            spec_stats = spec_planner.stats
+            st.caption(f"Speculative: {spec_stats['api_calls']} calls | {spec_stats['adopted']} adopted | {spec_stats['wasted']} wasted | {spec_stats['cancelled']} debounced")
+
     if st.button("✨ AUTO-PLAN CAMPAIGN (Cruella Mode)", help="Let Cruella analyze your brief & moodboard", use_container_width=True):
         if not user_prompt and not ref_image:
              st.error("Please enter a vision or upload a moodboard.")
         else:
-             with st.status("Cruella is analyzing your vision...", expanded=True) as status:
+             with st.status("Cruella is analyzing your vision...", expanded=True) as status, tracing.trace("plan", user=st.session_state.studio_name):
                   st.write("Reading brief & analyzing visuals...")
                   st.write("Designing high-fashion campaign structure...")
                   
-                  # Handle Image
-                  pil_image = None
-                  if ref_image:
-                      pil_image = Image.open(ref_image)
+                  # Adopt the background result if it matches the current inputs
+                  generated_shots = None
+                  if speculative_mode and spec_planner:
+                      generated_shots = spec_planner.adopt(user_prompt, ref_bytes)
                   
-                  # Campaign Planning Execution
-                  try:
-                      generated_shots = ShotListGenerator.generate_shot_list(client, user_prompt, image=pil_image, min_count=3)
-                  except Exception as e:
-                      st.error(f"Planning Error: {e}")
-                      generated_shots = [{"description": user_prompt}] # Fallback
+                  if generated_shots is None:
+                      # Handle Image
+                      pil_image = None
+                      if ref_image:
+                          pil_image = Image.open(ref_image)
+                      
+                      # Campaign Planning Execution
+                      try:
+                          generated_shots = engine.plan(user_prompt, image=pil_image, min_count=3, user_id=st.session_state.user_id)
+                      except Exception as e:
+                          st.error(f"Planning Error: {e}")
+                          generated_shots = [{"description": user_prompt}] # Fallback
                   
                   # Extract descriptions for the text areas
                   briefs = [shot['description'] for shot in generated_shots]
@@ -605,18 +825,17 @@ with main_tab1:
     selected_ar = ar_map[aspect_ratio]
 
     # Cost Calculation
-    cost_map = {
-        "Standard (1K)": "~$0.14",
-        "Pro (2K)": "~$0.14", 
-        "Ultra (4K)": "~$0.25"
-    }
-    est_cost = cost_map[resolution]
+    image_size = RESOLUTION_SIZES[resolution]
 
     with act_col:
         st.markdown("<div style='height: 24px'></div>", unsafe_allow_html=True) # Spacer
+        draft_mode = st.toggle("Draft First", key="draft_mode", help="Render fast low-res drafts, then promote the keepers to a final render.")
+        variants = st.number_input("Variants per Shot", min_value=1, max_value=4, value=1, key="variants", help="Candidates per shot. Requested in one call where the model supports it.")
         if st.button("INITIATE SHOOT", use_container_width=True):
-            st.caption(f"Est: {est_cost}x3 | {selected_ar} | {resolution.split('(')[1][:-1]}")
-            if not client:
+            planned_count = len([b for b in st.session_state.shot_plan if b]) * variants
+            stage_cost = COST_PER_IMAGE["draft"] if draft_mode else COST_PER_IMAGE[image_size]
+            st.caption(f"Est: ${stage_cost * planned_count:.2f} ({planned_count} shots) | {selected_ar} | {'Draft' if draft_mode else image_size}")
+            if not engine:
                 st.error("AI Client not initialized.")
             elif not user_prompt:
                 st.error("Please provide a prompt.")
@@ -626,25 +845,18 @@ with main_tab1:
                 with st.spinner("Compiling scene..."):
                     try:
                         # Prep Images
-                        # Using global load_and_resize
-                        model_face_img = None
-                        model_body_img = None
-                        
-                        if selected_model:
-                            if 'face_base64' in selected_model and 'body_base64' in selected_model:
-                                 # Generation needs slightly larger limits (800 or 1024)
-                                 model_face_img = load_and_resize(selected_model['face_base64'], (800, 800))
-                                 model_body_img = load_and_resize(selected_model['body_base64'], (800, 800))
-                            elif 'image_base64' in selected_model:
-                                 # Legacy fallback
-                                 model_body_img = load_and_resize(selected_model['image_base64'], (800, 800))
-                        
-                        
-                        apparel_img = load_and_resize(selected_apparel['image_base64'], (800, 800))
-                        location_img = load_and_resize(selected_location['image_base64'], (800, 800)) if selected_location else None
+                        with tracing.trace("shoot_prep", user=st.session_state.studio_name):
+                            refs = ShootRefs.from_assets(selected_model, selected_apparel, selected_location)
+
+                        # All candidates of this run link back to one campaign
+                        campaign_id = db.create_campaign(st.session_state.user_id, user_prompt)
+
+                        # Drafts keep their prompt & references so a promotion re-renders the same shot
+                        if draft_mode:
+                            st.session_state.draft_batch = {"campaign_id": campaign_id, "drafts": []}
 
                         # Results Grid
-                        st.markdown("### SERIES RESULTS")
+                        st.markdown("### DRAFT RESULTS" if draft_mode else "### SERIES RESULTS")
                         
                         # Dynamic Results Grid
                         # We'll create columns dynamically or use a wrapping logic?
@@ -653,6 +865,8 @@ with main_tab1:
                         
                         total_shots = len(st.session_state.shot_plan)
                         cols_per_row = 3
+                        # Quality-gate retries are shared by the whole campaign
+                        retry_budget = engine.gate.budget(total_shots * variants) if engine.gate else None
                         
                         # Loop through all planned shots
                         for i in range(total_shots):
@@ -664,7 +878,7 @@ with main_tab1:
                             
                             with current_row_cols[col_idx]:
                                 st.markdown(f"**Shot {i+1}**")
-                                with st.spinner(f"Generating..."):
+                                with st.spinner(f"Generating..."), tracing.trace("shoot", user=st.session_state.studio_name, shot=i + 1, model=DRAFT_MODEL if draft_mode else IMAGE_MODEL):
                                     # Select Payload
                                     current_brief = st.session_state.shot_plan[i]
                                     
@@ -673,94 +887,42 @@ with main_tab1:
                                         st.warning("Skipped (Empty)")
                                         continue
 
-                                    # Construct Payload manually using the brief as Subject
-                                    # We disable auto-variation since the brief is now explicit
-                                    style_text = selected_style.prompt_modifier
-                                    if selected_location:
-                                         style_text += " IGNORE STYLE ENVIRONMENT. USE LOCATION IMAGE BACKGROUND."
-                                    
-                                    final_prompt_optimized = (
-                                        f"STRICT INSTRUCTION: {PromptGenerator.MASTER_BASE_PROMPT} "
-                                        f"Aspect Ratio: {selected_ar}. "
-                                        f"Subject: {current_brief}. "
-                                        f"Style Guide: {style_text} "
-                                        f"Exclude: {PromptGenerator.NEGATIVE_PROMPT}"
-                                    )
-                        
-                                    # Fidelity checks
-                                    final_prompt_optimized += "\\n\\nVISUAL MAPPING:"
-                                    img_count = 1
-                                    
-                                    if model_face_img:
-                                        final_prompt_optimized += f"\\n- Image {img_count}: MODEL FACE REF. PRIORITY: CRITICAL IDENTITY PRESERVATION. The output face must be indistinguishable from this reference. strict Carbon-Copy. Do NOT 'beautify', 'optimize', or 'average' the features. Maintain exact eye shape, nose structure, and facial landmarks."
-                                        img_count += 1
-                                    
-                                    if model_body_img:
-                                        final_prompt_optimized += f"\\n- Image {img_count}: MODEL BODY REF. Use this for body proportions and pose. Ensure natural anatomical connection to the head."
-                                        img_count += 1
-                                        
-                                    if apparel_img:
-                                        final_prompt_optimized += f"\\n- Image {img_count}: APPAREL REF. PRIORITY: TEXTURE & CUT FIDELITY. However, the FIT must be realistic. The fabric should fold, crease, and hang according to the model's pose and gravity. Do not make it look like a sticker. It must wrap around the 3D form."
-                                        img_count += 1
-                                    if location_img:
-                                        final_prompt_optimized += f"\\n- Image {img_count}: LOCATION REF. Use this background. Integrate the subject with matching lighting and shadows."
-                                        img_count += 1
-                                    
-                                    final_prompt_optimized += "\\n\\nFINAL INSTRUCTION: NATURAL CONSISTENCY ALL THE TIME."
-                                    final_prompt_optimized += "\\n1. The Reference Face MUST match the Output Face."
-                                    final_prompt_optimized += "\\n2. The Reference Apparel MUST match the Output Apparel."
-                                    final_prompt_optimized += "\\n3. Lighting must be coherent across Model, Clothes, and Background."
-
-                                    # Request
-                                    # Input list for the model (Text + Images)
-                                    contents = [final_prompt_optimized]
-                                    if model_face_img: contents.append(model_face_img)
-                                    if model_body_img: contents.append(model_body_img)
-                                    if apparel_img: contents.append(apparel_img)
-                                    if location_img: contents.append(location_img)
+                                    # Construct Payload using the brief as Subject
+                                    if draft_mode:
+                                        request = engine.shoot_request(current_brief, selected_style, selected_ar, refs, model=DRAFT_MODEL, candidate_count=variants)
+                                    else:
+                                        request = engine.shoot_request(current_brief, selected_style, selected_ar, refs, image_size=image_size, candidate_count=variants)
 
                                     # Call API
-                                    response = client.models.generate_content(
-                                        model='gemini-3-pro-image-preview',
-                                        contents=contents,
-                                        config={
-                                            'aspect_ratio': selected_ar, 
-                                            'safety_settings': [types.SafetySetting(
-                                                category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                                                threshold="BLOCK_ONLY_HIGH"
-                                            )]
-                                        }
-                                    )
-                                    
-                                    # Process response (Gemini 3 returns image in parts)
-                                    generated_pil = None
-                                    
-                                    if response.parts:
-                                        for part in response.parts:
-                                            if part.inline_data:
-                                                try:
-                                                    if isinstance(part.inline_data.data, bytes):
-                                                        generated_pil = Image.open(BytesIO(part.inline_data.data))
-                                                    else:
-                                                        # Decode base64 if needed
-                                                        image_data = base64.b64decode(part.inline_data.data)
-                                                        generated_pil = Image.open(BytesIO(image_data))
-                                                    break
-                                                except Exception as img_err:
-                                                     st.error(f"Failed to decode output: {img_err}")
-                                            elif hasattr(part, 'text') and part.text and "http" in part.text:
-                                                st.warning("Received link instead of image: " + part.text)
+                                    result = engine.generate(request, user_id=st.session_state.user_id, budget=retry_budget)
+                                    generated, latency, notes = result.images, result.latency, result.notes
+                                    # Rejected frames were billed too
+                                    if draft_mode:
+                                        record_stage("draft", latency, COST_PER_IMAGE["draft"] * (len(generated) + result.rejected))
+                                    else:
+                                        record_stage("final", latency, COST_PER_IMAGE[image_size] * (len(generated) + result.rejected))
+
+                                    for note in notes:
+                                        st.warning(note)
                                     
-                                    if generated_pil:
+                                    if generated and draft_mode:
+                                        st.success(f"DRAFT READY ({latency:.1f}s)")
+                                        for v, generated_pil in enumerate(generated):
+                                            st.image(generated_pil, caption=f"Draft {i+1}" + (f".{v+1}" if len(generated) > 1 else ""), use_container_width=True)
+                                            # The contact sheet references a static file; no PNG bytes kept in the session
+                                            st.session_state.draft_batch["drafts"].append({
+                                                "shot": i + 1,
+                                                "brief": current_brief,
+                                                "request": request,
+                                                "url": static_assets.publish_bytes(pil_to_png_bytes(generated_pil))
+                                            })
+                                    elif generated:
                                         st.success("SHOOT COMPLETE")
-                                        st.image(generated_pil, caption=f"Shot {i+1}", use_container_width=True)
-                                        
-                                        # Save to Gallery
-                                        res_buffer = BytesIO()
-                                        generated_pil.save(res_buffer, format="PNG")
-                                        b64_res = base64.b64encode(res_buffer.getvalue()).decode('utf-8')
-                                        
-                                        db.add_gallery_item(st.session_state.user_id, 'apparel', f"{current_brief[:100]}", b64_res)
+                                        for v, generated_pil in enumerate(generated):
+                                            st.image(generated_pil, caption=f"Shot {i+1}" + (f".{v+1}" if len(generated) > 1 else ""), use_container_width=True)
+                                            
+                                            # Save to Gallery
+                                            engine.save(st.session_state.user_id, 'apparel', f"{current_brief[:100]}", generated_pil, campaign_id=campaign_id)
                                         
                                     else:
                                         st.error("Frame failed.")
@@ -768,6 +930,63 @@ with main_tab1:
                     except Exception as e:
                         st.error(f"Generation failed: {str(e)}")
 
+    # -- Draft Contact Sheet --
+    draft_batch = st.session_state.get("draft_batch")
+    if draft_batch and draft_batch["drafts"]:
+        st.markdown("---")
+        st.markdown("### DRAFT CONTACT SHEET")
+        st.caption(f"Select drafts to promote to a final {image_size} render (~${COST_PER_IMAGE[image_size]:.2f} each). Same brief & references.")
+
+        drafts = draft_batch["drafts"]
+        promote_idx = []
+        for i in range(0, len(drafts), 3):
+            cols = st.columns(3)
+            for j, draft in enumerate(drafts[i:i+3]):
+                with cols[j]:
+                    st.markdown(static_assets.img_tag(draft["url"], f"Draft {draft['shot']}"), unsafe_allow_html=True)
+                    st.caption(f"Draft {draft['shot']}")
+                    # Keyed by batch too: a new draft batch must not inherit the previous batch's ticks
+                    if st.checkbox("Promote", key=f"promote_{draft_batch['campaign_id']}_{i + j}"):
+                        promote_idx.append(i + j)
+
+        pr_col1, pr_col2 = st.columns([3, 1])
+        with pr_col1:
+            if st.button(f"PROMOTE SELECTED ({len(promote_idx)}) TO {image_size}", use_container_width=True, disabled=not promote_idx):
+                if not engine:
+                    st.error("AI Client not initialized.")
+                else:
+                    for idx in promote_idx:
+                        draft = drafts[idx]
+                        with st.spinner(f"Final render: Shot {draft['shot']}..."), tracing.trace("promote", user=st.session_state.studio_name, shot=draft['shot'], model=IMAGE_MODEL):
+                            try:
+                                # Same prompt & references, final model and size
+                                final_request = replace(draft["request"], model=IMAGE_MODEL, image_size=image_size, candidate_count=1)
+                                result = engine.generate(final_request, user_id=st.session_state.user_id)
+                                record_stage("final", result.latency, COST_PER_IMAGE[image_size] * (1 + result.rejected))
+                                for note in result.notes:
+                                    st.warning(note)
+                                if result.image:
+                                    engine.save(st.session_state.user_id, 'apparel', f"{draft['brief'][:100]}", result.image, campaign_id=draft_batch.get("campaign_id"))
+                                else:
+                                    st.error(f"Shot {draft['shot']}: Frame failed.")
+                            except Exception as e:
+                                st.error(f"Shot {draft['shot']}: Final render failed: {e}")
+                    st.rerun()
+        with pr_col2:
+            if st.button("DISCARD DRAFTS", use_container_width=True):
+                del st.session_state.draft_batch
+                st.rerun()
+
+    # Stage Metrics
+    stage_metrics = st.session_state.get("stage_metrics")
+    if stage_metrics:
+        parts = []
+        for stage in ("draft", "final"):
+            m = stage_metrics.get(stage)
+            if m and m["renders"]:
+                parts.append(f"{stage.upper()}: {m['renders']} renders | avg {m['latency'] / m['renders']:.1f}s | ${m['cost']:.2f}")
+        st.caption("  ·  ".join(parts))
+
     # Gallery
     st.markdown("---")
     # Header & Download All
@@ -780,23 +999,11 @@ with main_tab1:
     with gh_col2:
         if gallery:
             try:
-                zip_buffer = BytesIO()
-                with zipfile.ZipFile(zip_buffer, "w") as zf:
-                    for idx, item in enumerate(gallery):
-                        img_data = base64.b64decode(item['image_base64'])
-                        zf.writestr(f"shoot_{idx}_{item['timestamp'][:10]}.png", img_data)
-                
                 # Action Buttons Layout (Side by Side)
                 st.markdown("<div style='height: 5px'></div>", unsafe_allow_html=True) # visual alignment
                 dl_col, clr_col = st.columns([1, 1])
                 with dl_col:
-                    st.download_button(
-                        label="Download All",
-                        data=zip_buffer.getvalue(),
-                        file_name=f"ella_portfolio_{st.session_state.studio_name}.zip",
-                        mime="application/zip",
-                        use_container_width=True
-                    )
+                    download_all(gallery, "shoot", f"ella_portfolio_{st.session_state.studio_name}.zip", "zip_apparel")
                 with clr_col:
                     if st.button("CLEAR", help="Wipe Archive", use_container_width=True):
                         db.clear_gallery(st.session_state.user_id, 'apparel')
@@ -805,44 +1012,97 @@ with main_tab1:
             except Exception as e:
                 st.error(f"Zip error: {e}")
 
+    # Search (prompts & campaign briefs) and date range, paged server-side
+    grid_items = gallery
     if gallery:
+        sq_col, sd_col = st.columns([3, 2])
+        with sq_col:
+            search_query = st.text_input("Search Archive", placeholder="Search prompts & briefs, e.g. red silk dress", key="gallery_search", label_visibility="collapsed")
+        with sd_col:
+            search_dates = st.date_input("Date Range", value=(), key="gallery_dates", label_visibility="collapsed")
+        date_from = search_dates[0] if len(search_dates) > 0 else None
+        date_to = search_dates[1] if len(search_dates) > 1 else date_from
+
+        if search_query.strip() or date_from:
+            filter_key = (search_query, date_from, date_to)
+            if st.session_state.get("gallery_filter") != filter_key:
+                st.session_state.gallery_filter = filter_key
+                st.session_state.gallery_page = 0
+            page = st.session_state.get("gallery_page", 0)
+            grid_items, total = db.search_gallery(st.session_state.user_id, search_query, category='apparel',
+                                                  date_from=date_from, date_to=date_to,
+                                                  limit=GALLERY_PAGE_SIZE, offset=page * GALLERY_PAGE_SIZE)
+            pages = max(1, -(-total // GALLERY_PAGE_SIZE))
+            pg_c1, pg_c2, pg_c3 = st.columns([1, 3, 1])
+            with pg_c1:
+                if st.button("◀", key="gallery_prev", disabled=page == 0, use_container_width=True):
+                    st.session_state.gallery_page = page - 1
+                    st.rerun()
+            with pg_c2:
+                st.caption(f"{total} matches · page {page + 1} of {pages}")
+            with pg_c3:
+                if st.button("▶", key="gallery_next", disabled=page + 1 >= pages, use_container_width=True):
+                    st.session_state.gallery_page = page + 1
+                    st.rerun()
+
+    # Near-duplicate views (perceptual-hash index)
+    dupe_counts = {}
+    similar_to = st.session_state.get("similar_to")
+    if gallery and similar_to:
+        hash_index = HashIndex.for_gallery(st.session_state.user_id, 'apparel')
+        matches = hash_index.similar_to_item(similar_to)
+        grid_items = db.get_gallery_items([similar_to] + [item_id for item_id, _ in matches])
+        sim_c1, sim_c2 = st.columns([4, 1])
+        with sim_c1:
+            st.caption(f"{len(matches)} shots similar to the selected frame")
+        with sim_c2:
+            if st.button("Show All", key="clear_similar", use_container_width=True):
+                st.session_state.similar_to = None
+                st.rerun()
+    elif gallery and st.toggle("Collapse Duplicates", key="collapse_dupes", help="Show one frame per group of near-identical re-rolls."):
+        hash_index = HashIndex.for_gallery(st.session_state.user_id, 'apparel')
+        known = dict(zip(hash_index.ids.tolist(), hash_index.hashes.tolist()))
+        hashed_ids = [item['id'] for item in grid_items if item['id'] in known]
+        groups = HashIndex(hashed_ids, [known[i] for i in hashed_ids]).collapse(DUPLICATE_DISTANCE)
+        grid_items = [item for item in grid_items if item['id'] in groups or item['id'] not in known]
+        dupe_counts = {rep: len(dupes) for rep, dupes in groups.items() if dupes}
+
+    if grid_items:
         # SCROLLABLE GALLERY CONTAINER
         with st.container(height=600):
             # Grid Layout: Iterate in batches of 3
-            for i in range(0, len(gallery), 3):
+            for i in range(0, len(grid_items), 3):
                 cols = st.columns(3)
-                batch = gallery[i:i+3]
+                batch = grid_items[i:i+3]
                 for j, item in enumerate(batch):
                     idx = i + j
                     with cols[j]:
-                        g_img = base64_to_image(item['image_base64'])
-                        if g_img:
-                            st.image(g_img, caption=f"{item['timestamp'][:10]}", use_container_width=True)
-                            st.caption(f"{item['prompt'][:30]}...")
+                        # Cacheable URLs: reruns resend the <img> tag, not the pixels
+                        thumb_url = static_assets.thumbnail_url('gallery', item)
+                        if thumb_url:
+                            st.markdown(static_assets.img_tag(thumb_url, item['prompt'][:30]), unsafe_allow_html=True)
+                            st.caption(f"{item['timestamp'][:10]} · {item['prompt'][:30]}..." + (f" (+{dupe_counts[item['id']]} similar)" if item['id'] in dupe_counts else ""))
                             
                             # Actions Row
                             act_c1, act_c2, act_c3, act_c4 = st.columns([1, 1, 2, 1])
+                            with act_c4:
+                                if st.button("≈", key=f"similar_{item['id']}", help="Find Similar"):
+                                    st.session_state.similar_to = item['id']
+                                    st.rerun()
                             with act_c1:
                                 if st.button("🔍", key=f"view_{item['id']}", help="Maximize"):
-                                    show_image_preview(g_img, item['prompt'])
+                                    show_image_preview(item['id'], item['prompt'])
                             with act_c2:
                                 if st.button("✏️", key=f"edit_{item['id']}", help="Remix"):
-                                    render_edit_dialog(g_img, item['prompt'], 'apparel')
+                                    render_edit_dialog(item['id'], item['prompt'], 'apparel')
                             with act_c3:
-                                buf = BytesIO()
-                                g_img.save(buf, format="PNG")
-                                st.download_button(
-                                    label="Download",
-                                    data=buf.getvalue(),
-                                    file_name=f"ella_shoot_{idx}.png",
-                                    mime="image/png",
-                                    key=f"dl_{idx}",
-                                    use_container_width=True
-                                )
+                                tile_download(item, f"ella_shoot_{idx}.png", f"dl_gal_{item['id']}")
                             with act_c3:
                                 if st.button("🗑", key=f"del_gal_{item['id']}", help="Remove", use_container_width=True):
                                     db.delete_gallery_item(item['id'])
                                     st.rerun()
+    elif gallery:
+        st.info("No shoots match your search.")
     else:
         st.info("No shoots in portfolio yet.")
 
@@ -855,14 +1115,21 @@ with main_tab2:
     # 1. Select Base from Main Gallery
     main_gallery = db.get_gallery(st.session_state.user_id, 'apparel')
     
+    batch_mode = st.toggle("Batch Mode", key="acc_batch_mode", help="Apply the same accessory to many shoots at once.")
     col_base, col_acc = st.columns(2)
     
-    selected_shoot_base64 = None
+    selected_shoot_id = None
+    batch_shoots = []
     
     with col_base:
-        st.markdown("#### 1. Select Base Shoot")
+        st.markdown("#### 1. Select Base Shoot" + ("s" if batch_mode else ""))
         if not main_gallery:
             st.info("No shoots available. Go to Apparel Shoot tab first.")
+        elif batch_mode:
+            shoot_options = {f"Shoot {i+1} ({item['timestamp'][:10]}) {item['prompt'][:30]}": i for i, item in enumerate(main_gallery)}
+            picked = st.multiselect("Choose Images", list(shoot_options.keys()), key="acc_batch_pick")
+            batch_shoots = [main_gallery[shoot_options[label]] for label in picked]
+            st.caption(f"{len(batch_shoots)} shoots selected")
         else:
             # Create friendly labels
             shoot_options = {f"Shoot {i+1} ({item['timestamp'][:10]})": i for i, item in enumerate(main_gallery)}
@@ -871,12 +1138,13 @@ with main_tab2:
             if selected_option:
                 idx = shoot_options[selected_option]
                 selected_shoot = main_gallery[idx]
-                selected_shoot_base64 = selected_shoot['image_base64']
+                selected_shoot_id = selected_shoot['id']
                 
                 # Preview
-                base_img = base64_to_image(selected_shoot_base64)
-                if base_img:
-                    st.image(base_img, caption="Base Image", use_container_width=True)
+                base_url = static_assets.thumbnail_url('gallery', selected_shoot)
+                if base_url:
+                    st.markdown(static_assets.img_tag(base_url, "Base Image"), unsafe_allow_html=True)
+                    st.caption("Base Image")
 
     with col_acc:
         st.markdown("#### 2. Add Accessory")
@@ -891,57 +1159,57 @@ with main_tab2:
 
     st.markdown("---")
     
-    if st.button("APPLY ACCESSORY", use_container_width=True):
-        if not selected_shoot_base64 or not acc_image or not acc_desc:
+    if batch_mode and st.button(f"APPLY TO {len(batch_shoots)} SHOOTS", use_container_width=True):
+        if not batch_shoots or not acc_image or not acc_desc:
+            st.error("Missing inputs. Select shoots, upload an accessory, and describe it.")
+        elif not engine:
+             st.error("AI Client not initialized.")
+        else:
+            with tracing.trace("accessory_batch", user=st.session_state.studio_name, model=IMAGE_MODEL, shots=len(batch_shoots)):
+                bases = [(item['id'], base64_to_image(item['image_base64']))
+                         for item in db.get_gallery_items([item['id'] for item in batch_shoots])]
+                labels = {item['id']: f"{item['timestamp'][:10]} {item['prompt'][:30]}" for item in batch_shoots}
+                progress = st.progress(0.0, text=f"0 / {len(bases)} shoots")
+                item_status = {key: st.empty() for key, _ in bases}
+                for key in item_status:
+                    item_status[key].caption(f"… {labels[key]}")
+                finished = []
+                try:
+                    for done, (key, result, error) in enumerate(engine.accessory_batch(bases, acc_image, acc_desc, user_id=st.session_state.user_id), start=1):
+                        if result and result.image:
+                            finished.append((f"Accessory Add: {acc_desc}", result.image))
+                            item_status[key].caption(f"✓ {labels[key]}")
+                        else:
+                            item_status[key].caption(f"✗ {labels[key]}: {error or 'No image returned.'}")
+                        progress.progress(done / len(bases), text=f"{done} / {len(bases)} shoots")
+                    if finished:
+                        # One write for the whole batch
+                        engine.save_batch(st.session_state.user_id, 'accessory', finished)
+                        st.success(f"{len(finished)} of {len(bases)} shoots saved to the Accessory Archive.")
+                except Exception as e:
+                    st.error(f"Failed: {e}")
+
+    if not batch_mode and st.button("APPLY ACCESSORY", use_container_width=True):
+        if not selected_shoot_id or not acc_image or not acc_desc:
             st.error("Missing inputs. Select a shoot, upload an accessory, and describe it.")
-        elif not client:
+        elif not engine:
              st.error("AI Client not initialized.")
         else:
-            with st.spinner(" fusing accessory..."):
+            with st.spinner(" fusing accessory..."), tracing.trace("accessory", user=st.session_state.studio_name, model=IMAGE_MODEL):
                 try:
                     # Prepare inputs
-                    base_pil = base64_to_image(selected_shoot_base64)
+                    base_pil = base64_to_image(db.get_stored_image('gallery', selected_shoot_id))
                     
                     # Construct Prompt via Engine
-                    acc_prompt = PromptGenerator.generate_accessory_payload(
-                        base_desc="Existing fashion shoot",
-                        accessory_desc=acc_desc
-                    )
-                    
-                    contents = [acc_prompt, base_pil, acc_image]
-                    
-                    response = client.models.generate_content(
-                        model='gemini-3-pro-image-preview',
-                        contents=contents,
-                         config=types.GenerateContentConfig(
-                            safety_settings=[types.SafetySetting(
-                                category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                                threshold="BLOCK_ONLY_HIGH"
-                            )]
-                        )
-                    )
-                    
-                    # Handle Response
-                    final_acc_pil = None
-                    if response.parts:
-                         for part in response.parts:
-                              if part.inline_data:
-                                   if isinstance(part.inline_data.data, bytes):
-                                        final_acc_pil = Image.open(BytesIO(part.inline_data.data))
-                                   else:
-                                        final_acc_pil = Image.open(BytesIO(base64.b64decode(part.inline_data.data)))
-                                   break
+                    result = engine.generate(engine.accessory_request(base_pil, acc_image, acc_desc), user_id=st.session_state.user_id)
+                    final_acc_pil = result.image
                     
                     if final_acc_pil:
                         st.success("ACCESSORY ADDED")
                         st.image(final_acc_pil, caption="Final Result", use_container_width=True)
                         
                         # Save to ACCESSORIES Gallery
-                        buf = BytesIO()
-                        final_acc_pil.save(buf, format="PNG")
-                        b64_new = base64.b64encode(buf.getvalue()).decode('utf-8')
-                        
-                        db.add_gallery_item(st.session_state.user_id, 'accessory', f"Accessory Add: {acc_desc}", b64_new)
+                        engine.save(st.session_state.user_id, 'accessory', f"Accessory Add: {acc_desc}", final_acc_pil)
                         st.rerun()
                         
                 except Exception as e:
@@ -960,24 +1228,11 @@ with main_tab2:
     with gh_col2:
         if acc_portfolio:
             try:
-                zip_buffer = BytesIO()
-                with zipfile.ZipFile(zip_buffer, "w") as zf:
-                    for idx, item in enumerate(acc_portfolio):
-                        img_data = base64.b64decode(item['image_base64'])
-                        zf.writestr(f"accessory_{idx}_{item['timestamp'][:10]}.png", img_data)
-                
                 # Action Buttons
                 st.markdown("<div style='height: 5px'></div>", unsafe_allow_html=True) 
                 dl_col, clr_col = st.columns([1, 1])
                 with dl_col:
-                    st.download_button(
-                        label="Download All",
-                        data=zip_buffer.getvalue(),
-                        file_name=f"ella_accessories_{st.session_state.studio_name}.zip",
-                        mime="application/zip",
-                        use_container_width=True,
-                        key="dl_all_acc"
-                    )
+                    download_all(acc_portfolio, "accessory", f"ella_accessories_{st.session_state.studio_name}.zip", "zip_accessory")
                 with clr_col:
                     if st.button("CLEAR", help="Wipe Accessories", use_container_width=True, key="clr_acc"):
                         db.clear_gallery(st.session_state.user_id, 'accessory')
@@ -995,32 +1250,23 @@ with main_tab2:
                 for j, item in enumerate(batch):
                     idx = i + j
                     with cols[j]:
-                        g_img = base64_to_image(item['image_base64'])
-                        if g_img:
-                            st.image(g_img, caption=f"{item['timestamp'][:10]}", use_container_width=True)
-                            st.caption(f"{item['prompt'][:30]}...")
+                        thumb_url = static_assets.thumbnail_url('gallery', item)
+                        if thumb_url:
+                            st.markdown(static_assets.img_tag(thumb_url, item['prompt'][:30]), unsafe_allow_html=True)
+                            st.caption(f"{item['timestamp'][:10]} · {item['prompt'][:30]}...")
                             
                             
                             # Actions
                             act_a1, act_a2, act_a3, act_a4 = st.columns([1, 1, 2, 1])
                             with act_a1:
                                 if st.button("🔍", key=f"view_acc_{item['id']}", help="Maximize"):
-                                    show_image_preview(g_img, item['prompt'])
+                                    show_image_preview(item['id'], item['prompt'])
                             with act_a2:
                                 if st.button("✏️", key=f"edit_acc_{item['id']}", help="Remix"):
-                                    render_edit_dialog(g_img, item['prompt'], 'accessory')
+                                    render_edit_dialog(item['id'], item['prompt'], 'accessory')
 
                             with act_a3:
-                                buf = BytesIO()
-                                g_img.save(buf, format="PNG")
-                                st.download_button(
-                                    label="Download",
-                                    data=buf.getvalue(),
-                                    file_name=f"ella_acc_{idx}.png",
-                                    mime="image/png",
-                                    key=f"dl_acc_{idx}",
-                                    use_container_width=True
-                                )
+                                tile_download(item, f"ella_acc_{idx}.png", f"dl_acc_{item['id']}")
                             with act_a4:
                                 if st.button("🗑", key=f"del_acc_{item['id']}", help="Remove", use_container_width=True):
                                     db.delete_gallery_item(item['id'])
@@ -1028,3 +1274,10 @@ with main_tab2:
 
     else:
         st.info("No accessory shoots yet.")
+
+
+# Per-session memory: measured after every completed rerun. Over budget, state that can be
+# rebuilt (remix sessions reopen from the database) goes first, unpromoted drafts last.
+if "draft_batch" in memory_budget.enforce(session_id(), st.session_state, st.session_state.studio_name,
+                                          releasable=("remix_sessions", "draft_batch")):
+    st.toast("Drafts were released to stay within the session memory budget.")
@@ -0,0 +1,271 @@
+"""
+Author: Steven Lansangan
+
+Online backups of studio.db (plus external image blobs) without stopping the app.
+
+The database is copied with SQLite's online backup API, BACKUP_PAGES pages per step with a short
+pause in between so writers get the lock back. A write from another connection restarts the copy;
+after MAX_RESTARTS the last pass copies in a single step instead, which is always consistent.
+With an external BLOB_STORE, every blob the snapshot references is copied to a content-addressed
+backup store shared by all snapshots (blobs are immutable, so the pair is consistent).
+
+    BACKUP_DIR=data/backups   BACKUP_KEEP=7   BACKUP_PAGES=256   BACKUP_STEP_PAUSE=0.005
+    BACKUP_EVERY_H=6          -> the app runs a backup every 6 hours in a background thread
+
+Usage:
+    python backup.py run [--keep 7] [--every 6]
+    python backup.py list
+    python backup.py restore 20250101_030000 [--yes]
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import db_manager as db
+import storage
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "data/backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "256"))  # 1 MB per step at 4 KB pages
+BACKUP_STEP_PAUSE = float(os.getenv("BACKUP_STEP_PAUSE", "0.005"))
+MAX_RESTARTS = 3
+SNAPSHOT_DB = "studio.db"
+MANIFEST = "manifest.json"
+
+_run_lock = threading.Lock()
+
+
+@dataclass
+class BackupResult:
+    name: str
+    status: str = "ok"
+    seconds: float = 0.0
+    db_seconds: float = 0.0
+    blob_seconds: float = 0.0
+    db_bytes: int = 0
+    steps: int = 0
+    restarts: int = 0
+    blobs_copied: int = 0
+    blob_bytes: int = 0
+    error: Optional[str] = None
+
+    def summary(self) -> str:
+        if self.status != "ok":
+            return f"{self.name}: {self.status} ({self.error})"
+        return (f"{self.name}: {self.db_bytes / 1e6:.1f} MB in {self.steps} steps ({self.restarts} restarts, {self.db_seconds:.1f}s), "
+                f"{self.blobs_copied} blobs ({self.blob_bytes / 1e6:.1f} MB, {self.blob_seconds:.1f}s), total {self.seconds:.1f}s")
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def copy_database(src_path: str, dst_path: str, pages: int = BACKUP_PAGES, pause: float = BACKUP_STEP_PAUSE) -> Tuple[int, int]:
+    """Copy a live SQLite database with the backup API. Returns (steps, restarts)."""
+    state = {"steps": 0, "restarts": 0, "remaining": None}
+
+    def progress(status, remaining, total):
+        state["steps"] += 1
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            # Another connection wrote to the source: SQLite started the copy over
+            state["restarts"] += 1
+            if state["restarts"] > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        state["remaining"] = remaining
+        if pause and remaining:
+            time.sleep(pause)  # Let writers in between steps
+
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        try:
+            src.backup(dst, pages=pages, progress=progress)
+        except _TooManyRestarts:
+            src.backup(dst, pages=-1)  # One step: holds the read lock for the whole copy, but always completes
+            state["steps"] += 1
+    finally:
+        dst.close()
+        src.close()
+    return state["steps"], state["restarts"]
+
+
+def _check(path: str):
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+        refs = db.get_blob_refs(conn) if storage.BLOBS.external else set()
+    finally:
+        conn.close()
+    if result != "ok":
+        raise RuntimeError(f"Snapshot failed quick_check: {result}")
+    return refs
+
+
+def _copy_blobs(keys, source, target, workers: int = 8) -> Tuple[int, int]:
+    """Copy blobs missing from `target`. Returns (count, bytes)."""
+    def copy_one(key):
+        if target.exists(key):
+            return 0
+        data = source.get(key)
+        target.put(key, data)
+        return len(data)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        sizes = [n for n in pool.map(copy_one, sorted(keys)) if n]
+    return len(sizes), sum(sizes)
+
+
+def list_backups() -> List[Dict]:
+    """Complete snapshots, newest first, with their manifests."""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    backups = []
+    for name in sorted(os.listdir(BACKUP_DIR), reverse=True):
+        manifest_path = os.path.join(BACKUP_DIR, name, MANIFEST)
+        if not name.startswith(".") and os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                backups.append(json.load(f))
+    return backups
+
+
+def prune_backups(keep: int = BACKUP_KEEP) -> int:
+    """Delete all but the newest `keep` snapshots, their unshared blobs and abandoned partial runs."""
+    removed = 0
+    for name in os.listdir(BACKUP_DIR):
+        if name.startswith(".") and name.endswith(".partial"):
+            shutil.rmtree(os.path.join(BACKUP_DIR, name), ignore_errors=True)
+    backups = list_backups()
+    for manifest in backups[keep:]:
+        shutil.rmtree(os.path.join(BACKUP_DIR, manifest["name"]), ignore_errors=True)
+        removed += 1
+    if storage.BLOBS.external:
+        kept = {key for manifest in backups[:keep] for key in manifest.get("blobs", [])}
+        store = storage.backup_blob_store(BACKUP_DIR)
+        for key, _, _ in list(store.entries()):
+            if key not in kept:
+                store.delete(key)
+    return removed
+
+
+def create_backup(keep: int = BACKUP_KEEP) -> BackupResult:
+    """Snapshot the database (and referenced blobs), prune old snapshots and record the timings."""
+    if storage.is_postgres():
+        raise RuntimeError("backup.py covers SQLite; back up Postgres with pg_dump or the provider's snapshots.")
+    with _run_lock:
+        name = datetime.now().strftime("%Y%m%d_%H%M%S")
+        result = BackupResult(name=name)
+        started_at = datetime.now().isoformat()
+        start = time.perf_counter()
+        partial = os.path.join(BACKUP_DIR, f".{name}.partial")
+        try:
+            os.makedirs(partial, exist_ok=True)
+            snapshot = os.path.join(partial, SNAPSHOT_DB)
+            result.steps, result.restarts = copy_database(db.DB_FILE, snapshot)
+            result.db_bytes = os.path.getsize(snapshot)
+            refs = _check(snapshot)
+            result.db_seconds = time.perf_counter() - start
+
+            if refs:
+                blob_start = time.perf_counter()
+                result.blobs_copied, result.blob_bytes = _copy_blobs(refs, storage.BLOBS, storage.backup_blob_store(BACKUP_DIR))
+                result.blob_seconds = time.perf_counter() - blob_start
+
+            result.seconds = time.perf_counter() - start
+            with open(os.path.join(partial, MANIFEST), "w") as f:
+                json.dump({**asdict(result), "created_at": started_at, "blob_store": storage.BLOBS.name,
+                           "blobs": sorted(refs)}, f)
+            os.replace(partial, os.path.join(BACKUP_DIR, name))
+            prune_backups(keep)
+        except Exception as e:
+            shutil.rmtree(partial, ignore_errors=True)
+            result.status, result.error = "failed", str(e)
+            result.seconds = time.perf_counter() - start
+            print(f"Backup {name} failed: {e}")
+        db.add_backup_run(result.name, started_at, result.status, result.seconds, result.db_seconds, result.blob_seconds,
+                          result.db_bytes, result.steps, result.restarts, result.blobs_copied, result.blob_bytes, result.error)
+        return result
+
+
+def restore_backup(name: str) -> float:
+    """
+    Replace the live database with a snapshot (and put back any blobs it needs). Writes made
+    after the snapshot are lost; stop batch runners first. Returns seconds taken.
+    """
+    folder = os.path.join(BACKUP_DIR, name)
+    with open(os.path.join(folder, MANIFEST)) as f:
+        manifest = json.load(f)
+    start = time.perf_counter()
+    snapshot = os.path.join(folder, SNAPSHOT_DB)
+    _check(snapshot)
+    if manifest.get("blobs"):
+        if not storage.BLOBS.external:
+            raise RuntimeError(f"Snapshot references {manifest['blob_store']} blobs; set BLOB_STORE before restoring.")
+        _copy_blobs(manifest["blobs"], storage.backup_blob_store(BACKUP_DIR), storage.BLOBS)
+    # Backup API in the other direction: other connections see the old or the new database, never a mix
+    copy_database(snapshot, db.DB_FILE, pages=-1, pause=0)
+    return time.perf_counter() - start
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler(interval_s: float, keep: int = BACKUP_KEEP):
+    """Run create_backup every `interval_s` in a daemon thread. Safe to call on every Streamlit rerun."""
+    global _scheduler
+
+    def loop():
+        while True:
+            time.sleep(interval_s)
+            try:
+                print(create_backup(keep).summary())
+            except Exception as e:
+                print(f"Scheduled backup failed: {e}")
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=loop, daemon=True, name="ella-backup")
+            _scheduler.start()
+        return _scheduler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ella Studio online backups")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="Take a snapshot now")
+    run.add_argument("--keep", type=int, default=BACKUP_KEEP, help="Snapshots to retain")
+    run.add_argument("--every", type=float, help="Keep running, one snapshot every N hours")
+    sub.add_parser("list", help="List snapshots")
+    restore = sub.add_parser("restore", help="Replace the live database with a snapshot")
+    restore.add_argument("name")
+    restore.add_argument("--yes", action="store_true", help="Don't ask for confirmation")
+    args = parser.parse_args()
+
+    db.init_db()
+    if args.command == "run":
+        while True:
+            result = create_backup(args.keep)
+            print(result.summary())
+            if not args.every:
+                raise SystemExit(0 if result.status == "ok" else 1)
+            time.sleep(args.every * 3600)
+    elif args.command == "list":
+        for manifest in list_backups():
+            print(f"{manifest['name']}  {manifest['db_bytes'] / 1e6:>8.1f} MB  {len(manifest.get('blobs', [])):>6} blobs  "
+                  f"{manifest['seconds']:.1f}s")
+    elif args.command == "restore":
+        if not args.yes and input(f"Replace {db.DB_FILE} with snapshot {args.name}? [y/N] ").lower() != "y":
+            raise SystemExit("Aborted.")
+        print(f"Restored {args.name} in {restore_backup(args.name):.1f}s")
+
+
+if __name__ == "__main__":
+    main()
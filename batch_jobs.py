@@ -0,0 +1,360 @@
+"""
+Author: Steven Lansangan
+
+Offline bulk generation through the provider's batch interface.
+Shoot requests are compiled with the same prompt assembly as INITIATE SHOOT,
+written to a JSONL batch file, submitted, tracked in the studio DB and ingested
+into the gallery once the provider finishes.
+
+Usage:
+    python batch_jobs.py submit --studio NAME --models 1,2 --apparel 3,4 --locations 5 --brief "..." [--style LUXURY] [--ar 9:16] [--size 2K] [--local]
+    python batch_jobs.py poll [--wait] [--local]
+    python batch_jobs.py status [--studio NAME]
+"""
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from io import BytesIO
+from typing import List, Dict, Optional
+
+from PIL import Image
+
+import db_manager as db
+from image_index import dhash_b64
+from image_utils import load_and_resize, pil_to_png_bytes, pil_to_base64
+from prompt_engine import PromptGenerator, BrandStyle
+
+BATCH_MODEL = 'gemini-3-pro-image-preview'
+BATCH_DIR = os.getenv("BATCH_DIR", "data/batches")
+
+SAFETY_SETTINGS = [{"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"}]
+
+
+class GeminiBatchBackend:
+    """Google GenAI batch mode (file input, file output)."""
+    name = "gemini"
+
+    def __init__(self, client):
+        self.client = client
+
+    def upload_image(self, png_bytes: bytes) -> Dict[str, str]:
+        uploaded = self.client.files.upload(file=BytesIO(png_bytes), config={'mime_type': 'image/png'})
+        return {"file_uri": uploaded.uri, "mime_type": "image/png"}
+
+    def submit(self, jsonl_path: str, display_name: str) -> str:
+        uploaded = self.client.files.upload(file=jsonl_path, config={'display_name': display_name, 'mime_type': 'jsonl'})
+        job = self.client.batches.create(model=BATCH_MODEL, src=uploaded.name, config={'display_name': display_name})
+        return job.name
+
+    def status(self, job_name: str) -> str:
+        job = self.client.batches.get(name=job_name)
+        return job.state.name
+
+    def results(self, job_name: str):
+        job = self.client.batches.get(name=job_name)
+        raw = self.client.files.download(file=job.dest.file_name)
+        for line in raw.decode('utf-8').splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+class LocalBatchBackend:
+    """
+    Local stand-in for the provider batch endpoint, for tests and dry runs.
+    Jobs complete `delay_s` after submission with a placeholder render per request line.
+    """
+    name = "local"
+
+    def __init__(self, root: Optional[str] = None, delay_s: float = 0):
+        self.root = root or os.path.join(BATCH_DIR, "local")
+        self.delay_s = delay_s
+        os.makedirs(os.path.join(self.root, "files"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "jobs"), exist_ok=True)
+
+    def upload_image(self, png_bytes: bytes) -> Dict[str, str]:
+        digest = hashlib.sha256(png_bytes).hexdigest()
+        path = os.path.join(self.root, "files", f"{digest}.png")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(png_bytes)
+        return {"file_uri": f"local://{digest}", "mime_type": "image/png"}
+
+    def submit(self, jsonl_path: str, display_name: str) -> str:
+        job_id = f"local-{uuid.uuid4().hex[:12]}"
+        with open(jsonl_path, "rb") as src, open(os.path.join(self.root, "jobs", f"{job_id}.jsonl"), "wb") as dst:
+            dst.write(src.read())
+        with open(os.path.join(self.root, "jobs", f"{job_id}.json"), "w") as f:
+            json.dump({"display_name": display_name, "submitted": time.time()}, f)
+        return f"batches/{job_id}"
+
+    def status(self, job_name: str) -> str:
+        job_id = job_name.split("/")[-1]
+        meta_path = os.path.join(self.root, "jobs", f"{job_id}.json")
+        if not os.path.exists(meta_path):
+            return "JOB_STATE_FAILED"
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if time.time() - meta["submitted"] < self.delay_s:
+            return "JOB_STATE_RUNNING"
+        return "JOB_STATE_SUCCEEDED"
+
+    def results(self, job_name: str):
+        job_id = job_name.split("/")[-1]
+        with open(os.path.join(self.root, "jobs", f"{job_id}.jsonl")) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                parts = item["request"]["contents"][0]["parts"]
+                missing = [p["file_data"]["file_uri"] for p in parts if "file_data" in p
+                           and not os.path.exists(os.path.join(self.root, "files", p["file_data"]["file_uri"][len("local://"):] + ".png"))]
+                if missing:
+                    yield {"key": item["key"], "error": {"message": f"Unknown file(s): {missing}"}}
+                    continue
+                yield {"key": item["key"], "response": {"candidates": [{"content": {"parts": [
+                    {"inlineData": {"mimeType": "image/png", "data": base64.b64encode(self._placeholder(item)).decode('utf-8')}}
+                ]}}]}}
+
+    @staticmethod
+    def _placeholder(item) -> bytes:
+        # Deterministic solid frame, colour derived from the request key, shaped by the aspect ratio
+        ar = item["request"]["generation_config"]["image_config"]["aspect_ratio"]
+        w, h = (int(x) for x in ar.split(":"))
+        scale = 256 / max(w, h)
+        color = tuple(hashlib.md5(item["key"].encode()).digest()[:3])
+        return pil_to_png_bytes(Image.new("RGB", (int(w * scale), int(h * scale)), color))
+
+
+PENDING_STATES = {"JOB_STATE_PENDING", "JOB_STATE_QUEUED", "JOB_STATE_RUNNING"}
+STATUS_MAP = {
+    "JOB_STATE_SUCCEEDED": "SUCCEEDED",
+    "JOB_STATE_FAILED": "FAILED",
+    "JOB_STATE_CANCELLED": "CANCELLED",
+    "JOB_STATE_EXPIRED": "EXPIRED",
+}
+
+
+def expand_combinations(model_ids, apparel_ids, location_ids, brief, style: BrandStyle, aspect_ratio="1:1", image_size="2K") -> List[Dict]:
+    """Every model x apparel x location combination as one shoot spec."""
+    specs = []
+    for model_id, apparel_id, location_id in itertools.product(model_ids, apparel_ids, location_ids or [None]):
+        specs.append({
+            "model_id": model_id,
+            "apparel_id": apparel_id,
+            "location_id": location_id,
+            "brief": brief,
+            "style": style.name,
+            "aspect_ratio": aspect_ratio,
+            "image_size": image_size,
+        })
+    return specs
+
+
+def compile_batch(user_id, specs: List[Dict], backend, path: str) -> Dict[str, Dict]:
+    """
+    Writes one batch request line per spec to `path`. Reference images are prepared
+    like the shoot handler (800px RGB) and uploaded once per asset, then referenced by URI.
+    Returns the manifest: request key -> spec.
+    """
+    models = {m['id']: m for m in db.get_models(user_id)}
+    apparel = {a['id']: a for a in db.get_assets(user_id, "closet")}
+    locations = {a['id']: a for a in db.get_assets(user_id, "location")}
+    uploaded = {}
+
+    def ref_part(cache_key, b64):
+        if cache_key not in uploaded:
+            img = load_and_resize(b64, (800, 800))
+            uploaded[cache_key] = backend.upload_image(pil_to_png_bytes(img)) if img else None
+        return uploaded[cache_key]
+
+    manifest = {}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        for n, spec in enumerate(specs):
+            model = models.get(spec["model_id"])
+            garment = apparel.get(spec["apparel_id"])
+            location = locations.get(spec["location_id"]) if spec.get("location_id") else None
+            if not model or not garment:
+                print(f"Batch compile: skipping spec {n}, unknown model/apparel {spec['model_id']}/{spec['apparel_id']}")
+                continue
+
+            face = ref_part(("face", model['id']), model.get('face_base64'))
+            body = ref_part(("body", model['id']), model.get('body_base64'))
+            cloth = ref_part(("asset", garment['id']), garment['image_base64'])
+            loc = ref_part(("asset", location['id']), location['image_base64']) if location else None
+
+            prompt = PromptGenerator.generate_shoot_payload(
+                spec["brief"], BrandStyle[spec["style"]], spec["aspect_ratio"],
+                has_face=face is not None, has_body=body is not None,
+                has_apparel=cloth is not None, has_location=loc is not None
+            )
+            # Reference order must match the VISUAL MAPPING numbering
+            parts = [{"text": prompt}] + [{"file_data": ref} for ref in (face, body, cloth, loc) if ref]
+
+            key = f"{n:05d}-m{spec['model_id']}-a{spec['apparel_id']}-l{spec.get('location_id') or 0}"
+            request = {
+                "contents": [{"role": "user", "parts": parts}],
+                "generation_config": {
+                    "response_modalities": ["TEXT", "IMAGE"],
+                    "image_config": {"aspect_ratio": spec["aspect_ratio"], "image_size": spec["image_size"]},
+                },
+                "safety_settings": SAFETY_SETTINGS,
+            }
+            f.write(json.dumps({"key": key, "request": request}) + "\n")
+            manifest[key] = spec
+    return manifest
+
+
+def submit_batch(user_id, specs: List[Dict], backend, label: str = "") -> Optional[int]:
+    """Compile, submit and register a batch job. Returns the batch_jobs row id."""
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(BATCH_DIR, f"user{user_id}-{stamp}.jsonl")
+    manifest = compile_batch(user_id, specs, backend, path)
+    if not manifest:
+        print("Batch submit: nothing to submit.")
+        return None
+
+    campaign_id = db.create_campaign(user_id, label or specs[0]["brief"])
+    provider_job = backend.submit(path, display_name=f"ella-{user_id}-{stamp}")
+    return db.add_batch_job(user_id, campaign_id, provider_job, backend.name, len(manifest), manifest)
+
+
+def _response_image_b64(response: Dict) -> Optional[str]:
+    for candidate in response.get("candidates", []):
+        for part in (candidate.get("content") or {}).get("parts", []):
+            inline = part.get("inlineData") or part.get("inline_data")
+            if inline and inline.get("data"):
+                # Normalize to PNG like the interactive flows
+                img = Image.open(BytesIO(base64.b64decode(inline["data"])))
+                return pil_to_base64(img)
+    return None
+
+
+def ingest_results(job: Dict, backend) -> Dict[str, int]:
+    """
+    Store finished renders in the gallery. Each render is stored in the same transaction as the
+    job's counters, so an interrupted ingest resumes exactly after the last stored line.
+    """
+    ingested, failed = job['ingested_count'], job['failed_count']
+    done = ingested + failed
+    for n, result in enumerate(backend.results(job['provider_job'])):
+        if n < done:
+            continue
+        spec = job['manifest'].get(result.get("key"), {})
+        b64 = None
+        try:
+            if "response" in result:
+                b64 = _response_image_b64(result["response"])
+        except Exception as e:
+            print(f"Batch ingest decode error ({result.get('key')}): {e}")
+
+        if b64:
+            db.ingest_batch_item(job['id'], job['user_id'], 'apparel', f"{spec.get('brief', '')[:100]}", b64,
+                                 job['campaign_id'], dhash_b64(b64), ingested + 1, failed)
+            ingested += 1
+        else:
+            print(f"Batch item failed ({result.get('key')}): {result.get('error', 'No image returned.')}")
+            failed += 1
+            db.update_batch_job(job['id'], 'INGESTING', ingested_count=ingested, failed_count=failed)
+
+    db.update_batch_job(job['id'], 'SUCCEEDED', ingested_count=ingested, failed_count=failed)
+    return {"ingested": ingested, "failed": failed}
+
+
+def poll_batches(backend, user_id=None) -> List[Dict]:
+    """Check every open job for this backend; ingest the ones that finished."""
+    summaries = []
+    for job in db.get_batch_jobs(user_id, open_only=True):
+        if job['backend'] != backend.name:
+            continue
+        try:
+            state = backend.status(job['provider_job'])
+        except Exception as e:
+            print(f"Batch status error ({job['provider_job']}): {e}")
+            continue
+
+        if state in PENDING_STATES:
+            db.update_batch_job(job['id'], 'RUNNING')
+            summaries.append({"id": job['id'], "status": "RUNNING"})
+        elif state == "JOB_STATE_SUCCEEDED":
+            counts = ingest_results(job, backend)
+            summaries.append({"id": job['id'], "status": "SUCCEEDED", **counts})
+        else:
+            db.update_batch_job(job['id'], STATUS_MAP.get(state, state))
+            summaries.append({"id": job['id'], "status": STATUS_MAP.get(state, state)})
+    return summaries
+
+
+def make_backend(local: bool):
+    if local:
+        return LocalBatchBackend()
+    from google import genai
+    from dotenv import load_dotenv
+    load_dotenv()
+    return GeminiBatchBackend(genai.Client(api_key=os.getenv("GOOGLE_API_KEY")))
+
+
+def _ids(value):
+    return [int(x) for x in value.split(",") if x.strip()] if value else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ella Studio offline batch generation")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_submit = sub.add_parser("submit", help="Compile and submit a model x apparel x location batch")
+    p_submit.add_argument("--studio", required=True)
+    p_submit.add_argument("--models", required=True, help="Comma-separated model ids")
+    p_submit.add_argument("--apparel", required=True, help="Comma-separated apparel asset ids")
+    p_submit.add_argument("--locations", default="", help="Comma-separated location asset ids")
+    p_submit.add_argument("--brief", required=True)
+    p_submit.add_argument("--style", default="LUXURY", choices=[s.name for s in BrandStyle])
+    p_submit.add_argument("--ar", default="1:1", choices=["1:1", "16:9", "9:16"])
+    p_submit.add_argument("--size", default="2K", choices=["1K", "2K", "4K"])
+    p_submit.add_argument("--local", action="store_true", help="Use the local stand-in batch endpoint")
+
+    p_poll = sub.add_parser("poll", help="Poll open jobs and ingest finished results")
+    p_poll.add_argument("--wait", action="store_true", help="Keep polling until no job is open")
+    p_poll.add_argument("--interval", type=float, default=60)
+    p_poll.add_argument("--local", action="store_true")
+
+    p_status = sub.add_parser("status", help="List batch jobs")
+    p_status.add_argument("--studio")
+
+    args = parser.parse_args()
+    db.init_db()
+
+    if args.command == "submit":
+        user_id = db.get_user_id(args.studio)
+        if not user_id:
+            parser.error(f"Unknown studio: {args.studio}")
+        specs = expand_combinations(_ids(args.models), _ids(args.apparel), _ids(args.locations),
+                                    args.brief, BrandStyle[args.style], args.ar, args.size)
+        job_id = submit_batch(user_id, specs, make_backend(args.local))
+        print(f"Submitted batch job {job_id} ({len(specs)} requests).")
+
+    elif args.command == "poll":
+        backend = make_backend(args.local)
+        while True:
+            summaries = poll_batches(backend)
+            for s in summaries:
+                print(json.dumps(s))
+            if not args.wait or not any(s["status"] == "RUNNING" for s in summaries):
+                break
+            time.sleep(args.interval)
+
+    elif args.command == "status":
+        user_id = db.get_user_id(args.studio) if args.studio else None
+        for job in db.get_batch_jobs(user_id):
+            print(f"#{job['id']} {job['status']:<10} {job['ingested_count']}/{job['item_count']} ok, "
+                  f"{job['failed_count']} failed  [{job['backend']}] {job['provider_job']}  {job['created_at'][:16]}")
+
+
+if __name__ == "__main__":
+    main()
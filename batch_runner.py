@@ -0,0 +1,281 @@
+"""
+Author: Steven Lansangan
+
+Headless shoot runner driven by a JSONL manifest (no Streamlit).
+
+One shoot per line:
+    {"id": "look-01", "studio": "atelier", "model_id": 1, "apparel_id": 4, "location_id": 7,
+     "brief": "Red silk dress, golden hour", "style": "LUXURY", "aspect_ratio": "9:16", "image_size": "2K"}
+
+Optional keys: "location_id", "shots" (explicit list of shot briefs), "auto_plan" (true = let
+Cruella plan the shots from "brief"), "style" (BrandStyle name, default LUXURY),
+"aspect_ratio" (default 1:1), "image_size" (1K/2K/4K, default 2K).
+
+Progress is checkpointed next to the manifest (<manifest>.checkpoint.jsonl) after every saved
+shot, so a crashed run resumes where it stopped: finished shoots are skipped, and an unfinished
+or partly failed shoot reuses its campaign and only re-runs the shots that have no image yet.
+The database is the source of truth on resume: a shoot's campaign is found by the run key
+checkpointed before it was created, and its gallery rows count as saved shots even when the
+crash came before their checkpoint line.
+
+Usage:
+    python batch_runner.py shoots.jsonl [--workers 4] [--checkpoint PATH] [--restart] [--backend fake]
+"""
+import argparse
+import json
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+
+import db_manager as db
+import tracing
+from prompt_engine import BrandStyle
+from quality_gate import QualityGate
+from studio_engine import StudioEngine, GeminiBackend, FakeBackend, ShootRefs, IMAGE_MODEL
+
+
+def load_manifest(path: str) -> List[Dict]:
+    items = []
+    with open(path) as f:
+        for n, line in enumerate(f):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item.setdefault("id", f"line-{n + 1}")
+            items.append(item)
+    return items
+
+
+def load_checkpoint(path: str) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    """
+    Read a checkpoint file. Returns (completed item id -> result record,
+    unfinished item id -> {"run_key", "campaign_id", "shots", "saved": {shot index: gallery id}}).
+    """
+    done, progress = {}, {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Torn last line from a crash
+                if record.get("status") == "ok":
+                    done[record["id"]] = record
+                elif record.get("campaign_id") is not None or record.get("run_key"):
+                    entry = progress.setdefault(record["id"], {"run_key": None, "campaign_id": None, "shots": None, "saved": {}})
+                    for key in ("run_key", "campaign_id"):
+                        if record.get(key) is not None:
+                            entry[key] = record[key]
+                    if "shots" in record:
+                        entry["shots"] = record["shots"]
+                    if "shot" in record:
+                        entry["saved"][record["shot"]] = record["gallery_id"]
+    for item_id in done:
+        progress.pop(item_id, None)
+    return done, progress
+
+
+def reconcile_shots(shots: List[str], saved: Dict[int, int], rows: List[Dict]) -> Dict[int, int]:
+    """
+    Add the campaign's gallery rows that the checkpoint missed (saved just before a crash) to
+    `saved` {shot index: gallery id}. Rows are matched to unsaved shots by their stored prompt.
+    """
+    saved = dict(saved)
+    known = set(saved.values())
+    for row in rows:
+        if row['id'] in known:
+            continue
+        for n, shot in enumerate(shots):
+            if n not in saved and shot[:100] == row['prompt']:
+                saved[n] = row['id']
+                break
+    return saved
+
+
+class ManifestRunner:
+    def __init__(self, engine: StudioEngine, checkpoint_path: str, workers: int = 4):
+        self.engine = engine
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._studios = {}
+        self._progress = {}
+
+    def _studio(self, name: str) -> Dict:
+        # Vault is loaded once per studio and shared by all workers
+        with self._lock:
+            if name not in self._studios:
+                user_id = db.get_user_id(name)
+                if not user_id:
+                    raise ValueError(f"Unknown studio: {name}")
+                self._studios[name] = {
+                    "user_id": user_id,
+                    "models": {m['id']: m for m in db.get_models(user_id)},
+                    "assets": {a['id']: a for cat in ("closet", "location") for a in db.get_assets(user_id, cat)},
+                }
+            return self._studios[name]
+
+    def _checkpoint(self, record: Dict):
+        with self._lock:
+            with open(self.checkpoint_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def run_item(self, item: Dict) -> Dict:
+        start = time.perf_counter()
+        studio = self._studio(item["studio"])
+        model = studio["models"].get(item["model_id"])
+        apparel = studio["assets"].get(item["apparel_id"])
+        location = studio["assets"].get(item["location_id"]) if item.get("location_id") else None
+        if not model or not apparel:
+            raise ValueError("Model and Apparel are required.")
+
+        style = BrandStyle[item.get("style", "LUXURY")]
+        aspect_ratio = item.get("aspect_ratio", "1:1")
+        image_size = item.get("image_size", "2K")
+
+        # A resumed item keeps its campaign, its planned shots and the frames already saved
+        progress = self._progress.get(item["id"]) or {}
+        saved_shots = dict(progress.get("saved", {}))
+        if progress.get("shots"):
+            shots = progress["shots"]
+        elif item.get("shots"):
+            shots = item["shots"]
+        elif item.get("auto_plan"):
+            with tracing.trace("plan", user=item["studio"], item=item["id"]):
+                shots = [s['description'] for s in self.engine.plan(item["brief"], min_count=3, user_id=studio["user_id"])]
+        else:
+            shots = [item["brief"]]
+
+        with tracing.trace("shoot_prep", user=item["studio"], item=item["id"]):
+            refs = ShootRefs.from_assets(model, apparel, location)
+
+        # The run key (and the shot list) is checkpointed before the campaign exists, so a crash
+        # in between finds that campaign again instead of orphaning it
+        campaign_id, run_key = progress.get("campaign_id"), progress.get("run_key")
+        if campaign_id is None and run_key:
+            campaign_id = db.find_campaign(studio["user_id"], run_key)
+        if campaign_id is None:
+            if not run_key:
+                run_key = secrets.token_hex(8)
+                self._checkpoint({"id": item["id"], "run_key": run_key, "shots": shots})
+            campaign_id = db.create_campaign(studio["user_id"], item.get("brief") or shots[0], run_key=run_key)
+            self._checkpoint({"id": item["id"], "campaign_id": campaign_id})
+        else:
+            saved_shots = reconcile_shots(shots, saved_shots, db.get_campaign_prompts(campaign_id))
+
+        failed, rejected, error = 0, 0, None
+        pending = [n for n in range(len(shots)) if n not in saved_shots]
+        budget = self.engine.gate.budget(len(pending)) if self.engine.gate else None
+        for n in pending:
+            shot = shots[n]
+            try:
+                with tracing.trace("shoot", user=item["studio"], item=item["id"], shot=n + 1, model=IMAGE_MODEL):
+                    request = self.engine.shoot_request(shot, style, aspect_ratio, refs, image_size=image_size)
+                    result = self.engine.generate(request, user_id=studio["user_id"], budget=budget)
+                    rejected += result.rejected
+                    if not result.image:
+                        raise RuntimeError(result.notes[-1] if result.notes else "no image returned")
+                    gallery_id = self.engine.save(studio["user_id"], 'apparel', f"{shot[:100]}", result.image, campaign_id=campaign_id)
+            except Exception as e:
+                failed += 1
+                error = f"shot {n + 1}: {e}"
+                continue
+            saved_shots[n] = gallery_id
+            self._checkpoint({"id": item["id"], "campaign_id": campaign_id, "shot": n, "gallery_id": gallery_id})
+
+        record = {
+            "id": item["id"],
+            "status": "ok" if not failed else "failed",  # Failed shots are retried on the next run
+            "campaign_id": campaign_id,
+            "images": len(saved_shots),
+            "resumed_shots": len(shots) - len(pending),
+            "failed_shots": failed,
+            "rejected_frames": rejected,
+            "latency": round(time.perf_counter() - start, 3),
+        }
+        if error:
+            record["error"] = error
+        return record
+
+    def _safe_run(self, item: Dict) -> Dict:
+        try:
+            record = self.run_item(item)
+        except Exception as e:
+            record = {"id": item["id"], "status": "failed", "error": str(e), "images": 0, "latency": 0.0}
+        self._checkpoint(record)
+        return record
+
+    def run(self, items: List[Dict]) -> Dict:
+        done, self._progress = load_checkpoint(self.checkpoint_path)
+        pending = [item for item in items if item["id"] not in done]
+        print(f"{len(items)} shoots in manifest, {len(done)} already done, {len(pending)} to run with {self.workers} workers.")
+
+        results = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(self._safe_run, item) for item in pending]
+            for future in as_completed(futures):
+                record = future.result()
+                results.append(record)
+                print(f"[{len(results)}/{len(pending)}] {record['id']}: {record['status']} "
+                      f"({record['images']} images, {record['latency']:.1f}s){' - ' + record['error'] if record.get('error') else ''}")
+        return summarize(results, time.perf_counter() - start)
+
+
+def summarize(results: List[Dict], wall_s: float) -> Dict:
+    latencies = sorted(r["latency"] for r in results if r["status"] == "ok")
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+    images = sum(r["images"] for r in results)
+    return {
+        "shoots": len(results),
+        "ok": sum(1 for r in results if r["status"] == "ok"),
+        "failed": sum(1 for r in results if r["status"] != "ok"),
+        "images": images,
+        "wall_s": round(wall_s, 2),
+        "shoots_per_min": round(len(results) / wall_s * 60, 2) if wall_s else 0.0,
+        "images_per_min": round(images / wall_s * 60, 2) if wall_s else 0.0,
+        "latency_p50_s": pct(0.50),
+        "latency_p95_s": pct(0.95),
+        "latency_max_s": latencies[-1] if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ella Studio headless manifest runner")
+    parser.add_argument("manifest", help="JSONL manifest, one shoot per line")
+    parser.add_argument("--workers", type=int, default=4, help="Shoots generated in parallel")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <manifest>.checkpoint.jsonl)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the existing checkpoint")
+    parser.add_argument("--backend", default="gemini", choices=["gemini", "fake"], help="fake = deterministic offline renders")
+    args = parser.parse_args()
+
+    checkpoint = args.checkpoint or f"{args.manifest}.checkpoint.jsonl"
+    if args.restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    if args.backend == "fake":
+        backend = FakeBackend()
+    else:
+        from google import genai
+        from dotenv import load_dotenv
+        load_dotenv()
+        backend = GeminiBackend(genai.Client(api_key=os.getenv("GOOGLE_API_KEY")))
+
+    db.init_db()
+    # The fake backend's solid frames would never pass the quality gate
+    gate = QualityGate.from_env() if args.backend != "fake" else None
+    runner = ManifestRunner(StudioEngine(backend, gate=gate), checkpoint, workers=args.workers)
+    summary = runner.run(load_manifest(args.manifest))
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
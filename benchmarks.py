@@ -0,0 +1,205 @@
+"""
+Author: Steven Lansangan
+
+Offline micro-benchmarks for the hot paths: db_manager reads/writes, image decode/resize,
+the gallery ZIP build and prompt assembly/parsing. Synthetic studios are seeded at several
+sizes (10 / 1k / 10k gallery items and vault assets) into a throwaway SQLite file.
+
+Results are written as JSON; pass --baseline to compare against an earlier run and fail
+(exit 1) on regressions beyond --tolerance.
+
+Usage:
+    python benchmarks.py [--sizes 10,1000,10000] [--out bench_results/latest.json] [--baseline bench_results/baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict
+
+import numpy as np
+from PIL import Image
+
+import db_manager as db
+import storage
+from image_utils import base64_to_image, load_and_resize, pil_to_base64, gallery_zip_bytes
+from prompt_engine import PromptGenerator, BrandStyle, ShotListGenerator
+
+
+def synthetic_image(edge: int, seed: int = 0) -> Image.Image:
+    """Photo-like frame: low-frequency noise compresses roughly like a real shoot. Same seed, same pixels."""
+    rng = np.random.default_rng(seed)
+    small = max(1, edge // 8)
+    bands = []
+    for c in range(3):
+        noise = rng.normal(128, 40 + 10 * ((seed + c) % 4), (small, small)).clip(0, 255).astype(np.uint8)
+        bands.append(Image.fromarray(noise, "L").resize((edge, edge), Image.BILINEAR))
+    return Image.merge("RGB", bands)
+
+
+def bench(fn: Callable, repeat: int = 5, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return {
+        "median_s": round(statistics.median(runs), 6),
+        "min_s": round(min(runs), 6),
+        "mean_s": round(statistics.fmean(runs), 6),
+        "runs": repeat,
+    }
+
+
+def seed_studio(name: str, size: int, payload_b64: str) -> int:
+    """Studio with `size` gallery items and `size` vault assets per category (bulk insert, not timed)."""
+    db.create_user(name, "bench")
+    user_id = db.get_user_id(name)
+    now = datetime.now()
+    conn = db.get_db_connection()
+    conn.executemany('INSERT INTO models (user_id, name, face_base64, body_base64) VALUES (?, ?, ?, ?)',
+                     [(user_id, f"Model {i}", payload_b64, payload_b64) for i in range(min(size, 100))])
+    for category in ("closet", "location"):
+        conn.executemany('INSERT INTO assets (user_id, category, name, image_base64) VALUES (?, ?, ?, ?)',
+                         [(user_id, category, f"{category} {i}", payload_b64) for i in range(size)])
+    conn.executemany('INSERT INTO gallery (user_id, category, prompt, image_base64, timestamp) VALUES (?, ?, ?, ?, ?)',
+                     [(user_id, 'apparel', f"Red silk dress look {i}, golden hour, rooftop editorial",
+                       payload_b64, (now - timedelta(minutes=i)).isoformat()) for i in range(size)])
+    conn.commit()
+    conn.close()
+    return user_id
+
+
+class _CannedClient:
+    """Stands in for the genai client so ShotListGenerator's parse path runs offline."""
+
+    class _Response:
+        def __init__(self, text):
+            self.text = text
+
+    class _Models:
+        def __init__(self, text):
+            self._text = text
+
+        def generate_content(self, **kwargs):
+            return _CannedClient._Response(self._text)
+
+    def __init__(self, text):
+        self.models = self._Models(text)
+
+
+def run(sizes, repeat: int, payload_edge: int) -> Dict[str, Dict]:
+    results = {}
+    payload_b64 = pil_to_base64(synthetic_image(payload_edge))
+
+    # --- db_manager reads at each scale ---
+    for size in sizes:
+        user_id = seed_studio(f"bench_{size}", size, payload_b64)
+        r = max(1, repeat if size <= 1000 else repeat // 2)
+        results[f"get_gallery[n={size}]"] = bench(lambda: db.get_gallery(user_id, 'apparel'), r)
+        results[f"get_assets[n={size}]"] = bench(lambda: db.get_assets(user_id, 'closet'), r)
+        results[f"get_models[n={min(size, 100)}]"] = bench(lambda: db.get_models(user_id), r)
+        if size <= 1000:
+            gallery = db.get_gallery_items([item['id'] for item in db.get_gallery(user_id, 'apparel')])
+            results[f"gallery_zip[n={size}]"] = bench(lambda: gallery_zip_bytes(gallery, "shoot"), r)
+
+    # --- writes with realistic output sizes ---
+    writer = db.get_user_id(f"bench_{sizes[0]}")
+    for label, edge in (("2K", 2048), ("4K", 4096)):
+        frame = synthetic_image(edge)
+        b64 = pil_to_base64(frame)
+        results[f"add_gallery_item[{label}]"] = bench(lambda: db.add_gallery_item(writer, 'bench', "bench", b64), repeat)
+        results[f"png_encode[{label}]"] = bench(lambda: pil_to_base64(frame), max(1, repeat // 2), warmup=0)
+        results[f"base64_to_image[{label}]"] = bench(lambda: base64_to_image(b64).load(), repeat)
+        results[f"load_and_resize[{label}->800]"] = bench(lambda: load_and_resize(b64, (800, 800)), repeat)
+
+    # --- prompt assembly & parsing ---
+    brief = "Red silk slip dress, golden hour rooftop, wind in the hair, Phase One XF 100MP, 80mm"
+    results["generate_shoot_payload"] = bench(lambda: PromptGenerator.generate_shoot_payload(
+        brief, BrandStyle.LUXURY, "9:16", True, True, True, True), repeat * 200)
+    structured = " ".join(f"Shot {i}: {brief} variation {i} with a distinct pose." for i in range(1, 4))
+    results["generate_campaign_payloads"] = bench(lambda: PromptGenerator.generate_campaign_payloads(
+        structured, BrandStyle.MINIMALIST, "1:1", False), repeat * 200)
+    plan_json = "```json\n" + json.dumps([{"title": f"Shot {i}", "description": brief * 3} for i in range(8)]) + "\n```"
+    client = _CannedClient(plan_json)
+    results["shot_list_parse[8 shots]"] = bench(lambda: ShotListGenerator.generate_shot_list(client, brief), repeat * 200)
+
+    return results
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> int:
+    """Print a comparison table. Returns the number of regressions."""
+    regressions = 0
+    print(f"\n{'benchmark':<36}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for name, stats in current.items():
+        base = baseline.get(name)
+        if not base or not base["median_s"]:
+            print(f"{name:<36}{'-':>12}{stats['median_s']:>12.6f}{'new':>8}")
+            continue
+        ratio = stats["median_s"] / base["median_s"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{name:<36}{base['median_s']:>12.6f}{stats['median_s']:>12.6f}{ratio:>8.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ella Studio micro-benchmarks")
+    parser.add_argument("--sizes", default="10,1000,10000", help="Comma-separated studio sizes")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--payload-edge", type=int, default=96, help="Edge (px) of the synthetic image stored per seeded row")
+    parser.add_argument("--out", default="bench_results/latest.json")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before flagging (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    db.DB_FILE = os.path.join(tempfile.mkdtemp(prefix="ella-bench-"), "studio.db")
+    db.init_db()
+
+    started = time.perf_counter()
+    results = run(sizes, args.repeat, args.payload_edge)
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sqlite": sqlite3.sqlite_version,
+            "storage": f"{storage.BACKEND}+{storage.BLOBS.name}",
+            "sizes": sizes,
+            "repeat": args.repeat,
+            "payload_edge": args.payload_edge,
+            "total_s": round(time.perf_counter() - started, 2),
+        },
+        "results": results,
+    }
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, stats in results.items():
+        print(f"{name:<36}{stats['median_s']:>12.6f}s  (min {stats['min_s']:.6f}s, {stats['runs']} runs)")
+    print(f"\nWrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{regressions} regression(s) beyond {args.tolerance:.0%}.")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
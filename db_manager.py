@@ -3,22 +3,187 @@ Author: Steven Lansangan
 """
 import sqlite3
 import os
+import sys
+import time
+import logging
+import threading
 import bcrypt
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta
 import json
 
+import storage
+from image_utils import b64_size
+
 DB_FILE = os.getenv("DB_PATH", "data/studio.db")
 
+# Query profiling (optional): DB_PROFILE=1 enables it, DB_SLOW_MS sets the slow-query threshold
+DB_PROFILE = os.getenv("DB_PROFILE", "0") == "1"
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_MS", "50"))
+
+profile_logger = logging.getLogger("ella.db")
+if not profile_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    profile_logger.addHandler(_handler)
+    profile_logger.propagate = False
+profile_logger.setLevel(logging.INFO)
+
+class QueryProfiler:
+    """Aggregates statement timings, rows and payload bytes per db_manager function."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.functions = {}
+            self.slow_queries = deque(maxlen=50)
+            self.plans = {}  # sql -> {"plan": [...], "full_scan": bool}
+
+    def record(self, function, sql, seconds, rows, nbytes, vm_steps):
+        with self._lock:
+            stat = self.functions.setdefault(function, {"calls": 0, "total_s": 0.0, "max_s": 0.0, "rows": 0, "bytes": 0, "vm_steps": 0})
+            stat["calls"] += 1
+            stat["total_s"] += seconds
+            stat["max_s"] = max(stat["max_s"], seconds)
+            stat["rows"] += rows
+            stat["bytes"] += nbytes
+            stat["vm_steps"] += vm_steps
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            entry = {"event": "slow_query", "function": function, "ms": round(seconds * 1000, 1),
+                     "rows": rows, "bytes": nbytes, "sql": " ".join(sql.split())}
+            with self._lock:
+                self.slow_queries.append(entry)
+            profile_logger.warning(json.dumps(entry))
+
+    def explain(self, conn, sql, params):
+        """Capture EXPLAIN QUERY PLAN once per distinct statement; flag full table scans."""
+        key = " ".join(sql.split())
+        with self._lock:
+            if key in self.plans:
+                return
+            self.plans[key] = None  # Claim it so concurrent callers don't explain twice
+        try:
+            cur = sqlite3.Cursor(conn)  # Plain cursor: not profiled
+            cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+            detail = [row[3] for row in cur.fetchall()]
+            cur.close()
+        except sqlite3.Error:
+            detail = []
+        # "SCAN gallery" = full scan; "SCAN gallery USING INDEX ..." / "SEARCH ..." are index driven.
+        # Scans of subquery results (CO-ROUTINE / MATERIALIZE), virtual tables (FTS) and the schema are not.
+        derived = {d.split(" ", 1)[1] for d in detail if d.startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+        full_scan = any(d.startswith("SCAN ") and " USING " not in d and " VIRTUAL TABLE " not in d
+                        and d[5:] not in derived and not d[5:].startswith("sqlite_") for d in detail)
+        with self._lock:
+            self.plans[key] = {"plan": detail, "full_scan": full_scan}
+        if full_scan:
+            profile_logger.warning(json.dumps({"event": "full_scan", "sql": key, "plan": detail}))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "functions": {k: dict(v) for k, v in self.functions.items()},
+                "slow_queries": list(self.slow_queries),
+                "full_scans": {sql: p["plan"] for sql, p in self.plans.items() if p and p["full_scan"]},
+            }
+
+PROFILER = QueryProfiler()
+
+def _row_bytes(row):
+    total = 0
+    for value in row:
+        if isinstance(value, (str, bytes)):
+            total += len(value)
+        elif value is not None:
+            total += 8
+    return total
+
+class ProfilingCursor(sqlite3.Cursor):
+    """Times each statement (execute + fetch) and counts rows / payload bytes returned."""
+
+    def _caller(self):
+        frame = sys._getframe(2)
+        while frame and frame.f_locals.get("self") is self:
+            frame = frame.f_back
+        return frame.f_code.co_name if frame else "?"
+
+    def execute(self, sql, params=()):
+        self._function = self._caller()
+        self._sql = sql
+        self._rows = 0
+        self._bytes = 0
+        self.connection.vm_steps = 0
+        if sql.lstrip()[:6].upper() in ("SELECT", "UPDATE", "DELETE"):
+            PROFILER.explain(self.connection, sql, params)
+        start = time.perf_counter()
+        result = super().execute(sql, params)
+        self._elapsed = time.perf_counter() - start
+        if self.description is None:
+            # No result set (INSERT/UPDATE/DELETE/DDL): done now
+            self._record()
+        return result
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._elapsed += time.perf_counter() - start
+        if row is not None:
+            self._rows += 1
+            self._bytes += _row_bytes(row)
+        self._record()
+        return row
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._elapsed += time.perf_counter() - start
+        self._rows += len(rows)
+        self._bytes += sum(_row_bytes(r) for r in rows)
+        self._record()
+        return rows
+
+    def _record(self):
+        if getattr(self, "_sql", None) is None:
+            return
+        PROFILER.record(self._function, self._sql, self._elapsed, self._rows, self._bytes, self.connection.vm_steps)
+        self._sql = None
+
+class ProfilingConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.vm_steps = 0
+        # Progress handler fires every 1000 VM instructions: a cheap work counter per statement
+        self.set_progress_handler(self._tick, 1000)
+
+    def _tick(self):
+        self.vm_steps += 1000
+        return 0
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
 def get_db_connection():
+    if storage.is_postgres():
+        return storage.pg_connect()  # Pooled; close() returns it to the pool
     if not os.path.exists("data"):
         os.makedirs("data")
-    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False,
+                           factory=ProfilingConnection if DB_PROFILE else sqlite3.Connection)
     conn.row_factory = sqlite3.Row
     return conn
 
 def init_db():
     conn = get_db_connection()
+    if storage.is_postgres():
+        storage.init_postgres(conn)
+        conn.close()
+        return
     c = conn.cursor()
+    # Lets maintenance.py hand freed pages back to the OS (takes effect on new databases, or after one VACUUM)
+    c.execute('PRAGMA auto_vacuum = INCREMENTAL')
     
     # Users
     c.execute('''
@@ -68,15 +233,225 @@ def init_db():
         )
     ''')
     
+    # Campaigns (one INITIATE SHOOT run, all its candidates link back here)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS campaigns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            brief TEXT,
+            created_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Batch Jobs (offline bulk generation via the provider batch interface)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS batch_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            campaign_id INTEGER,
+            provider_job TEXT NOT NULL,
+            backend TEXT NOT NULL,
+            status TEXT NOT NULL,
+            item_count INTEGER DEFAULT 0,
+            ingested_count INTEGER DEFAULT 0,
+            failed_count INTEGER DEFAULT 0,
+            manifest TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    
+    # Remix Sessions (multi-turn edit chains; context = backend conversation state)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS remix_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            category TEXT NOT NULL,
+            base_item_id INTEGER,
+            head_item_id INTEGER,
+            original_prompt TEXT,
+            model TEXT,
+            turns TEXT,
+            context TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_remix_sessions_head ON remix_sessions (user_id, head_item_id)')
+
+    # Generations (ledger: one row per model API call)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS generations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            flow TEXT NOT NULL,
+            model TEXT NOT NULL,
+            resolution TEXT,
+            aspect_ratio TEXT,
+            input_bytes INTEGER DEFAULT 0,
+            output_bytes INTEGER DEFAULT 0,
+            latency REAL,
+            retries INTEGER DEFAULT 0,
+            outcome TEXT NOT NULL,
+            cost REAL DEFAULT 0,
+            created_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    # Covering indexes for the admin aggregates (p95 per model, failure rate, spend per studio)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_generations_model_latency ON generations (model, latency)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_generations_model_outcome ON generations (model, outcome)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_generations_user_cost ON generations (user_id, cost)')
+
+    # Gallery lookups: newest-first per category and date-range filters (ISO-8601 text sorts chronologically)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_gallery_user_category ON gallery (user_id, category)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_gallery_user_timestamp ON gallery (user_id, timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_assets_user_category ON assets (user_id, category)')
+
     # Simple migration check
     try:
         c.execute('ALTER TABLE users ADD COLUMN password_hint TEXT')
     except sqlite3.OperationalError:
         pass
+    try:
+        c.execute('ALTER TABLE gallery ADD COLUMN campaign_id INTEGER')
+    except sqlite3.OperationalError:
+        pass
+    # Brief search matches gallery rows through their campaign
+    c.execute('CREATE INDEX IF NOT EXISTS idx_gallery_campaign ON gallery (campaign_id)')
+    # Lets batch_runner.py find the campaign of a shoot that crashed before checkpointing it
+    try:
+        c.execute('ALTER TABLE campaigns ADD COLUMN run_key TEXT')
+    except sqlite3.OperationalError:
+        pass
+    c.execute('CREATE INDEX IF NOT EXISTS idx_campaigns_user_run_key ON campaigns (user_id, run_key)')
+    # Perceptual hashes (64-bit dHash, see image_index.py)
+    for table in ('gallery', 'assets', 'models'):
+        try:
+            c.execute(f'ALTER TABLE {table} ADD COLUMN phash INTEGER')
+        except sqlite3.OperationalError:
+            pass
+    c.execute('CREATE INDEX IF NOT EXISTS idx_gallery_user_category_phash ON gallery (user_id, category, phash)')
+    # Colour palettes for vault matching (64-bin histogram, float16 BLOB)
+    for table in ('assets', 'models'):
+        try:
+            c.execute(f'ALTER TABLE {table} ADD COLUMN palette BLOB')
+        except sqlite3.OperationalError:
+            pass
+
+    # Derived renditions / metadata (filled at write time or by migrate.py)
+    for table in ('gallery', 'assets', 'models'):
+        for column, kind in (('thumb_base64', 'TEXT'), ('width', 'INTEGER'), ('height', 'INTEGER'), ('image_bytes', 'INTEGER')):
+            try:
+                c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {kind}')
+            except sqlite3.OperationalError:
+                pass
+
+    # Prompt size of each model call (see prompt_budget.py)
+    try:
+        c.execute('ALTER TABLE generations ADD COLUMN input_tokens INTEGER')
+    except sqlite3.OperationalError:
+        pass
+    c.execute('CREATE INDEX IF NOT EXISTS idx_generations_flow_tokens ON generations (flow, input_tokens)')
+
+    # Checkpoints for migrate.py (one row per step and table)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS migration_state (
+            step TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            last_id INTEGER DEFAULT 0,
+            rows_done INTEGER DEFAULT 0,
+            updated_at TEXT,
+            PRIMARY KEY (step, table_name)
+        )
+    ''')
+
+    # Retention (per studio, applied per gallery category) and maintenance history
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS retention_policies (
+            user_id INTEGER PRIMARY KEY,
+            keep_last INTEGER,
+            keep_days INTEGER,
+            updated_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT,
+            seconds REAL,
+            archived_items INTEGER DEFAULT 0,
+            archived_bytes INTEGER DEFAULT 0,
+            vacuum_bytes INTEGER DEFAULT 0,
+            orphan_blobs INTEGER DEFAULT 0,
+            orphan_bytes INTEGER DEFAULT 0,
+            details TEXT
+        )
+    ''')
+
+    # Backup history (see backup.py)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS backup_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            started_at TEXT,
+            status TEXT,
+            seconds REAL,
+            db_seconds REAL,
+            blob_seconds REAL,
+            db_bytes INTEGER DEFAULT 0,
+            steps INTEGER DEFAULT 0,
+            restarts INTEGER DEFAULT 0,
+            blobs_copied INTEGER DEFAULT 0,
+            blob_bytes INTEGER DEFAULT 0,
+            error TEXT
+        )
+    ''')
+
+    _init_gallery_fts(c)
         
     conn.commit()
     conn.close()
 
+FTS_ENABLED = True
+
+def _init_gallery_fts(c):
+    """Full-text index over gallery prompts and campaign briefs, kept in sync by triggers."""
+    global FTS_ENABLED
+    c.execute("SELECT 1 FROM sqlite_master WHERE name = 'gallery_fts'")
+    existed = c.fetchone() is not None
+    try:
+        # rowid = gallery.id
+        c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS gallery_fts USING fts5(prompt, brief, tokenize = 'unicode61 remove_diacritics 2')")
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5: search falls back to LIKE
+        print(f"FTS5 unavailable, gallery search uses LIKE: {e}")
+        FTS_ENABLED = False
+        return
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS gallery_fts_insert AFTER INSERT ON gallery BEGIN
+            INSERT INTO gallery_fts (rowid, prompt, brief)
+            VALUES (new.id, new.prompt, (SELECT brief FROM campaigns WHERE id = new.campaign_id));
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS gallery_fts_delete AFTER DELETE ON gallery BEGIN
+            DELETE FROM gallery_fts WHERE rowid = old.id;
+        END
+    ''')
+    if not existed:
+        # Backfill archives created before the index existed
+        c.execute('''INSERT INTO gallery_fts (rowid, prompt, brief)
+                     SELECT g.id, g.prompt, cp.brief FROM gallery g LEFT JOIN campaigns cp ON cp.id = g.campaign_id''')
+
+def _hydrate(rows, *columns):
+    """Swap blob-store references in image columns back to base64 (no-op for inline storage)."""
+    return storage.BLOBS.resolve_rows(rows, columns)
+
 # --- AUTH ---
 def create_user(username, password, hint=""):
     try:
@@ -88,7 +463,7 @@ def create_user(username, password, hint=""):
         conn.commit()
         conn.close()
         return True, "User created successfully."
-    except sqlite3.IntegrityError:
+    except storage.integrity_errors():
         return False, "Username already exists."
     except Exception as e:
         return False, str(e)
@@ -109,6 +484,14 @@ def get_all_users():
     conn.close()
     return [dict(row) for row in rows]
 
+def get_user_id(username):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT id FROM users WHERE username = ?', (username,))
+    row = c.fetchone()
+    conn.close()
+    return row['id'] if row else None
+
 def login_user(username, password):
     conn = get_db_connection()
     c = conn.cursor()
@@ -121,11 +504,12 @@ def login_user(username, password):
     return None
 
 # --- MODELS ---
-def add_model(user_id, name, face_b64, body_b64):
+def add_model(user_id, name, face_b64, body_b64, phash=None, palette=None):
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute('INSERT INTO models (user_id, name, face_base64, body_base64) VALUES (?, ?, ?, ?)', 
-              (user_id, name, face_b64, body_b64))
+    c.execute('INSERT INTO models (user_id, name, face_base64, body_base64, phash, palette, image_bytes) VALUES (?, ?, ?, ?, ?, ?, ?)', 
+              (user_id, name, storage.BLOBS.put_b64(face_b64), storage.BLOBS.put_b64(body_b64), phash, palette,
+               b64_size(face_b64) + b64_size(body_b64)))
     conn.commit()
     conn.close()
 
@@ -135,7 +519,7 @@ def get_models(user_id):
     c.execute('SELECT * FROM models WHERE user_id = ? ORDER BY id DESC', (user_id,))
     rows = c.fetchall()
     conn.close()
-    return [dict(row) for row in rows] # Convert to list of dicts
+    return _hydrate([dict(row) for row in rows], 'face_base64', 'body_base64') # Convert to list of dicts
 
 def delete_model(model_id):
     conn = get_db_connection()
@@ -145,11 +529,11 @@ def delete_model(model_id):
     conn.close()
 
 # --- ASSETS (Closet/Locations) ---
-def add_asset(user_id, category, name, image_b64):
+def add_asset(user_id, category, name, image_b64, phash=None, palette=None):
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute('INSERT INTO assets (user_id, category, name, image_base64) VALUES (?, ?, ?, ?)', 
-              (user_id, category, name, image_b64))
+    c.execute('INSERT INTO assets (user_id, category, name, image_base64, phash, palette, image_bytes) VALUES (?, ?, ?, ?, ?, ?, ?)', 
+              (user_id, category, name, storage.BLOBS.put_b64(image_b64), phash, palette, b64_size(image_b64)))
     conn.commit()
     conn.close()
 
@@ -159,7 +543,7 @@ def get_assets(user_id, category):
     c.execute('SELECT * FROM assets WHERE user_id = ? AND category = ? ORDER BY id DESC', (user_id, category))
     rows = c.fetchall()
     conn.close()
-    return [dict(row) for row in rows]
+    return _hydrate([dict(row) for row in rows], 'image_base64')
 
 def delete_asset(asset_id):
     conn = get_db_connection()
@@ -168,24 +552,197 @@ def delete_asset(asset_id):
     conn.commit()
     conn.close()
 
+def add_assets_bulk(user_id, category, rows):
+    """Insert many (name, image_b64, phash, palette) rows in one transaction."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.executemany('INSERT INTO assets (user_id, category, name, image_base64, phash, palette, image_bytes) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                  [(user_id, category, name, storage.BLOBS.put_b64(b64), phash, palette, b64_size(b64))
+                   for name, b64, phash, palette in rows])
+    conn.commit()
+    conn.close()
+
+def get_asset_hashes(user_id, category):
+    """(id, name, phash) of hashed assets in a category, without the image payload."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT id, name, phash FROM assets WHERE user_id = ? AND category = ? AND phash IS NOT NULL', (user_id, category))
+    rows = c.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def set_palette(table, row_id, palette):
+    """Store a colour palette on a vault row ('assets' or 'models')."""
+    if table not in ('assets', 'models'):
+        raise ValueError(f"No palette column on {table}")
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(f'UPDATE {table} SET palette = ? WHERE id = ?', (palette, row_id))
+    conn.commit()
+    conn.close()
+
+# --- CAMPAIGNS ---
+def create_campaign(user_id, brief, run_key=None):
+    created_at = datetime.now().isoformat()
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('INSERT INTO campaigns (user_id, brief, created_at, run_key) VALUES (?, ?, ?, ?)',
+              (user_id, brief, created_at, run_key))
+    campaign_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    return campaign_id
+
+def find_campaign(user_id, run_key):
+    """Id of the studio's campaign created with `run_key`, if any."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT id FROM campaigns WHERE user_id = ? AND run_key = ? ORDER BY id LIMIT 1', (user_id, run_key))
+    row = c.fetchone()
+    conn.close()
+    return row['id'] if row else None
+
+def get_campaign_prompts(campaign_id):
+    """(id, prompt) of a campaign's gallery rows, oldest first."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT id, prompt FROM gallery WHERE campaign_id = ? ORDER BY id', (campaign_id,))
+    rows = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return rows
+
 # --- GALLERY ---
-def add_gallery_item(user_id, category, prompt, image_b64):
+def add_gallery_item(user_id, category, prompt, image_b64, campaign_id=None, phash=None):
     timestamp = datetime.now().isoformat()
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute('INSERT INTO gallery (user_id, category, prompt, image_base64, timestamp) VALUES (?, ?, ?, ?, ?)', 
-              (user_id, category, prompt, image_b64, timestamp))
+    c.execute('INSERT INTO gallery (user_id, category, prompt, image_base64, timestamp, campaign_id, phash, image_bytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', 
+              (user_id, category, prompt, storage.BLOBS.put_b64(image_b64), timestamp, campaign_id, phash, b64_size(image_b64)))
+    item_id = c.lastrowid
     conn.commit()
     conn.close()
+    return item_id
+
+def add_gallery_items_bulk(user_id, category, rows, campaign_id=None):
+    """Insert many (prompt, image_b64, phash) rows in one transaction. Returns the new ids in order."""
+    timestamp = datetime.now().isoformat()
+    conn = get_db_connection()
+    c = conn.cursor()
+    ids = []
+    for prompt, image_b64, phash in rows:
+        c.execute('INSERT INTO gallery (user_id, category, prompt, image_base64, timestamp, campaign_id, phash, image_bytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                  (user_id, category, prompt, storage.BLOBS.put_b64(image_b64), timestamp, campaign_id, phash, b64_size(image_b64)))
+        ids.append(c.lastrowid)
+    conn.commit()
+    conn.close()
+    return ids
+
+# What grids and pickers list: everything but the full image, which get_gallery_items /
+# get_stored_image fetch for the one item that needs it (preview, remix, download)
+GALLERY_LIST_COLUMNS = ('id', 'user_id', 'category', 'prompt', 'timestamp', 'campaign_id', 'phash',
+                        'thumb_base64', 'width', 'height', 'image_bytes')
 
 def get_gallery(user_id, category):
+    """Gallery rows without the full image (GALLERY_LIST_COLUMNS), newest first."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(f'SELECT {", ".join(GALLERY_LIST_COLUMNS)} FROM gallery WHERE user_id = ? AND category = ? ORDER BY id DESC',
+              (user_id, category))
+    rows = c.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def _fts_query(text):
+    """User text -> FTS5 query: every word must match, as a prefix, with FTS syntax neutralised."""
+    terms = [t.replace('"', '""') for t in text.split()]
+    return " ".join(f'"{t}"*' for t in terms)
+
+def search_gallery(user_id, query=None, category=None, date_from=None, date_to=None, limit=24, offset=0):
+    """
+    Paged archive search, newest first. `query` matches prompts and campaign briefs; dates are
+    inclusive `date` bounds. Returns (items without the full image, total_matches).
+    """
+    where = ['g.user_id = ?']
+    params = [user_id]
+    if query and query.strip():
+        if storage.is_postgres():
+            tsquery = storage.pg_tsquery(query)
+            where.append(storage.PG_SEARCH_CLAUSE)
+            params += [tsquery, tsquery]
+        elif FTS_ENABLED:
+            # Resolve the MATCH once up front; as a join the planner may re-run it per gallery row
+            where.append('g.id IN (SELECT rowid FROM gallery_fts WHERE gallery_fts MATCH ?)')
+            params.append(_fts_query(query))
+        else:
+            where.append('g.prompt LIKE ?')
+            params.append(f"%{query.strip()}%")
+    if category:
+        where.append('g.category = ?')
+        params.append(category)
+    if date_from:
+        where.append('g.timestamp >= ?')
+        params.append(date_from.isoformat())
+    if date_to:
+        where.append('g.timestamp < ?')
+        params.append((date_to + timedelta(days=1)).isoformat())
+    clause = ' AND '.join(where)
+
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute('SELECT * FROM gallery WHERE user_id = ? AND category = ? ORDER BY id DESC', (user_id, category))
+    c.execute(f'SELECT COUNT(*) FROM gallery g WHERE {clause}', params)
+    total = c.fetchone()[0]
+    c.execute(f'SELECT {", ".join("g." + col for col in GALLERY_LIST_COLUMNS)} FROM gallery g WHERE {clause} '
+              'ORDER BY g.id DESC LIMIT ? OFFSET ?', params + [limit, offset])
+    rows = c.fetchall()
+    conn.close()
+    return [dict(row) for row in rows], total
+
+def get_gallery_items(item_ids):
+    """Gallery rows for the given ids, in the order given."""
+    if not item_ids:
+        return []
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(f'SELECT * FROM gallery WHERE id IN ({",".join("?" * len(item_ids))})', list(item_ids))
+    rows = {row['id']: dict(row) for row in c.fetchall()}
+    conn.close()
+    return _hydrate([rows[i] for i in item_ids if i in rows], 'image_base64')
+
+def get_stored_image(table, row_id, column='image_base64'):
+    """One row's image as base64 (blob references resolved), for rows listed without it."""
+    _check_columns(table, (column,))
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(f'SELECT {column} FROM {table} WHERE id = ?', (row_id,))
+    row = c.fetchone()
+    conn.close()
+    return storage.BLOBS.resolve(row[0]) if row else None
+
+def get_gallery_hashes(user_id, category):
+    """(id, phash) for every hashed item, newest first. Served from the covering index."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT id, phash FROM gallery WHERE user_id = ? AND category = ? AND phash IS NOT NULL ORDER BY id DESC',
+              (user_id, category))
     rows = c.fetchall()
     conn.close()
     return [dict(row) for row in rows]
 
+def get_gallery_missing_hashes(user_id, category):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT id, image_base64 FROM gallery WHERE user_id = ? AND category = ? AND phash IS NULL', (user_id, category))
+    rows = c.fetchall()
+    conn.close()
+    return _hydrate([dict(row) for row in rows], 'image_base64')
+
+def set_gallery_hash(item_id, phash):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('UPDATE gallery SET phash = ? WHERE id = ?', (phash, item_id))
+    conn.commit()
+    conn.close()
+
 def delete_gallery_item(item_id):
     conn = get_db_connection()
     c = conn.cursor()
@@ -200,6 +757,389 @@ def clear_gallery(user_id, category):
     conn.commit()
     conn.close()
 
+# --- MIGRATIONS / BACKFILLS (see migrate.py) ---
+MIGRATABLE_COLUMNS = {
+    'gallery': {'image_base64', 'phash', 'thumb_base64', 'width', 'height', 'image_bytes'},
+    'assets': {'image_base64', 'phash', 'palette', 'thumb_base64', 'width', 'height', 'image_bytes'},
+    'models': {'face_base64', 'body_base64', 'phash', 'palette', 'thumb_base64', 'width', 'height', 'image_bytes'},
+}
+
+def _check_columns(table, columns):
+    if table not in MIGRATABLE_COLUMNS or not set(columns) <= MIGRATABLE_COLUMNS[table]:
+        raise ValueError(f"Not migratable: {table} {sorted(columns)}")
+
+def get_rows_after(table, columns, after_id, limit, pending=()):
+    """
+    Next chunk of raw rows (blob references unresolved) with id > after_id, in id order.
+    With `pending`, only rows where any of those columns IS NULL.
+    """
+    _check_columns(table, set(columns) | set(pending))
+    where = 'id > ?'
+    if pending:
+        where += ' AND (' + ' OR '.join(f'{col} IS NULL' for col in pending) + ')'
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(f'SELECT id, {", ".join(columns)} FROM {table} WHERE {where} ORDER BY id LIMIT ?', (after_id, limit))
+    rows = c.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def get_max_id(table):
+    _check_columns(table, ())
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(f'SELECT MAX(id) FROM {table}')
+    row = c.fetchone()
+    conn.close()
+    return row[0] or 0
+
+def apply_migration_chunk(step, table, last_id, columns, updates):
+    """Write one chunk of converted rows [(id, {column: value})] and advance the checkpoint, in one transaction."""
+    _check_columns(table, columns)
+    conn = get_db_connection()
+    c = conn.cursor()
+    if updates:
+        c.executemany(f'UPDATE {table} SET {", ".join(f"{col} = ?" for col in columns)} WHERE id = ?',
+                      [[values.get(col) for col in columns] + [row_id] for row_id, values in updates])
+    c.execute('SELECT rows_done FROM migration_state WHERE step = ? AND table_name = ?', (step, table))
+    row = c.fetchone()
+    done = (row['rows_done'] if row else 0) + len(updates)
+    if row:
+        c.execute('UPDATE migration_state SET last_id = ?, rows_done = ?, updated_at = ? WHERE step = ? AND table_name = ?',
+                  (last_id, done, datetime.now().isoformat(), step, table))
+    else:
+        c.execute('INSERT INTO migration_state (step, table_name, last_id, rows_done, updated_at) VALUES (?, ?, ?, ?, ?)',
+                  (step, table, last_id, done, datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+
+def set_rendition(table, row_id, thumb_b64, width, height):
+    """Store a row's grid thumbnail and dimensions (generated on first view, see static_assets.py)."""
+    _check_columns(table, ('thumb_base64', 'width', 'height'))
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(f'UPDATE {table} SET thumb_base64 = ?, width = ?, height = ? WHERE id = ?', (thumb_b64, width, height, row_id))
+    conn.commit()
+    conn.close()
+
+def get_migration_state():
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT * FROM migration_state ORDER BY step, table_name')
+    rows = c.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def reset_migration_state(step):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('DELETE FROM migration_state WHERE step = ?', (step,))
+    conn.commit()
+    conn.close()
+
+# --- STORAGE ACCOUNTING / RETENTION (see maintenance.py) ---
+def get_storage_usage():
+    """
+    Items and image bytes per studio, table and category. Uses image_bytes where recorded, else the
+    inline payload length (run `migrate.py renditions` once so old rows don't need reading).
+    """
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''SELECT x.user_id, u.username, x.kind, x.category, x.items, x.bytes FROM (
+                     SELECT user_id, 'gallery' AS kind, category, COUNT(*) AS items,
+                            SUM(COALESCE(image_bytes, LENGTH(image_base64) * 3 / 4)) AS bytes
+                     FROM gallery GROUP BY user_id, category
+                     UNION ALL
+                     SELECT user_id, 'assets' AS kind, category, COUNT(*) AS items,
+                            SUM(COALESCE(image_bytes, LENGTH(image_base64) * 3 / 4)) AS bytes
+                     FROM assets GROUP BY user_id, category
+                     UNION ALL
+                     SELECT user_id, 'models' AS kind, 'models' AS category, COUNT(*) AS items,
+                            SUM(COALESCE(image_bytes, (COALESCE(LENGTH(face_base64), 0) + COALESCE(LENGTH(body_base64), 0)) * 3 / 4)) AS bytes
+                     FROM models GROUP BY user_id
+                 ) x LEFT JOIN users u ON u.id = x.user_id ORDER BY x.bytes DESC''')
+    rows = c.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def set_retention_policy(user_id, keep_last=None, keep_days=None):
+    """Keep a studio's newest `keep_last` items per category and/or `keep_days` days; both None removes the policy."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('DELETE FROM retention_policies WHERE user_id = ?', (user_id,))
+    if keep_last or keep_days:
+        c.execute('INSERT INTO retention_policies (user_id, keep_last, keep_days, updated_at) VALUES (?, ?, ?, ?)',
+                  (user_id, keep_last or None, keep_days or None, datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+
+def get_retention_policies():
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''SELECT p.*, u.username FROM retention_policies p LEFT JOIN users u ON u.id = p.user_id
+                 ORDER BY u.username''')
+    rows = c.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def get_retention_candidates(user_id, keep_last=None, keep_days=None):
+    """
+    {category: [gallery ids, oldest first]} outside the policy. An item is kept if it is among the
+    newest `keep_last` of its category or younger than `keep_days`.
+    """
+    if not keep_last and not keep_days:
+        return {}
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT DISTINCT category FROM gallery WHERE user_id = ?', (user_id,))
+    categories = [row['category'] for row in c.fetchall()]
+    candidates = {}
+    for category in categories:
+        where = ['user_id = ?', 'category = ?']
+        params = [user_id, category]
+        if keep_last:
+            # Older than the keep_last-th newest item; NULL (fewer items) matches nothing
+            where.append('id < (SELECT id FROM gallery WHERE user_id = ? AND category = ? ORDER BY id DESC LIMIT 1 OFFSET ?)')
+            params += [user_id, category, keep_last - 1]
+        if keep_days:
+            where.append('timestamp < ?')
+            params.append((datetime.now() - timedelta(days=keep_days)).isoformat())
+        c.execute(f'SELECT id FROM gallery WHERE {" AND ".join(where)} ORDER BY id', params)
+        ids = [row['id'] for row in c.fetchall()]
+        if ids:
+            candidates[category] = ids
+    conn.close()
+    return candidates
+
+def delete_gallery_items(item_ids):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.executemany('DELETE FROM gallery WHERE id = ?', [(i,) for i in item_ids])
+    conn.commit()
+    conn.close()
+
+def get_blob_refs(conn=None):
+    """Every blob key still referenced by a row (external blob stores only). `conn` reads another file, e.g. a backup."""
+    own = conn is None
+    if own:
+        conn = get_db_connection()
+    c = conn.cursor()
+    refs = set()
+    for table, column in (('gallery', 'image_base64'), ('assets', 'image_base64'), ('models', 'face_base64'), ('models', 'body_base64')):
+        c.execute(f"SELECT {column} FROM {table} WHERE {column} LIKE 'blob:%'")
+        refs.update(row[0][len(storage.BLOB_REF_PREFIX):] for row in c.fetchall())
+    if own:
+        conn.close()
+    return refs
+
+def get_page_stats():
+    """SQLite file layout: page size, pages, free pages and the auto_vacuum mode (2 = incremental)."""
+    if storage.is_postgres():
+        return None
+    conn = get_db_connection()
+    stats = {pragma: conn.execute(f'PRAGMA {pragma}').fetchone()[0]
+             for pragma in ('page_size', 'page_count', 'freelist_count', 'auto_vacuum')}
+    conn.close()
+    stats['file_bytes'] = os.path.getsize(DB_FILE) if os.path.exists(DB_FILE) else 0
+    return stats
+
+def enable_incremental_vacuum():
+    """Switch an existing database to incremental auto_vacuum. Runs one full VACUUM (blocks writers while it runs)."""
+    conn = get_db_connection()
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    conn.close()
+
+def incremental_vacuum(max_pages=0):
+    """Return up to `max_pages` free pages (0 = all) to the OS. Returns the bytes released."""
+    conn = get_db_connection()
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    # executescript steps the pragma to completion; execute() would free a single page
+    conn.executescript(f'PRAGMA incremental_vacuum({int(max_pages)});')
+    after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    conn.close()
+    return (before - after) * page_size
+
+def add_maintenance_run(started_at, seconds, archived_items, archived_bytes, vacuum_bytes, orphan_blobs, orphan_bytes, details):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''INSERT INTO maintenance_runs (started_at, seconds, archived_items, archived_bytes, vacuum_bytes,
+                 orphan_blobs, orphan_bytes, details) VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+              (started_at, seconds, archived_items, archived_bytes, vacuum_bytes, orphan_blobs, orphan_bytes, json.dumps(details)))
+    conn.commit()
+    conn.close()
+
+def get_maintenance_runs(limit=5):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT * FROM maintenance_runs ORDER BY id DESC LIMIT ?', (limit,))
+    rows = c.fetchall()
+    conn.close()
+    runs = [dict(row) for row in rows]
+    for run in runs:
+        run['details'] = json.loads(run['details']) if run['details'] else {}
+    return runs
+
+# --- BACKUPS (see backup.py) ---
+def add_backup_run(name, started_at, status, seconds, db_seconds, blob_seconds, db_bytes, steps, restarts,
+                   blobs_copied, blob_bytes, error=None):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''INSERT INTO backup_runs (name, started_at, status, seconds, db_seconds, blob_seconds, db_bytes, steps,
+                 restarts, blobs_copied, blob_bytes, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+              (name, started_at, status, seconds, db_seconds, blob_seconds, db_bytes, steps, restarts,
+               blobs_copied, blob_bytes, error))
+    conn.commit()
+    conn.close()
+
+def get_backup_runs(limit=5):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT * FROM backup_runs ORDER BY id DESC LIMIT ?', (limit,))
+    rows = c.fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+# --- BATCH JOBS ---
+def add_batch_job(user_id, campaign_id, provider_job, backend, item_count, manifest):
+    now = datetime.now().isoformat()
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''INSERT INTO batch_jobs (user_id, campaign_id, provider_job, backend, status, item_count, manifest, created_at, updated_at)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+              (user_id, campaign_id, provider_job, backend, 'SUBMITTED', item_count, json.dumps(manifest), now, now))
+    job_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    return job_id
+
+def get_batch_jobs(user_id=None, open_only=False):
+    conn = get_db_connection()
+    c = conn.cursor()
+    query = 'SELECT * FROM batch_jobs WHERE 1 = 1'
+    params = []
+    if user_id is not None:
+        query += ' AND user_id = ?'
+        params.append(user_id)
+    if open_only:
+        query += " AND status NOT IN ('SUCCEEDED', 'FAILED', 'CANCELLED', 'EXPIRED')"
+    c.execute(query + ' ORDER BY id DESC', params)
+    rows = c.fetchall()
+    conn.close()
+    jobs = [dict(row) for row in rows]
+    for job in jobs:
+        job['manifest'] = json.loads(job['manifest']) if job['manifest'] else {}
+    return jobs
+
+def update_batch_job(job_id, status, ingested_count=None, failed_count=None):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''UPDATE batch_jobs SET status = ?,
+                 ingested_count = COALESCE(?, ingested_count),
+                 failed_count = COALESCE(?, failed_count),
+                 updated_at = ? WHERE id = ?''',
+              (status, ingested_count, failed_count, datetime.now().isoformat(), job_id))
+    conn.commit()
+    conn.close()
+
+def ingest_batch_item(job_id, user_id, category, prompt, image_b64, campaign_id, phash, ingested_count, failed_count):
+    """
+    Store one batch render and advance the job's ingest counters in the same transaction, so a
+    crash can't leave a stored render that the resumed ingest would store again. Returns the item id.
+    """
+    now = datetime.now().isoformat()
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('INSERT INTO gallery (user_id, category, prompt, image_base64, timestamp, campaign_id, phash, image_bytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+              (user_id, category, prompt, storage.BLOBS.put_b64(image_b64), now, campaign_id, phash, b64_size(image_b64)))
+    item_id = c.lastrowid
+    c.execute("UPDATE batch_jobs SET status = 'INGESTING', ingested_count = ?, failed_count = ?, updated_at = ? WHERE id = ?",
+              (ingested_count, failed_count, now, job_id))
+    conn.commit()
+    conn.close()
+    return item_id
+
+# --- REMIX SESSIONS ---
+def _remix_session_row(row):
+    session = dict(row)
+    session['turns'] = json.loads(session['turns']) if session['turns'] else []
+    session['context'] = json.loads(session['context']) if session['context'] else {}
+    return session
+
+def create_remix_session(user_id, category, item_id, original_prompt, model):
+    now = datetime.now().isoformat()
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''INSERT INTO remix_sessions (user_id, category, base_item_id, head_item_id, original_prompt, model, turns, context, created_at, updated_at)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+              (user_id, category, item_id, item_id, original_prompt, model, '[]', '{}', now, now))
+    session_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    return session_id
+
+def get_remix_session(session_id):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT * FROM remix_sessions WHERE id = ?', (session_id,))
+    row = c.fetchone()
+    conn.close()
+    return _remix_session_row(row) if row else None
+
+def find_remix_session(user_id, head_item_id):
+    """The session whose latest output is this gallery item, if any."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT * FROM remix_sessions WHERE user_id = ? AND head_item_id = ? ORDER BY id DESC LIMIT 1', (user_id, head_item_id))
+    row = c.fetchone()
+    conn.close()
+    return _remix_session_row(row) if row else None
+
+def update_remix_session(session_id, head_item_id, turns, context):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('UPDATE remix_sessions SET head_item_id = ?, turns = ?, context = ?, updated_at = ? WHERE id = ?',
+              (head_item_id, json.dumps(turns), json.dumps(context), datetime.now().isoformat(), session_id))
+    conn.commit()
+    conn.close()
+
+# --- GENERATION LEDGER ---
+def add_generation(user_id, flow, model, resolution, aspect_ratio, input_bytes, output_bytes, latency, retries, outcome, cost,
+                   input_tokens=None):
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''INSERT INTO generations (user_id, flow, model, resolution, aspect_ratio, input_bytes, output_bytes,
+                 latency, retries, outcome, cost, input_tokens, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+              (user_id, flow, model, resolution, aspect_ratio, input_bytes, output_bytes, latency, retries, outcome, cost,
+               input_tokens, datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+
+def get_generation_stats():
+    """Per-model latency/failure figures, per-studio spend and prompt size per flow, answered from the ledger indexes."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''SELECT model, COUNT(*) AS calls, SUM(CASE WHEN outcome != 'ok' THEN 1 ELSE 0 END) AS failures
+                 FROM generations GROUP BY model ORDER BY calls DESC''')
+    models = [dict(row) for row in c.fetchall()]
+    for m in models:
+        # p95 = the latency at rank ceil(0.95 n): one seek into (model, latency)
+        offset = max(0, -(-m['calls'] * 95 // 100) - 1)
+        c.execute('SELECT latency FROM generations WHERE model = ? ORDER BY latency LIMIT 1 OFFSET ?', (m['model'], offset))
+        row = c.fetchone()
+        m['p95_latency'] = row['latency'] if row else None
+        m['failure_rate'] = m['failures'] / m['calls'] if m['calls'] else 0.0
+    c.execute('''SELECT g.user_id, u.username, g.spend, g.calls FROM
+                 (SELECT user_id, SUM(cost) AS spend, COUNT(*) AS calls FROM generations GROUP BY user_id) g
+                 LEFT JOIN users u ON u.id = g.user_id ORDER BY g.spend DESC''')
+    studios = [dict(row) for row in c.fetchall()]
+    c.execute('''SELECT flow, COUNT(input_tokens) AS calls, AVG(input_tokens) AS avg_tokens, MAX(input_tokens) AS max_tokens
+                 FROM generations WHERE input_tokens IS NOT NULL GROUP BY flow ORDER BY flow''')
+    flows = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return {"models": models, "studios": studios, "flows": flows}
+
 # Initial Init
 if __name__ == "__main__":
     init_db()
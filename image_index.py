@@ -0,0 +1,215 @@
+"""
+Author: Steven Lansangan
+
+Perceptual-hash index for near-duplicate detection, and a colour-palette index for vault matching.
+
+Every gallery and vault image gets a 64-bit dHash at save time (stored as a signed INTEGER
+column). Lookups load a studio's hashes into a NumPy uint64 array once and answer
+"find similar" / "collapse duplicates" with a vectorised XOR + popcount over the whole array.
+
+    DEDUPE_ON_SAVE=1      -> StudioEngine.save skips frames that near-duplicate an existing one
+    DEDUPE_DISTANCE=6     -> Hamming distance (of 64 bits) that counts as a duplicate
+
+Vault assets also get a 64-bin RGB colour histogram (4 levels per channel, float16 BLOB)
+at ingest. PaletteIndex stacks them into one matrix and ranks every location or model
+against the selected apparel with a single matrix-vector product (Bhattacharyya coefficient).
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import db_manager as db
+from image_utils import base64_to_image
+
+HASH_BITS = 64
+SIMILAR_DISTANCE = 12  # "Find similar": same look / composition
+DUPLICATE_DISTANCE = int(os.getenv("DEDUPE_DISTANCE", "6"))  # Re-rolls and retries of the same frame
+DEDUPE_ON_SAVE = os.getenv("DEDUPE_ON_SAVE", "0") == "1"
+
+# Bits set per byte value, for popcount on uint8 views
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def dhash(img: Image.Image) -> int:
+    """64-bit difference hash: brightness gradient across a 9x8 grayscale thumbnail."""
+    small = np.asarray(img.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = int(np.packbits(bits).view(">u8")[0])
+    # SQLite INTEGER is signed 64-bit
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def dhash_b64(b64: str) -> Optional[int]:
+    img = base64_to_image(b64)
+    return dhash(img) if img else None
+
+
+def hamming(hashes: np.ndarray, query: int) -> np.ndarray:
+    """Hamming distance from `query` to every hash in a uint64 array."""
+    xor = hashes ^ np.uint64(query & 0xFFFFFFFFFFFFFFFF)
+    return _POPCOUNT8[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+class HashIndex:
+    """A studio's gallery hashes for one category, as parallel id / uint64 arrays."""
+
+    def __init__(self, ids: List[int], hashes: List[int]):
+        self._ids = np.asarray(ids, dtype=np.int64)
+        self._hashes = np.asarray([h & 0xFFFFFFFFFFFFFFFF for h in hashes], dtype=np.uint64)
+        self._size = len(self._ids)
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._size]
+
+    @property
+    def hashes(self) -> np.ndarray:
+        return self._hashes[:self._size]
+
+    def add(self, item_id: int, phash: int):
+        """Append one hash (amortised O(1): the arrays grow by doubling)."""
+        if self._size == len(self._ids):
+            capacity = max(16, 2 * len(self._ids))
+            self._ids = np.resize(self._ids, capacity)
+            self._hashes = np.resize(self._hashes, capacity)
+        self._ids[self._size] = item_id
+        self._hashes[self._size] = phash & 0xFFFFFFFFFFFFFFFF
+        self._size += 1
+
+    @classmethod
+    def for_gallery(cls, user_id, category: str) -> "HashIndex":
+        fill_missing_gallery_hashes(user_id, category)
+        rows = db.get_gallery_hashes(user_id, category)
+        return cls([r['id'] for r in rows], [r['phash'] for r in rows])
+
+    def __len__(self):
+        return self._size
+
+    def similar(self, query: int, max_distance: int = SIMILAR_DISTANCE, exclude_id=None) -> List[Tuple[int, int]]:
+        """(item id, distance) pairs within max_distance, closest first."""
+        if not len(self.ids):
+            return []
+        dist = hamming(self.hashes, query)
+        mask = dist <= max_distance
+        if exclude_id is not None:
+            mask &= self.ids != exclude_id
+        idx = np.flatnonzero(mask)
+        idx = idx[np.argsort(dist[idx], kind="stable")]
+        return [(int(self.ids[i]), int(dist[i])) for i in idx]
+
+    def similar_to_item(self, item_id: int, max_distance: int = SIMILAR_DISTANCE) -> List[Tuple[int, int]]:
+        pos = np.flatnonzero(self.ids == item_id)
+        if not len(pos):
+            return []
+        return self.similar(int(self.hashes[pos[0]]), max_distance, exclude_id=item_id)
+
+    def collapse(self, max_distance: int = DUPLICATE_DISTANCE) -> Dict[int, List[int]]:
+        """
+        Group near-duplicates. Returns {representative id: [duplicate ids]} where the
+        representative is the first id in index order (newest first, as loaded).
+        """
+        groups = {}
+        unassigned = np.ones(len(self.ids), dtype=bool)
+        for i in range(len(self.ids)):
+            if not unassigned[i]:
+                continue
+            members = np.flatnonzero(unassigned & (hamming(self.hashes, int(self.hashes[i])) <= max_distance))
+            unassigned[members] = False
+            groups[int(self.ids[i])] = [int(self.ids[m]) for m in members if m != i]
+        return groups
+
+
+def fill_missing_gallery_hashes(user_id, category: str) -> int:
+    """Hash items saved before the index existed. Returns how many were filled."""
+    missing = db.get_gallery_missing_hashes(user_id, category)
+    filled = 0
+    for row in missing:
+        value = dhash_b64(row['image_base64'])
+        if value is not None:
+            db.set_gallery_hash(row['id'], value)
+            filled += 1
+    return filled
+
+
+def find_duplicate(user_id, category: str, phash: int, max_distance: int = DUPLICATE_DISTANCE) -> Optional[int]:
+    """Id of an existing gallery item that near-duplicates `phash`, if any."""
+    rows = db.get_gallery_hashes(user_id, category)
+    if not rows:
+        return None
+    matches = HashIndex([r['id'] for r in rows], [r['phash'] for r in rows]).similar(phash, max_distance)
+    return matches[0][0] if matches else None
+
+
+# --- COLOUR PALETTES ---
+PALETTE_LEVELS = 4  # Per channel -> 64 bins
+PALETTE_BINS = PALETTE_LEVELS ** 3
+
+
+def _smooth(hist: np.ndarray) -> np.ndarray:
+    """Spread each bin into its neighbours along R, G and B so near colours across a bin edge still overlap."""
+    cube = hist.reshape(PALETTE_LEVELS, PALETTE_LEVELS, PALETTE_LEVELS)
+    for axis in range(3):
+        padded = np.pad(cube, [(1, 1) if a == axis else (0, 0) for a in range(3)])
+        lo = np.take(padded, range(0, PALETTE_LEVELS), axis=axis)
+        hi = np.take(padded, range(2, PALETTE_LEVELS + 2), axis=axis)
+        cube = 0.5 * cube + 0.25 * (lo + hi)
+    return cube.ravel()
+
+
+def palette(img: Image.Image) -> bytes:
+    """Normalised, smoothed 64-bin RGB histogram of a 64x64 thumbnail, as float16 bytes (128 B)."""
+    small = np.asarray(img.convert("RGB").resize((64, 64), Image.BILINEAR), dtype=np.uint16)
+    q = small // (256 // PALETTE_LEVELS)
+    bins = (q[..., 0] * PALETTE_LEVELS + q[..., 1]) * PALETTE_LEVELS + q[..., 2]
+    hist = _smooth(np.bincount(bins.ravel(), minlength=PALETTE_BINS).astype(np.float32))
+    return (hist / hist.sum()).astype(np.float16).tobytes()
+
+
+def palette_b64(b64: str) -> Optional[bytes]:
+    img = base64_to_image(b64)
+    return palette(img) if img else None
+
+
+class PaletteIndex:
+    """Vault rows stacked into an (n, 64) matrix of sqrt-histograms; rows are unit length."""
+
+    def __init__(self, ids: List[int], blobs: List[bytes]):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        if blobs:
+            hist = np.frombuffer(b"".join(blobs), dtype=np.float16).reshape(-1, PALETTE_BINS).astype(np.float32)
+        else:
+            hist = np.zeros((0, PALETTE_BINS), dtype=np.float32)
+        self.matrix = np.sqrt(hist)
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict], key: str = 'palette') -> "PaletteIndex":
+        rows = [r for r in rows if r.get(key)]
+        return cls([r['id'] for r in rows], [r[key] for r in rows])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rank(self, query: bytes, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """(id, similarity 0..1) best first. Similarity = sum(sqrt(p * q))."""
+        if not len(self.ids):
+            return []
+        q = np.sqrt(np.frombuffer(query, dtype=np.float16).astype(np.float32))
+        scores = self.matrix @ q
+        order = np.argsort(-scores, kind="stable")[:limit]
+        return [(int(self.ids[i]), float(scores[i])) for i in order]
+
+
+def fill_missing_palettes(rows: List[Dict], table: str, image_key: str) -> int:
+    """Compute palettes for vault rows ingested before the index existed (updates rows in place)."""
+    filled = 0
+    for row in rows:
+        if row.get('palette') or not row.get(image_key):
+            continue
+        blob = palette_b64(row[image_key])
+        if blob:
+            db.set_palette(table, row['id'], blob)
+            row['palette'] = blob
+            filled += 1
+    return filled
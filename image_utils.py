@@ -0,0 +1,73 @@
+"""
+Author: Steven Lansangan
+"""
+import base64
+import zipfile
+from io import BytesIO
+from typing import Optional
+from PIL import Image
+
+THUMB_SIZE = (384, 384)  # Gallery grid / vault card rendition
+
+def base64_to_image(base64_string: str) -> Optional[Image.Image]:
+    """Convert base64 string to PIL Image."""
+    try:
+        if not base64_string:
+            return None
+        # Handle data:image/png;base64, prefix if present
+        if "," in base64_string:
+            base64_string = base64_string.split(",")[1]
+        image_data = base64.b64decode(base64_string)
+        return Image.open(BytesIO(image_data))
+    except Exception:
+        return None
+
+def load_and_resize(b64_str, max_size=None):
+    """Load base64 image and optionally resize it."""
+    if not b64_str: return None
+    img = base64_to_image(b64_str)
+    if img:
+        # Convert to RGB to ensure compatibility
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        # Resize if max_size is provided (tuple)
+        if max_size:
+            img.thumbnail(max_size)
+    return img
+
+def pil_to_png_bytes(img) -> bytes:
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+def pil_to_base64(img) -> str:
+    """PNG-encode a PIL image for gallery storage."""
+    return base64.b64encode(pil_to_png_bytes(img)).decode('utf-8')
+
+def pil_to_thumbnail_base64(img, size=THUMB_SIZE) -> str:
+    """Small JPEG rendition for grids; the full PNG stays the source of truth."""
+    thumb = img.convert('RGB')
+    thumb.thumbnail(size)
+    buf = BytesIO()
+    thumb.save(buf, format="JPEG", quality=80, optimize=True)
+    return base64.b64encode(buf.getvalue()).decode('utf-8')
+
+def b64_size(b64_str) -> int:
+    """Decoded byte size of a base64 payload, without decoding it."""
+    if not b64_str:
+        return 0
+    b64_str = b64_str.split(",")[-1]
+    return len(b64_str) * 3 // 4 - b64_str[-2:].count("=")
+
+def write_gallery_zip(items, prefix: str, fileobj):
+    """Write the Download All archive for a list of gallery rows to a file or buffer, one image at a time."""
+    with zipfile.ZipFile(fileobj, "w") as zf:
+        for idx, item in enumerate(items):
+            img_data = base64.b64decode(item['image_base64'])
+            zf.writestr(f"{prefix}_{idx}_{item['timestamp'][:10]}.png", img_data)
+
+def gallery_zip_bytes(items, prefix: str) -> bytes:
+    """Build the Download All archive for a list of gallery rows."""
+    zip_buffer = BytesIO()
+    write_gallery_zip(items, prefix, zip_buffer)
+    return zip_buffer.getvalue()
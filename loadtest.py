@@ -0,0 +1,238 @@
+"""
+Author: Steven Lansangan
+
+Load-test harness: K concurrent studio sessions against a local fake Gemini backend.
+
+Each simulated session does what a user does in the app, through the same code paths:
+login -> vault browse -> plan -> 3-8 shot shoot -> gallery scroll -> download all.
+Streamlit runs every session's script in a thread of one process, so sessions are threads here too.
+API latency and output sizes come from a latency profile (recorded samples or a distribution).
+
+Usage:
+    python loadtest.py --sessions 8 [--iterations 2] [--profile profile.json] [--time-scale 0.1] [--json out.json]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from PIL import Image
+
+import db_manager as db
+from image_utils import base64_to_image, pil_to_base64, gallery_zip_bytes
+from prompt_engine import BrandStyle
+from studio_engine import StudioEngine, LatencyProfileBackend, ShootRefs
+
+ACTIONS = ["login", "vault_browse", "plan", "shoot", "gallery_scroll", "download_all"]
+PASSWORD = "loadtest"
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {action: [] for action in ACTIONS}
+        self.errors = {action: 0 for action in ACTIONS}
+
+    def timed(self, action, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            print(f"[{action}] error: {e}")
+            with self._lock:
+                self.errors[action] += 1
+            return None
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.samples[action].append(elapsed)
+
+
+class ResourceSampler(threading.Thread):
+    """Samples process RSS while the test runs (peak and mean)."""
+
+    def __init__(self, interval=0.25):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.rss = []
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def current_rss_mb() -> float:
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        # Fallback: peak RSS (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if peak > 1 << 30 else peak / 1024
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.rss.append(self.current_rss_mb())
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _synthetic_b64(edge, seed):
+    rng = random.Random(seed)
+    small = Image.new("RGB", (16, 16), tuple(rng.randrange(256) for _ in range(3)))
+    noise = Image.effect_noise((edge // 8, edge // 8), 40).convert("RGB").resize((edge, edge))
+    return pil_to_base64(Image.blend(small.resize((edge, edge)), noise, 0.5))
+
+
+def seed_studios(count: int, assets_per_category: int, asset_edge: int) -> List[str]:
+    """Create (or reuse) loadtest studios, each with a small vault."""
+    names = []
+    for n in range(count):
+        name = f"loadtest_{n}"
+        names.append(name)
+        if db.get_user_id(name):
+            continue
+        db.create_user(name, PASSWORD)
+        user_id = db.get_user_id(name)
+        b64 = _synthetic_b64(asset_edge, n)
+        db.add_model(user_id, f"Model {n}", b64, b64)
+        for i in range(assets_per_category):
+            db.add_asset(user_id, "closet", f"Look {i}", b64)
+            db.add_asset(user_id, "location", f"Set {i}", b64)
+    return names
+
+
+def run_session(engine: StudioEngine, studio: str, recorder: Recorder, iterations: int, rng: random.Random):
+    user_id = recorder.timed("login", db.login_user, studio, PASSWORD)
+    if not user_id:
+        return
+
+    for _ in range(iterations):
+        # Vault browse: the app loads every list, then decodes the selected cards
+        def browse():
+            models = db.get_models(user_id)
+            apparel = db.get_assets(user_id, "closet")
+            locations = db.get_assets(user_id, "location")
+            picks = (rng.choice(models), rng.choice(apparel), rng.choice(locations))
+            for asset in picks:
+                base64_to_image(asset.get('face_base64') or asset.get('image_base64')).load()
+            return picks
+        picks = recorder.timed("vault_browse", browse)
+        if not picks:
+            continue
+
+        brief = "Red silk slip dress, golden hour, rooftop"
+        shots = recorder.timed("plan", engine.plan, brief, None, rng.randint(3, 8), user_id) or []
+
+        def shoot():
+            refs = ShootRefs.from_assets(*picks)
+            campaign_id = db.create_campaign(user_id, brief)
+            for shot in shots:
+                request = engine.shoot_request(shot['description'], BrandStyle.LUXURY, "9:16", refs, image_size="2K")
+                result = engine.generate(request, user_id=user_id)
+                if result.image:
+                    engine.save(user_id, 'apparel', shot['description'][:100], result.image, campaign_id=campaign_id)
+        recorder.timed("shoot", shoot)
+
+        # Gallery scroll: the archive lists rows without images and decodes their thumbnails
+        def scroll():
+            for item in db.get_gallery(user_id, 'apparel'):
+                thumb = item['thumb_base64'] or db.get_stored_image('gallery', item['id'])
+                base64_to_image(thumb).load()
+        recorder.timed("gallery_scroll", scroll)
+
+        recorder.timed("download_all", lambda: gallery_zip_bytes(
+            db.get_gallery_items([item['id'] for item in db.get_gallery(user_id, 'apparel')]), "shoot"))
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def report(recorder: Recorder, wall_s: float, cpu_s: float, rss: List[float]) -> Dict:
+    actions = {}
+    for action in ACTIONS:
+        values = recorder.samples[action]
+        actions[action] = {
+            "count": len(values),
+            "errors": recorder.errors[action],
+            "p50_s": round(percentile(values, 0.50), 4),
+            "p95_s": round(percentile(values, 0.95), 4),
+            "p99_s": round(percentile(values, 0.99), 4),
+        }
+    return {
+        "wall_s": round(wall_s, 2),
+        "cpu_s": round(cpu_s, 2),
+        "cpu_util": round(cpu_s / wall_s, 2) if wall_s else 0.0,
+        "rss_peak_mb": round(max(rss), 1) if rss else 0.0,
+        "rss_mean_mb": round(sum(rss) / len(rss), 1) if rss else 0.0,
+        "actions": actions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ella Studio load test (fake backend)")
+    parser.add_argument("--sessions", type=int, default=4, help="Concurrent studio sessions (K)")
+    parser.add_argument("--iterations", type=int, default=1, help="Shoot cycles per session")
+    parser.add_argument("--profile", help="Latency profile JSON (see LatencyProfileBackend)")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiply profile latencies (0.1 = 10x faster)")
+    parser.add_argument("--assets", type=int, default=10, help="Vault assets per category per studio")
+    parser.add_argument("--asset-edge", type=int, default=1000, help="Vault image edge in px")
+    parser.add_argument("--db", help="SQLite file for the run (default: fresh temp file)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    db.DB_FILE = args.db or os.path.join(tempfile.mkdtemp(prefix="ella-load-"), "studio.db")
+    db.init_db()
+
+    profile = None
+    if args.profile:
+        with open(args.profile) as f:
+            profile = json.load(f)
+    engine = StudioEngine(LatencyProfileBackend(profile, time_scale=args.time_scale, seed=args.seed))
+
+    print(f"Seeding {args.sessions} studios into {db.DB_FILE}...")
+    studios = seed_studios(args.sessions, args.assets, args.asset_edge)
+
+    recorder = Recorder()
+    sampler = ResourceSampler()
+    sampler.start()
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        for n, studio in enumerate(studios):
+            pool.submit(run_session, engine, studio, recorder, args.iterations, random.Random(args.seed + n))
+
+    wall_s = time.perf_counter() - start
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+    sampler.stop()
+    cpu_s = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+
+    result = report(recorder, wall_s, cpu_s, sampler.rss)
+    print(f"\n{'action':<16}{'n':>6}{'err':>5}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for action, stats in result["actions"].items():
+        print(f"{action:<16}{stats['count']:>6}{stats['errors']:>5}{stats['p50_s']:>10.3f}{stats['p95_s']:>10.3f}{stats['p99_s']:>10.3f}")
+    print(f"\nwall {result['wall_s']}s | cpu {result['cpu_s']}s ({result['cpu_util']} cores) | "
+          f"rss peak {result['rss_peak_mb']} MB, mean {result['rss_mean_mb']} MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), **result}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
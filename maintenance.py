@@ -0,0 +1,204 @@
+"""
+Author: Steven Lansangan
+
+Storage maintenance: retention, space reclamation and orphaned-blob cleanup.
+
+    1. Retention  -> per-studio policies (keep the newest N per category and/or X days). Items
+                     outside a policy are written to a ZIP in ARCHIVE_DIR/<studio>/ (PNGs plus
+                     manifest.jsonl), then deleted from the gallery.
+    2. Vacuum     -> PRAGMA incremental_vacuum hands freed pages back to the OS. Databases created
+                     before incremental auto_vacuum need a one-time --enable-incremental-vacuum.
+    3. Orphans    -> with an external BLOB_STORE, blobs no row references any more (older than a
+                     grace period, so in-flight saves are safe) are deleted. Published static
+                     renditions not served for STATIC_MAX_AGE_D days are dropped too.
+
+Usage:
+    python maintenance.py [--dry-run] [--no-retention] [--no-vacuum] [--no-sweep] [--enable-incremental-vacuum]
+"""
+import argparse
+import base64
+import json
+import os
+import threading
+import time
+import zipfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import db_manager as db
+import static_assets
+import storage
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "data/archive")
+ORPHAN_GRACE_S = float(os.getenv("ORPHAN_GRACE_S", "3600"))
+ARCHIVE_CHUNK = 100  # Gallery rows decoded per read while archiving
+USAGE_TTL_S = float(os.getenv("STORAGE_USAGE_TTL_S", "600"))
+
+_usage = {"rows": None, "at": 0.0}
+_usage_lock = threading.Lock()
+
+
+@dataclass
+class MaintenanceReport:
+    archived_items: int = 0
+    archived_bytes: int = 0
+    vacuum_bytes: int = 0
+    orphan_blobs: int = 0
+    orphan_bytes: int = 0
+    seconds: float = 0.0
+    archives: List[str] = field(default_factory=list)
+    notes: List[str] = field(default_factory=list)
+
+    @property
+    def reclaimed_bytes(self) -> int:
+        return self.vacuum_bytes + self.orphan_bytes
+
+    def summary(self) -> str:
+        return (f"archived {self.archived_items} items ({self.archived_bytes / 1e6:.1f} MB), "
+                f"vacuum freed {self.vacuum_bytes / 1e6:.1f} MB, "
+                f"{self.orphan_blobs} orphaned blobs removed ({self.orphan_bytes / 1e6:.1f} MB) in {self.seconds:.1f}s")
+
+
+def archive_items(username: str, category: str, item_ids: List[int]) -> Tuple[str, int]:
+    """Write gallery items to a ZIP (PNG + manifest line each). Returns (path, image bytes)."""
+    folder = os.path.join(ARCHIVE_DIR, username)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{category}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
+    tmp = f"{path}.tmp"
+    nbytes = 0
+    manifest = []
+    with zipfile.ZipFile(tmp, "w") as zf:
+        for start in range(0, len(item_ids), ARCHIVE_CHUNK):
+            for item in db.get_gallery_items(item_ids[start:start + ARCHIVE_CHUNK]):
+                data = base64.b64decode(item['image_base64'])
+                name = f"{item['id']}_{(item['timestamp'] or '')[:10]}.png"
+                zf.writestr(name, data)
+                nbytes += len(data)
+                manifest.append(json.dumps({"file": name, "id": item['id'], "prompt": item['prompt'],
+                                            "timestamp": item['timestamp'], "campaign_id": item['campaign_id']}))
+        zf.writestr("manifest.jsonl", "\n".join(manifest) + "\n")
+    # Only a complete archive gets its final name; rows are deleted after that
+    os.replace(tmp, path)
+    return path, nbytes
+
+
+def apply_retention(report: MaintenanceReport, dry_run: bool = False):
+    for policy in db.get_retention_policies():
+        candidates = db.get_retention_candidates(policy['user_id'], policy['keep_last'], policy['keep_days'])
+        for category, ids in candidates.items():
+            if dry_run:
+                report.notes.append(f"{policy['username']}/{category}: would archive {len(ids)} items")
+                report.archived_items += len(ids)
+                continue
+            path, nbytes = archive_items(policy['username'] or str(policy['user_id']), category, ids)
+            db.delete_gallery_items(ids)
+            report.archives.append(path)
+            report.archived_items += len(ids)
+            report.archived_bytes += nbytes
+
+
+def vacuum(report: MaintenanceReport, dry_run: bool = False):
+    stats = db.get_page_stats()
+    if stats is None:
+        report.notes.append("Postgres: space is reclaimed by autovacuum")
+        return
+    free_bytes = stats['freelist_count'] * stats['page_size']
+    if stats['auto_vacuum'] != 2:
+        report.notes.append(f"Incremental vacuum not enabled ({free_bytes / 1e6:.1f} MB free in file); "
+                            "run with --enable-incremental-vacuum once")
+        return
+    if dry_run:
+        report.notes.append(f"would free {free_bytes / 1e6:.1f} MB")
+        return
+    report.vacuum_bytes = db.incremental_vacuum()
+
+
+def sweep_orphan_blobs(report: MaintenanceReport, dry_run: bool = False, grace_s: float = ORPHAN_GRACE_S):
+    if not dry_run:
+        files, nbytes = static_assets.prune()
+        report.orphan_blobs += files
+        report.orphan_bytes += nbytes
+    if not storage.BLOBS.external:
+        return
+    referenced = db.get_blob_refs()
+    cutoff = time.time() - grace_s
+    orphans = [(key, size) for key, size, modified in list(storage.BLOBS.entries())
+               if key not in referenced and modified <= cutoff]
+    if orphans and not dry_run:
+        # Rows saved while we listed may reference a blob again (a dedupe hit): re-check before deleting
+        referenced = db.get_blob_refs()
+    for key, size in orphans:
+        if key in referenced:
+            continue
+        if not dry_run:
+            storage.BLOBS.delete(key)
+        report.orphan_blobs += 1
+        report.orphan_bytes += size
+
+
+def run_maintenance(retention: bool = True, vacuum_db: bool = True, sweep: bool = True, dry_run: bool = False) -> MaintenanceReport:
+    report = MaintenanceReport()
+    started_at = datetime.now().isoformat()
+    start = time.perf_counter()
+    if retention:
+        apply_retention(report, dry_run)
+    if sweep:
+        # Before vacuuming, so the vacuum also frees pages of rows deleted by retention
+        sweep_orphan_blobs(report, dry_run)
+    if vacuum_db:
+        vacuum(report, dry_run)
+    report.seconds = time.perf_counter() - start
+    if not dry_run:
+        db.add_maintenance_run(started_at, report.seconds, report.archived_items, report.archived_bytes,
+                               report.vacuum_bytes, report.orphan_blobs, report.orphan_bytes,
+                               {"archives": report.archives, "notes": report.notes})
+    return report
+
+
+def storage_usage(max_age_s: float = USAGE_TTL_S) -> List[Dict]:
+    """db.get_storage_usage, cached per process for `max_age_s` (it aggregates every image row)."""
+    with _usage_lock:
+        if _usage["rows"] is None or time.time() - _usage["at"] > max_age_s:
+            _usage["rows"], _usage["at"] = db.get_storage_usage(), time.time()
+        return _usage["rows"]
+
+
+def usage_by_studio(rows: List[Dict]) -> Dict[str, Dict[str, int]]:
+    """Collapse get_storage_usage rows to {studio: {"items", "bytes"}} for summaries."""
+    totals = {}
+    for row in rows:
+        t = totals.setdefault(row['username'] or str(row['user_id']), {"items": 0, "bytes": 0})
+        t["items"] += row['items']
+        t["bytes"] += row['bytes'] or 0
+    return dict(sorted(totals.items(), key=lambda kv: -kv[1]["bytes"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ella Studio storage maintenance")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be archived / freed")
+    parser.add_argument("--no-retention", action="store_true")
+    parser.add_argument("--no-vacuum", action="store_true")
+    parser.add_argument("--no-sweep", action="store_true")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="One-time full VACUUM that switches an existing database to incremental auto_vacuum")
+    args = parser.parse_args()
+
+    db.init_db()
+    if args.enable_incremental_vacuum and not storage.is_postgres():
+        start = time.perf_counter()
+        db.enable_incremental_vacuum()
+        print(f"Incremental auto_vacuum enabled in {time.perf_counter() - start:.1f}s")
+
+    for studio, total in usage_by_studio(db.get_storage_usage()).items():
+        print(f"{studio:<20} {total['items']:>7} items {total['bytes'] / 1e6:>9.1f} MB")
+    report = run_maintenance(not args.no_retention, not args.no_vacuum, not args.no_sweep, args.dry_run)
+    for note in report.notes:
+        print(note)
+    for path in report.archives:
+        print(f"Archived to {path}")
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Author: Steven Lansangan
+
+Per-session memory accounting for the Streamlit app.
+
+After every rerun the app measures what its session keeps alive between reruns (session
+state: decoded images, PNG/ZIP buffers, base64 strings, remix contexts) and reports it to
+REGISTRY, which the admin console lists per session (with its largest keys) next to the
+process RSS. A session over SESSION_MEM_BUDGET_MB drops the releasable keys the app names,
+rebuildable state first, until it fits.
+
+tracemalloc is off by default (it slows every allocation); start_profiling() turns it on and
+snapshot() returns the top allocation sites, plus the growth since the previous snapshot.
+
+    SESSION_MEM_BUDGET_MB=256   SESSION_TTL_S=1800 (sessions not seen for this long are forgotten)
+"""
+import dataclasses
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from io import BytesIO
+from typing import Dict, Iterable, List, Optional
+
+from PIL import Image
+
+SESSION_MEM_BUDGET = float(os.getenv("SESSION_MEM_BUDGET_MB", "256")) * 1024 * 1024
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "1800"))
+MAX_DEPTH = 8
+
+
+def estimate_size(obj, seen: Optional[set] = None, depth: int = 0) -> int:
+    """
+    Approximate bytes held by `obj`: decoded pixels of PIL images, buffer lengths, string
+    lengths, recursing through containers and dataclasses. Objects reached twice count once
+    (pass the same `seen` set to share that across calls).
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or depth > MAX_DEPTH:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, Image.Image):
+        return obj.width * obj.height * len(obj.getbands())
+    if isinstance(obj, (bytes, bytearray, str)):
+        return len(obj)
+    if isinstance(obj, memoryview):
+        return obj.nbytes
+    if isinstance(obj, BytesIO):
+        return obj.getbuffer().nbytes
+    if isinstance(obj, dict):
+        return sum(estimate_size(k, seen, depth + 1) + estimate_size(v, seen, depth + 1) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sum(estimate_size(v, seen, depth + 1) for v in obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return sum(estimate_size(getattr(obj, f.name), seen, depth + 1) for f in dataclasses.fields(obj))
+    # Anything else (clients, executors, widgets) is shared or small; don't walk it
+    return sys.getsizeof(obj, 0)
+
+
+def session_footprint(state) -> Dict[str, int]:
+    """Bytes per session-state key, largest first."""
+    seen = set()
+    sizes = {}
+    for key in list(state.keys()):
+        try:
+            sizes[str(key)] = estimate_size(state[key], seen)
+        except (KeyError, RuntimeError):
+            continue  # Changed under us by a widget callback
+    return dict(sorted(sizes.items(), key=lambda kv: -kv[1]))
+
+
+def process_rss() -> int:
+    """Resident set size of this process in bytes (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}  # session id -> {"user", "bytes", "top", "released", "over_budget", "seen_at"}
+
+    def update(self, session_id: str, user: Optional[str], footprint: Dict[str, int], released: List[str], budget: float):
+        total = sum(footprint.values())
+        with self._lock:
+            previous = self._sessions.get(session_id, {})
+            self._sessions[session_id] = {
+                "user": user,
+                "bytes": total,
+                "top": list(footprint.items())[:3],
+                "released": previous.get("released", 0) + len(released),
+                "over_budget": total > budget,
+                "seen_at": time.time(),
+            }
+
+    def sessions(self) -> List[Dict]:
+        """Live sessions, largest first; sessions idle past SESSION_TTL_S are dropped."""
+        cutoff = time.time() - SESSION_TTL_S
+        with self._lock:
+            for session_id in [s for s, v in self._sessions.items() if v["seen_at"] < cutoff]:
+                del self._sessions[session_id]
+            rows = [{"session": s, **v} for s, v in self._sessions.items()]
+        return sorted(rows, key=lambda r: -r["bytes"])
+
+
+REGISTRY = MemoryRegistry()
+
+
+def enforce(session_id: str, state, user: Optional[str] = None, releasable: Iterable[str] = (),
+            budget: float = SESSION_MEM_BUDGET) -> List[str]:
+    """
+    Measure a session after its rerun and, while it is over budget, drop `releasable` keys
+    (in the order given). Returns the keys released.
+    """
+    footprint = session_footprint(state)
+    released = []
+    for key in releasable:
+        if sum(footprint.values()) <= budget:
+            break
+        if footprint.get(key):
+            del state[key]
+            del footprint[key]
+            released.append(key)
+    if released:
+        gc.collect()  # Remix contexts and PIL images can sit in reference cycles
+    REGISTRY.update(session_id, user, footprint, released, budget)
+    return released
+
+
+# --- tracemalloc (on demand) ---
+_snapshot_lock = threading.Lock()
+_last_snapshot = None
+
+
+def is_profiling() -> bool:
+    return tracemalloc.is_tracing()
+
+
+def start_profiling(frames: int = 10):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def stop_profiling():
+    global _last_snapshot
+    with _snapshot_lock:
+        _last_snapshot = None
+    tracemalloc.stop()
+
+
+def snapshot(limit: int = 10) -> Dict:
+    """
+    Top allocation sites now ({"top": [(site, bytes, count)]}) and the largest growth since the
+    previous snapshot ({"growth": [(site, bytes delta)]}). Needs start_profiling() first.
+    """
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        return {"top": [], "growth": [], "traced": 0, "peak": 0}
+    snap = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ))
+    traced, peak = tracemalloc.get_traced_memory()
+    top = [(f"{s.traceback[0].filename}:{s.traceback[0].lineno}", s.size, s.count)
+           for s in snap.statistics("lineno")[:limit]]
+    with _snapshot_lock:
+        growth = []
+        if _last_snapshot is not None:
+            growth = [(f"{s.traceback[0].filename}:{s.traceback[0].lineno}", s.size_diff)
+                      for s in snap.compare_to(_last_snapshot, "lineno")[:limit] if s.size_diff > 0]
+        _last_snapshot = snap
+    return {"top": top, "growth": growth, "traced": traced, "peak": peak}
@@ -0,0 +1,195 @@
+"""
+Author: Steven Lansangan
+
+Resumable, throttled migrations / backfills over models, assets and gallery.
+
+Each step walks a table in id order, a chunk at a time. A chunk is read (image columns only),
+converted in a worker pool, and written back in one short transaction together with its
+checkpoint, so the app keeps serving in between and an interrupted run resumes where it stopped.
+Rows added after a run are picked up by the next run; --restart walks the table from the start.
+
+Steps:
+    renditions  -> thumb_base64 (JPEG, image_utils.THUMB_SIZE), width, height, image_bytes
+    hashes      -> phash (dHash) where missing
+    palettes    -> palette (colour histogram) on assets and models where missing
+    blobs       -> move inline base64 into the configured external BLOB_STORE (see storage.py)
+
+Usage:
+    python migrate.py renditions hashes [--tables gallery assets] [--chunk 200] [--max-mb-s 20] [--pause 0.1]
+    python migrate.py --status
+"""
+import argparse
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+import db_manager as db
+import storage
+from image_index import dhash, palette
+from image_utils import base64_to_image, b64_size, pil_to_thumbnail_base64
+
+TABLES = ("gallery", "assets", "models")
+IMAGE_COLUMNS = {"gallery": ("image_base64",), "assets": ("image_base64",), "models": ("face_base64", "body_base64")}
+
+
+@dataclass
+class Step:
+    name: str
+    writes: Tuple[str, ...]
+    convert: Callable[[str, Dict], Optional[Dict]]  # (table, raw row) -> new values, or None to leave the row
+    pending: Tuple[str, ...] = ()  # Only visit rows where one of these IS NULL
+    tables: Tuple[str, ...] = TABLES
+
+
+def _images(table: str, row: Dict):
+    """Base64 payloads of a row's image columns (a model's face first), with blob references resolved."""
+    return [storage.BLOBS.resolve(row[column]) for column in IMAGE_COLUMNS[table] if row.get(column)]
+
+
+def _primary_image(table: str, row: Dict):
+    for b64 in _images(table, row):
+        img = base64_to_image(b64)
+        if img:
+            return img
+    return None
+
+
+def convert_renditions(table, row):
+    payloads = _images(table, row)
+    img = base64_to_image(payloads[0]) if payloads else None
+    if img is None:
+        return None
+    return {"thumb_base64": pil_to_thumbnail_base64(img), "width": img.width, "height": img.height,
+            "image_bytes": sum(b64_size(b64) for b64 in payloads)}
+
+
+def convert_hashes(table, row):
+    img = _primary_image(table, row)
+    return {"phash": dhash(img)} if img else None
+
+
+def convert_palettes(table, row):
+    img = _primary_image(table, row)
+    return {"palette": palette(img)} if img else None
+
+
+def convert_blobs(table, row):
+    values = {column: row.get(column) for column in IMAGE_COLUMNS[table]}
+    if all(not v or v.startswith(storage.BLOB_REF_PREFIX) for v in values.values()):
+        return None
+    return {column: storage.BLOBS.put_b64(v) for column, v in values.items()}
+
+
+STEPS = {
+    "renditions": Step("renditions", ("thumb_base64", "width", "height", "image_bytes"), convert_renditions, pending=("thumb_base64",)),
+    "hashes": Step("hashes", ("phash",), convert_hashes, pending=("phash",)),
+    "palettes": Step("palettes", ("palette",), convert_palettes, pending=("palette",), tables=("assets", "models")),
+    "blobs": Step("blobs", (), convert_blobs),  # Writes the table's image columns
+}
+
+
+class Throttle:
+    """Caps the read rate (decoded image bytes per second) and adds a fixed pause between chunks."""
+
+    def __init__(self, max_mb_s: float, pause_s: float):
+        self.max_bytes_s = max_mb_s * 1024 * 1024 if max_mb_s > 0 else 0
+        self.pause_s = pause_s
+        self.started = time.perf_counter()
+        self.bytes = 0
+
+    def chunk_done(self, nbytes: int):
+        self.bytes += nbytes
+        wait = self.pause_s
+        if self.max_bytes_s:
+            wait = max(wait, self.bytes / self.max_bytes_s - (time.perf_counter() - self.started))
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _write(step: Step, table: str, last_id: int, updates, retries: int = 5):
+    """Apply a chunk, backing off while the app holds the write lock."""
+    for attempt in range(retries):
+        try:
+            columns = step.writes or IMAGE_COLUMNS[table]
+            # Rows a step could not convert are skipped; the checkpoint still moves past them
+            updates = [(row_id, values) for row_id, values in updates if values]
+            db.apply_migration_chunk(step.name, table, last_id, columns, updates)
+            return len(updates)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) or attempt == retries - 1:
+                raise
+            time.sleep(0.5 * 2 ** attempt)
+
+
+def run_step(step: Step, table: str, chunk: int, workers: int, throttle: Throttle, log=print) -> int:
+    state = {(s['step'], s['table_name']): s for s in db.get_migration_state()}
+    last_id = state.get((step.name, table), {}).get('last_id', 0)
+    target = db.get_max_id(table)
+    read_columns = IMAGE_COLUMNS[table]
+    converted = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while True:
+            rows = db.get_rows_after(table, read_columns, last_id, chunk, step.pending)
+            if not rows:
+                break
+            results = list(pool.map(lambda r: step.convert(table, r), rows))
+            last_id = rows[-1]['id']
+            converted += _write(step, table, last_id, [(r['id'], v) for r, v in zip(rows, results)])
+            throttle.chunk_done(sum(len(r[c] or "") * 3 // 4 for r in rows for c in read_columns))
+            rate = converted / max(time.perf_counter() - started, 1e-9)
+            log(f"{step.name}/{table}: id {last_id}/{target}, {converted} rows converted ({rate:.0f} rows/s)")
+    return converted
+
+
+def print_status():
+    state = db.get_migration_state()
+    if not state:
+        print("No migrations recorded.")
+    for s in state:
+        print(f"{s['step']:<11} {s['table_name']:<8} last id {s['last_id']:>8}  rows {s['rows_done']:>8}  at {s['updated_at']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ella Studio resumable migrations / backfills")
+    parser.add_argument("steps", nargs="*", help=f"Steps to run, in order: {', '.join(STEPS)}")
+    parser.add_argument("--tables", nargs="+", choices=TABLES, default=list(TABLES))
+    parser.add_argument("--chunk", type=int, default=200, help="Rows per read / write transaction")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-mb-s", type=float, default=20.0, help="Image bytes read per second (0 = unthrottled)")
+    parser.add_argument("--pause", type=float, default=0.05, help="Seconds to yield between chunks")
+    parser.add_argument("--restart", action="store_true", help="Forget checkpoints of the given steps")
+    parser.add_argument("--status", action="store_true")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.steps if name not in STEPS]
+    if unknown:
+        parser.error(f"unknown step(s): {', '.join(unknown)} (choose from {', '.join(STEPS)})")
+
+    db.init_db()
+    if args.status or not args.steps:
+        print_status()
+        return
+    if "blobs" in args.steps and not storage.BLOBS.external:
+        raise SystemExit("The blobs step needs an external store: set BLOB_STORE=fs or BLOB_STORE=s3.")
+    if not storage.is_postgres():
+        # WAL lets the app keep reading while chunks are written (persistent, one-time switch)
+        conn = db.get_db_connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.close()
+
+    throttle = Throttle(args.max_mb_s, args.pause)
+    for name in args.steps:
+        step = STEPS[name]
+        if args.restart:
+            db.reset_migration_state(name)
+        for table in args.tables:
+            if table in step.tables:
+                total = run_step(step, table, args.chunk, args.workers, throttle)
+                print(f"{name}/{table}: done, {total} rows converted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Author: Steven Lansangan
+
+Prompt token accounting and the optional compaction budget.
+
+Every model call records its input size in tokens (generations.input_tokens): text through
+TokenCounter, reference images by the Gemini per-image rules. Counts are cached by content
+hash, so the fixed blocks and repeated prompts are counted once per process.
+
+    TOKEN_COUNT=estimate   -> local estimate (default, no network)
+    TOKEN_COUNT=api        -> exact counts from the backend's count_tokens, in the background
+                              while the call runs (falls back to the estimate on error)
+    PROMPT_COMPACT=1       -> shoot prompts drop what the fixed blocks already say (see
+                              PromptGenerator.generate_shoot_payload)
+    PROMPT_TOKEN_BUDGET=N  -> with compaction on, the brief is shortened until the text prompt
+                              fits N tokens; the fixed blocks are never cut
+"""
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from PIL import Image
+
+TOKEN_COUNT = os.getenv("TOKEN_COUNT", "estimate")
+COMPACT = os.getenv("PROMPT_COMPACT", "0") == "1"
+TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "0"))
+
+MIN_BRIEF_WORDS = 12  # A budget below the fixed blocks still leaves the shot its subject
+CACHE_SIZE = 4096
+REMOTE_TIMEOUT_S = 5.0
+
+# Gemini image input: Gemini 3 bills a fixed amount per image (default media resolution);
+# earlier models bill 258 per image up to 384px, else 258 per 768px tile.
+GEMINI3_IMAGE_TOKENS = 1120
+TILE_TOKENS = 258
+TILE_EDGE = 768
+SMALL_IMAGE_EDGE = 384
+
+_WORDS = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_text_tokens(text: str) -> int:
+    """SentencePiece-like estimate: one token per punctuation mark, about one per 4 letters of a word."""
+    return sum(max(1, math.ceil(len(piece) / 4)) if piece[0].isalnum() else 1 for piece in _WORDS.findall(text or ""))
+
+
+def image_tokens(image: Any, model: str) -> int:
+    if model.startswith("gemini-3"):
+        return GEMINI3_IMAGE_TOKENS
+    if not isinstance(image, Image.Image):
+        return TILE_TOKENS  # Uploaded file reference: size unknown here
+    width, height = image.size
+    if width <= SMALL_IMAGE_EDGE and height <= SMALL_IMAGE_EDGE:
+        return TILE_TOKENS
+    return math.ceil(width / TILE_EDGE) * math.ceil(height / TILE_EDGE) * TILE_TOKENS
+
+
+class TokenCounter:
+    """Text token counts cached by (model, content hash); `remote(model, text)` gives exact counts."""
+
+    def __init__(self, remote: Optional[Callable[[str, str], int]] = None, max_entries: int = CACHE_SIZE):
+        self.remote = remote
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str, model: str):
+        # Estimates don't depend on the model; exact counts are tokenizer-specific
+        return (model if self.remote else "", hashlib.sha1(text.encode("utf-8")).digest())
+
+    def _get(self, key) -> Optional[int]:
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._cache.move_to_end(key)
+            return value
+
+    def _put(self, key, value: int):
+        with self._lock:
+            self._cache[key] = value
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _count(self, key, text: str, model: str) -> int:
+        if self.remote:
+            try:
+                value = self.remote(model, text)
+            except Exception as e:
+                print(f"Token count failed, using estimate: {e}")
+                return estimate_text_tokens(text)
+        else:
+            value = estimate_text_tokens(text)
+        self._put(key, value)
+        return value
+
+    def text_tokens(self, text: str, model: str) -> int:
+        key = self._key(text, model)
+        value = self._get(key)
+        return value if value is not None else self._count(key, text, model)
+
+    def count_later(self, model: str, texts: List[str], images: List[Any] = ()) -> Callable[[], int]:
+        """
+        Input tokens of a request (texts + images). Cached and estimated counts are computed
+        now; remote counts run in the background so they add no latency to the call itself.
+        Returns a function that yields the total.
+        """
+        fixed = sum(image_tokens(img, model) for img in images)
+        pending = []
+        for text in texts:
+            key = self._key(text, model)
+            value = self._get(key)
+            if value is not None:
+                fixed += value
+            elif self.remote:
+                pending.append((key, text))
+            else:
+                fixed += self._count(key, text, model)
+        if not pending:
+            return lambda: fixed
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ella-tokens")
+        futures = [(self._pool.submit(self._count, key, text, model), text) for key, text in pending]
+
+        def total() -> int:
+            counted = fixed
+            for future, text in futures:
+                try:
+                    counted += future.result(timeout=REMOTE_TIMEOUT_S)
+                except Exception:
+                    counted += estimate_text_tokens(text)
+            return counted
+        return total
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+COUNTER = TokenCounter()
+
+
+def fit_brief(build: Callable[[str], str], brief: str, budget: int) -> str:
+    """
+    Shorten `brief` until build(brief) fits `budget` estimated tokens: trailing sentences first,
+    then trailing words of the first sentence, never below MIN_BRIEF_WORDS. Returns the built prompt.
+    """
+    prompt = build(brief)
+    if estimate_text_tokens(prompt) <= budget:
+        return prompt
+    sentences = re.split(r"(?<=[.;!?])\s+", brief.strip())
+    while len(sentences) > 1:
+        sentences.pop()
+        prompt = build(" ".join(sentences))
+        if estimate_text_tokens(prompt) <= budget:
+            return prompt
+    words = sentences[0].split()
+    lo, hi = min(MIN_BRIEF_WORDS, len(words)), len(words)  # Largest word count that fits, by bisection
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_text_tokens(build(" ".join(words[:mid]))) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return build(" ".join(words[:lo]))
@@ -3,6 +3,7 @@ Author: Steven Lansangan
 """
 from enum import Enum
 import json
+import re
 from typing import List, Dict, Optional, Any
 
 class BrandStyle(Enum):
@@ -38,6 +39,40 @@ class PromptGenerator:
         "3d render, low contrast, grain, noise, watermark, text."
     )
 
+    # Tags ShotListGenerator is told to put in front of every description
+    PLANNER_TAGS = ("[Full Stable Diffusion Prompt]",)
+
+    @staticmethod
+    def _norm(text: str) -> str:
+        return " " + " ".join(re.findall(r"[a-z0-9]+", text.lower())) + " "
+
+    @staticmethod
+    def compact_brief(brief: str, fixed_text: str) -> str:
+        """Drop planner tags and the clauses of a brief that the fixed blocks already state verbatim."""
+        for tag in PromptGenerator.PLANNER_TAGS:
+            brief = brief.replace(tag, "")
+        fixed = PromptGenerator._norm(fixed_text)
+        kept = []
+        for clause in re.split(r"(?<=[.,;])\s+", brief.strip()):
+            if PromptGenerator._norm(clause).strip() and PromptGenerator._norm(clause) not in fixed:
+                kept.append(clause)
+            elif clause.endswith(".") and kept:
+                kept[-1] = kept[-1].rstrip(",;.") + "."  # Keep the sentence break of a dropped clause
+        # "Subject: {brief}." adds the final full stop
+        return " ".join(kept).strip(" ,;.")
+
+    @staticmethod
+    def compact_negatives(positive_text: str) -> str:
+        """NEGATIVE_PROMPT without the terms the brief or style explicitly ask for."""
+        positive = PromptGenerator._norm(positive_text)
+
+        def asked_for(term):
+            term = PromptGenerator._norm(term)
+            return term in positive and f" no{term}" not in positive and f" without{term}" not in positive
+
+        terms = [t.strip() for t in PromptGenerator.NEGATIVE_PROMPT.rstrip(".").split(",")]
+        return ", ".join(t for t in terms if not asked_for(t)) + "."
+
     @staticmethod
     def generate_payload(user_input: str, style: BrandStyle, aspect_ratio: str, use_custom_location: bool, variation_idx: int = 0) -> str:
         # Override environment if custom loc
@@ -169,6 +204,66 @@ class PromptGenerator:
             f"{user_input}. DETAIL SHOT: Close-up, alternative angle, focus on texture/mood."
         ]
 
+    @staticmethod
+    def generate_shoot_payload(brief: str, style: BrandStyle, aspect_ratio: str, has_face: bool, has_body: bool,
+                               has_apparel: bool, has_location: bool, compact: bool = False) -> str:
+        """
+        Builds the INITIATE SHOOT prompt for one planned shot.
+        The VISUAL MAPPING block numbers the reference images in the order they are sent:
+        face, body, apparel, location.
+        compact=True removes what is said twice: brief clauses repeating the fixed blocks,
+        negatives the brief asks for, the style environment when a location image replaces it,
+        and FINAL INSTRUCTION lines restating the VISUAL MAPPING.
+        """
+        # We disable auto-variation since the brief is now explicit
+        style_text = style.prompt_modifier
+        negatives = PromptGenerator.NEGATIVE_PROMPT
+        if compact:
+            if has_location:
+                style_text = re.sub(r"Environment: [^.]*\.\s*", "", style_text)
+            brief = PromptGenerator.compact_brief(brief, f"{PromptGenerator.MASTER_BASE_PROMPT} {style_text}")
+            negatives = PromptGenerator.compact_negatives(f"{brief} {style_text}")
+        elif has_location:
+            style_text += " IGNORE STYLE ENVIRONMENT. USE LOCATION IMAGE BACKGROUND."
+
+        prompt = (
+            f"STRICT INSTRUCTION: {PromptGenerator.MASTER_BASE_PROMPT} "
+            f"Aspect Ratio: {aspect_ratio}. "
+            f"Subject: {brief}. "
+            f"Style Guide: {style_text} "
+            f"Exclude: {negatives}"
+        )
+
+        # Fidelity checks
+        prompt += "\\n\\nVISUAL MAPPING:"
+        img_count = 1
+
+        if has_face:
+            prompt += f"\\n- Image {img_count}: MODEL FACE REF. PRIORITY: CRITICAL IDENTITY PRESERVATION. The output face must be indistinguishable from this reference. strict Carbon-Copy. Do NOT 'beautify', 'optimize', or 'average' the features. Maintain exact eye shape, nose structure, and facial landmarks."
+            img_count += 1
+
+        if has_body:
+            prompt += f"\\n- Image {img_count}: MODEL BODY REF. Use this for body proportions and pose. Ensure natural anatomical connection to the head."
+            img_count += 1
+
+        if has_apparel:
+            prompt += f"\\n- Image {img_count}: APPAREL REF. PRIORITY: TEXTURE & CUT FIDELITY. However, the FIT must be realistic. The fabric should fold, crease, and hang according to the model's pose and gravity. Do not make it look like a sticker. It must wrap around the 3D form."
+            img_count += 1
+        if has_location:
+            prompt += f"\\n- Image {img_count}: LOCATION REF. Use this background. Integrate the subject with matching lighting and shadows."
+            img_count += 1
+
+        if compact:
+            # Identity and apparel fidelity are already CRITICAL in the mapping above
+            prompt += "\\n\\nFINAL INSTRUCTION: Lighting must be coherent across Model, Clothes, and Background."
+            return prompt
+
+        prompt += "\\n\\nFINAL INSTRUCTION: NATURAL CONSISTENCY ALL THE TIME."
+        prompt += "\\n1. The Reference Face MUST match the Output Face."
+        prompt += "\\n2. The Reference Apparel MUST match the Output Apparel."
+        prompt += "\\n3. Lighting must be coherent across Model, Clothes, and Background."
+        return prompt
+
     @staticmethod
     def generate_accessory_payload(base_desc: str, accessory_desc: str) -> str:
         return (
@@ -199,12 +294,8 @@ class ShotListGenerator:
     """
     
     @staticmethod
-    def generate_shot_list(client, user_prompt: str, image: Any = None, min_count: int = 3) -> List[Dict[str, str]]:
-        """
-        Generates a structured shot list based on the user's concept.
-        Utilizes the Creative Director persona to analyze text and visuals.
-        """
-        system_instruction = (
+    def system_instruction(min_count: int = 3) -> str:
+        return (
             "You are Cruella, the uncompromising, visionary High-Fashion Creative Director. "
             "Your Task: Analyze the user's raw concept (and moodboard if provided) and EXECUTE a high-end fashion campaign. "
             "Process:\n"
@@ -220,7 +311,26 @@ class ShotListGenerator:
             "]\n"
             "IMPORTANT: The 'description' must be the RAW PROMPT ready for generation, including tech specs (Phase One XF, 100MP, etc) if not provided by the system."
         )
-        
+
+    @staticmethod
+    def fallback_shots(user_prompt: str, min_count: int = 3) -> List[Dict[str, str]]:
+        """Generic coverage used when planning fails."""
+        return [
+            {"title": "Standard Front", "description": f"Standard front view. {user_prompt}"},
+            {"title": "Side Profile", "description": f"Side profile view. {user_prompt}"},
+            {"title": "Detail Shot", "description": f"Close up detail shot. {user_prompt}"}
+        ][:min_count]
+
+    @staticmethod
+    def generate_shot_list(client, user_prompt: str, image: Any = None, min_count: int = 3,
+                           fallback: bool = True) -> List[Dict[str, str]]:
+        """
+        Generates a structured shot list based on the user's concept.
+        Utilizes the Creative Director persona to analyze text and visuals.
+        On failure returns fallback_shots, or raises with fallback=False.
+        """
+        system_instruction = ShotListGenerator.system_instruction(min_count)
+
         try:
             # Build content list for Multimodal
             input_content = [f"User Concept: {user_prompt}\nTarget: Dynamic Campaign (Min {min_count} shots)"]
@@ -262,13 +372,13 @@ class ShotListGenerator:
             if "```json" in raw: raw = raw.replace("```json", "").replace("```", "")
             elif "```" in raw: raw = raw.replace("```", "")
             
-            return json.loads(raw)
+            shots = json.loads(raw)
+            if not isinstance(shots, list) or not shots:
+                raise ValueError(f"Expected a non-empty JSON list of shots, got {type(shots).__name__}")
+            return shots
             
         except Exception as e:
             print(f"Planning failed: {e}")
-            # Fallback
-            return [
-                {"title": "Standard Front", "description": f"Standard front view. {user_prompt}"},
-                {"title": "Side Profile", "description": f"Side profile view. {user_prompt}"},
-                {"title": "Detail Shot", "description": f"Close up detail shot. {user_prompt}"}
-            ][:min_count]
+            if not fallback:
+                raise
+            return ShotListGenerator.fallback_shots(user_prompt, min_count)
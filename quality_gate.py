@@ -0,0 +1,125 @@
+"""
+Author: Steven Lansangan
+
+Post-generation quality gate. Each returned frame is checked in a few milliseconds on a
+downscaled copy before it is shown or saved:
+
+    decode      -> the bytes decode completely (truncated payloads raise here)
+    resolution  -> the long edge reaches the requested size (1K/2K/4K), within tolerance
+    aspect      -> width/height matches the requested aspect ratio
+    variance    -> the frame is not blank or a solid fill (luma standard deviation)
+
+StudioEngine drops frames that fail and re-generates only the missing ones, spending from a
+RetryBudget (per request, or shared by a whole campaign).
+
+    QC_ENABLED=0        -> no gate
+    QC_MIN_STD=4        -> minimum luma std (0-255) on the downscaled copy
+    QC_AR_TOLERANCE=0.06
+    QC_MAX_RETRIES=2    -> extra calls per request when no campaign budget is given
+    QC_RETRY_RATIO=0.5  -> campaign budget = ceil(frames x ratio)
+"""
+import math
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+QC_EDGE = 256  # Long edge of the copy the pixel statistics run on
+MIN_LONG_EDGE = {"1K": 1024, "2K": 2048, "4K": 4096}
+DEFAULT_MIN_LONG_EDGE = 512  # Drafts, remixes and anything without an explicit size
+RESOLUTION_TOLERANCE = 0.1
+
+
+@dataclass
+class QualityReport:
+    ok: bool = True
+    reasons: List[str] = field(default_factory=list)
+    metrics: Dict[str, float] = field(default_factory=dict)
+
+    def fail(self, reason: str):
+        self.ok = False
+        self.reasons.append(reason)
+
+
+def _ratio(aspect_ratio: str) -> float:
+    w, h = (float(x) for x in aspect_ratio.split(":"))
+    return w / h
+
+
+class QualityGate:
+    def __init__(self, min_std: float = 4.0, ar_tolerance: float = 0.06, max_retries: int = 2, retry_ratio: float = 0.5):
+        self.min_std = min_std
+        self.ar_tolerance = ar_tolerance
+        self.max_retries = max_retries
+        self.retry_ratio = retry_ratio
+
+    @classmethod
+    def from_env(cls) -> Optional["QualityGate"]:
+        if os.getenv("QC_ENABLED", "1") == "0":
+            return None
+        return cls(min_std=float(os.getenv("QC_MIN_STD", "4")),
+                   ar_tolerance=float(os.getenv("QC_AR_TOLERANCE", "0.06")),
+                   max_retries=int(os.getenv("QC_MAX_RETRIES", "2")),
+                   retry_ratio=float(os.getenv("QC_RETRY_RATIO", "0.5")))
+
+    def budget(self, frames: int = 1) -> "RetryBudget":
+        """Retry budget for a request (frames=1) or a campaign of `frames` frames."""
+        if frames <= 1:
+            return RetryBudget(self.max_retries)
+        return RetryBudget(math.ceil(frames * self.retry_ratio))
+
+    def check(self, img: Image.Image, aspect_ratio: Optional[str] = None, image_size: Optional[str] = None) -> QualityReport:
+        report = QualityReport()
+        try:
+            img.load()  # Lazily opened frames decode here; a truncated payload raises
+        except Exception as e:
+            report.fail(f"undecodable ({e})")
+            return report
+        width, height = img.size
+        if not width or not height:
+            report.fail("empty frame")
+            return report
+
+        long_edge = max(width, height)
+        report.metrics["long_edge"] = long_edge
+        required = MIN_LONG_EDGE.get(image_size, DEFAULT_MIN_LONG_EDGE)
+        if long_edge < required * (1 - RESOLUTION_TOLERANCE):
+            report.fail(f"{width}x{height} below {image_size or 'minimum'} resolution")
+
+        if aspect_ratio:
+            actual, target = width / height, _ratio(aspect_ratio)
+            report.metrics["aspect_error"] = abs(actual - target) / target
+            if report.metrics["aspect_error"] > self.ar_tolerance:
+                report.fail(f"aspect {width}x{height} is not {aspect_ratio}")
+
+        scale = QC_EDGE / long_edge
+        small = img if scale >= 1 else img.resize((max(1, round(width * scale)), max(1, round(height * scale))),
+                                                  Image.BOX, reducing_gap=2.0)
+        luma = np.asarray(small.convert("L"), dtype=np.float32)
+        report.metrics["std"] = float(luma.std())
+        if report.metrics["std"] < self.min_std:
+            report.fail(f"blank or solid frame (std {report.metrics['std']:.1f})")
+        return report
+
+
+class RetryBudget:
+    """Thread-safe count of extra generation calls allowed for a request or a campaign."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self, wanted: int) -> int:
+        """Reserve up to `wanted` retries; returns how many were granted."""
+        with self._lock:
+            granted = max(0, min(wanted, self.total - self.used))
+            self.used += granted
+            return granted
+
+    @property
+    def remaining(self) -> int:
+        return self.total - self.used
@@ -0,0 +1,130 @@
+"""
+Author: Steven Lansangan
+"""
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import List, Dict, Optional
+
+from PIL import Image
+
+from studio_engine import StudioEngine
+
+
+class SpeculativePlanner:
+    """
+    Runs Cruella's shot planning in the background while the brief is still being edited.
+
+    Every brief/moodboard change supersedes the previous run. Runs still inside their
+    debounce window are cancelled for free; runs already talking to the API are left to
+    finish and their result is discarded and counted as wasted.
+    """
+
+    def __init__(self, engine: StudioEngine, debounce_s: float = 1.5, min_count: int = 3, user_id=None):
+        self.engine = engine
+        self.user_id = user_id  # Ledger attribution
+        self.debounce_s = debounce_s
+        self.min_count = min_count
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cruella-spec")
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._key = None
+        self._future = None
+        self._wake = None
+        self._adopted = False
+        self.stats = {"submitted": 0, "api_calls": 0, "cancelled": 0, "adopted": 0, "wasted": 0}
+
+    @staticmethod
+    def input_key(user_prompt: str, image_bytes: Optional[bytes]) -> str:
+        h = hashlib.sha256((user_prompt or "").encode("utf-8"))
+        if image_bytes:
+            h.update(image_bytes)
+        return h.hexdigest()
+
+    def submit(self, user_prompt: str, image_bytes: Optional[bytes] = None):
+        """Schedule a debounced planning run unless these exact inputs are already planned."""
+        key = self.input_key(user_prompt, image_bytes)
+        with self._lock:
+            if key == self._key:
+                return
+            self._supersede()
+            self._generation += 1
+            self._key = key
+            self._adopted = False
+            self._wake = threading.Event()
+            self.stats["submitted"] += 1
+            self._future = self._executor.submit(
+                self._run, self._generation, self._wake, user_prompt, image_bytes
+            )
+
+    def adopt(self, user_prompt: str, image_bytes: Optional[bytes] = None, timeout: float = 120) -> Optional[List[Dict[str, str]]]:
+        """
+        Returns the speculative shot list for exactly these inputs, or None if there is none.
+        A run still debouncing is started immediately; a run in flight is awaited.
+        """
+        key = self.input_key(user_prompt, image_bytes)
+        with self._lock:
+            if key != self._key or self._future is None:
+                return None
+            future = self._future
+            self._wake.set()
+        try:
+            shots = future.result(timeout=timeout)
+        except Exception as e:
+            print(f"Speculative planning failed: {e}")
+            return None
+        if shots is None:
+            return None
+        with self._lock:
+            if key == self._key and not self._adopted:
+                self._adopted = True
+                self.stats["adopted"] += 1
+        return shots
+
+    def cancel(self):
+        """Drop the current speculative run (e.g. when the mode is switched off)."""
+        with self._lock:
+            self._supersede()
+            self._generation += 1
+            self._key = None
+            self._future = None
+
+    def _supersede(self):
+        # Caller holds the lock.
+        if self._future is None:
+            return
+        if self._wake is not None:
+            self._wake.set()
+        if self._future.done():
+            # Finished but never used by the button -> the API call was wasted.
+            if not self._adopted and not self._future.cancelled() and self._future.exception() is None \
+                    and self._future.result() is not None:
+                self.stats["wasted"] += 1
+        elif self._future.cancel():
+            self.stats["cancelled"] += 1
+        # A run already in flight notices the newer generation itself when it returns.
+
+    def _is_current(self, generation: int) -> bool:
+        with self._lock:
+            return generation == self._generation
+
+    def _run(self, generation, wake, user_prompt, image_bytes):
+        # Debounce: wait for the input to settle (or for adopt()/supersede to wake us).
+        wake.wait(self.debounce_s)
+        if not self._is_current(generation):
+            with self._lock:
+                self.stats["cancelled"] += 1
+            return None
+
+        with self._lock:
+            self.stats["api_calls"] += 1
+
+        image = Image.open(BytesIO(image_bytes)) if image_bytes else None
+        shots = self.engine.plan(user_prompt, image=image, min_count=self.min_count, user_id=self.user_id)
+
+        with self._lock:
+            if generation != self._generation:
+                self.stats["wasted"] += 1
+                return None
+        return shots
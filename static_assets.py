@@ -0,0 +1,194 @@
+"""
+Author: Steven Lansangan
+
+Cacheable image URLs through Streamlit static serving (server.enableStaticServing).
+
+Renditions are written once to static/img/<sha256>.<ext> and referenced as
+app/static/img/<sha256>.<ext>?v=<hash prefix>. The static handler answers with an ETag and,
+because of the `v` argument, a far-future Cache-Control, so the browser fetches each image
+once and later reruns only resend the <img> tag. Content-hash names make the files immutable:
+a different image is always a different URL.
+
+Files are a cache of what the database holds: every replica publishes on demand, and
+prune() (run by maintenance.py) deletes files that have not been published for a while.
+
+Download All archives are the exception: one-off files under static/dl/ with random names,
+deleted DOWNLOAD_TTL_M minutes after they are written.
+"""
+import base64
+import hashlib
+import html
+import os
+import secrets
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import db_manager as db
+from image_utils import base64_to_image, pil_to_thumbnail_base64, write_gallery_zip
+
+STATIC_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+IMG_DIR = os.path.join(STATIC_ROOT, "img")
+URL_PREFIX = "app/static/img"
+STATIC_MAX_AGE_S = float(os.getenv("STATIC_MAX_AGE_D", "30")) * 86400
+ARCHIVE_CHUNK = 50  # Gallery rows decoded per read while zipping
+DOWNLOAD_DIR = os.path.join(STATIC_ROOT, "dl")
+DOWNLOAD_URL_PREFIX = "app/static/dl"
+DOWNLOAD_TTL_S = float(os.getenv("DOWNLOAD_TTL_M", "15")) * 60
+
+# (table, row id, rendition, version) -> URL. Stored images never change in place; the version
+# (recorded size, else payload length, plus timestamp) guards against ids reused after a restore.
+_urls: Dict[Tuple, str] = {}
+_lock = threading.Lock()
+
+
+def _extension(data: bytes) -> str:
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return "png"
+
+
+def publish_bytes(data: bytes) -> str:
+    """Write image bytes under their content hash (once) and return the cacheable URL."""
+    digest = hashlib.sha256(data).hexdigest()
+    name = f"{digest}.{_extension(data)}"
+    path = os.path.join(IMG_DIR, name)
+    if os.path.exists(path):
+        os.utime(path)  # Keeps it clear of prune()
+    else:
+        os.makedirs(IMG_DIR, exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return f"{URL_PREFIX}/{name}?v={digest[:16]}"
+
+
+def publish_b64(b64: str) -> Optional[str]:
+    if not b64:
+        return None
+    return publish_bytes(base64.b64decode(b64.split(",")[-1]))
+
+
+def _full_rows(items):
+    """Listed gallery rows -> the same rows with their images, read ARCHIVE_CHUNK at a time."""
+    ids = [item['id'] for item in items]
+    for start in range(0, len(ids), ARCHIVE_CHUNK):
+        yield from db.get_gallery_items(ids[start:start + ARCHIVE_CHUNK])
+
+
+def publish_archive(items, prefix: str) -> str:
+    """
+    Write the Download All ZIP for gallery rows to a one-off file under static/dl/ and return its
+    URL, so neither the archive nor a copy in Streamlit's media store stays in the session. The
+    name is random rather than a content hash, and the file is deleted after DOWNLOAD_TTL_S: a
+    portfolio is never reachable at a stable, long-lived URL.
+    """
+    prune_downloads()
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    name = f"{secrets.token_urlsafe(24)}.zip"
+    tmp = os.path.join(DOWNLOAD_DIR, f".{name}.tmp")
+    with open(tmp, "wb") as f:
+        write_gallery_zip(_full_rows(items), prefix, f)
+    os.replace(tmp, os.path.join(DOWNLOAD_DIR, name))
+    return f"{DOWNLOAD_URL_PREFIX}/{name}"
+
+
+def download_available(url: str) -> bool:
+    """Whether a publish_archive URL can still be served. Expired archives are deleted here too."""
+    prune_downloads()
+    path = os.path.join(DOWNLOAD_DIR, url[len(DOWNLOAD_URL_PREFIX) + 1:])
+    try:
+        return os.stat(path).st_mtime >= time.time() - DOWNLOAD_TTL_S
+    except FileNotFoundError:
+        return False
+
+
+def prune_downloads(max_age_s: float = DOWNLOAD_TTL_S) -> Tuple[int, int]:
+    """Delete archives (and abandoned partial writes) older than max_age_s. Returns (files, bytes)."""
+    return _prune_dir(DOWNLOAD_DIR, max_age_s)
+
+
+def _path(url: str) -> str:
+    return os.path.join(IMG_DIR, url[len(URL_PREFIX) + 1:].split("?")[0])
+
+
+def _cached(key, build) -> Optional[str]:
+    with _lock:
+        url = _urls.get(key)
+    if url is None or not os.path.exists(_path(url)):  # May have been pruned by another process
+        url = build()
+        if url:
+            with _lock:
+                _urls[key] = url
+    return url
+
+
+def _version(row: Dict, column: str) -> Tuple:
+    return row.get('image_bytes') or len(row.get(column) or ""), row.get('timestamp')
+
+
+def _image_b64(table: str, row: Dict, column: str) -> Optional[str]:
+    """The row's full image; listed rows (db.GALLERY_LIST_COLUMNS) don't carry it, so it is read on demand."""
+    if column in row:
+        return row[column]
+    return db.get_stored_image(table, row['id'], column)
+
+
+def full_url(table: str, row: Dict, column: str = "image_base64") -> Optional[str]:
+    """URL of a row's stored image, as saved. The image is only read from the database on a cache miss."""
+    return _cached((table, row['id'], column, _version(row, column)), lambda: publish_b64(_image_b64(table, row, column)))
+
+
+def thumbnail_url(table: str, row: Dict, column: str = "image_base64") -> Optional[str]:
+    """URL of a row's grid rendition. Rows without one get it generated and saved on first view."""
+    def build():
+        thumb = row.get('thumb_base64')
+        if not thumb:
+            img = base64_to_image(_image_b64(table, row, column))
+            if img is None:
+                return None
+            thumb = pil_to_thumbnail_base64(img)
+            db.set_rendition(table, row['id'], thumb, img.width, img.height)
+        return publish_b64(thumb)
+    return _cached((table, row['id'], "thumb", _version(row, column)), build)
+
+
+def img_tag(url: str, alt: str = "", css_class: str = "tile-img") -> str:
+    return f'<img class="{css_class}" src="{html.escape(url)}" alt="{html.escape(alt)}" loading="lazy">'
+
+
+def download_link(url: str, filename: str, label: str = "Download") -> str:
+    return f'<a class="dl-link" href="{html.escape(url)}" download="{html.escape(filename)}">{html.escape(label)}</a>'
+
+
+def _prune_dir(folder: str, max_age_s: float) -> Tuple[int, int]:
+    if not os.path.isdir(folder):
+        return 0, 0
+    cutoff = time.time() - max_age_s
+    files = nbytes = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        # Other replicas publish and prune the same directory: entries can vanish under us
+        try:
+            st = os.stat(path)
+            if st.st_mtime >= cutoff:
+                continue
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        files += 1
+        nbytes += st.st_size
+    return files, nbytes
+
+
+def prune(max_age_s: float = STATIC_MAX_AGE_S) -> Tuple[int, int]:
+    """
+    Delete renditions not published within max_age_s (they are re-published on demand) and
+    expired download archives. Returns (files, bytes).
+    """
+    files, nbytes = _prune_dir(IMG_DIR, max_age_s)
+    archives, archive_bytes = prune_downloads()
+    return files + archives, nbytes + archive_bytes
@@ -0,0 +1,750 @@
+"""
+Author: Steven Lansangan
+
+UI-independent studio engine.
+Reference prep, prompt assembly, the image generation call, response decoding and the
+gallery save live here, so the Streamlit app, the batch runner and the tooling all drive
+the same hot path. Model access goes through a pluggable backend (Gemini or a deterministic fake).
+"""
+import base64
+import contextvars
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, replace
+from io import BytesIO
+from typing import List, Dict, Optional, Any
+
+from PIL import Image
+
+import db_manager as db
+import image_index
+import prompt_budget
+import tracing
+from image_utils import load_and_resize, pil_to_base64, pil_to_png_bytes
+from prompt_engine import PromptGenerator, BrandStyle, ShotListGenerator
+from quality_gate import QualityGate, RetryBudget
+
+logger = logging.getLogger("ella.engine")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.propagate = False
+
+IMAGE_MODEL = 'gemini-3-pro-image-preview'
+DRAFT_MODEL = 'gemini-2.5-flash-image'  # Fast low-res drafts
+
+RESOLUTION_SIZES = {
+    "Standard (1K)": "1K",
+    "Pro (2K)": "2K",
+    "Ultra (4K)": "4K"
+}
+
+# Approximate USD per generated image
+COST_PER_IMAGE = {
+    "draft": 0.039,
+    "1K": 0.134,
+    "2K": 0.134,
+    "4K": 0.24
+}
+
+REF_MAX_SIZE = (800, 800)  # Generation needs slightly larger limits than previews
+
+PLAN_MODEL = 'gemini-3-pro-preview'  # Model behind ShotListGenerator (ledger label)
+# Approximate USD per million text tokens for the planner (thinking is billed as output, not counted here)
+PLAN_COST_PER_MTOK = {"input": 2.0, "output": 12.0}
+
+
+def estimate_cost(model: str, image_size: Optional[str], images: int) -> float:
+    """Approximate USD for a call that returned `images` frames."""
+    rate = COST_PER_IMAGE["draft"] if model == DRAFT_MODEL else COST_PER_IMAGE.get(image_size or "1K", COST_PER_IMAGE["1K"])
+    return rate * images
+
+
+def estimate_text_cost(input_tokens: int, output_tokens: int) -> float:
+    """Approximate USD for a planner call."""
+    return (input_tokens * PLAN_COST_PER_MTOK["input"] + output_tokens * PLAN_COST_PER_MTOK["output"]) / 1e6
+
+
+def pixel_bytes(images) -> int:
+    """Decoded size of a list of images (what the client serialises, before compression)."""
+    return sum(img.width * img.height * len(img.getbands()) for img in images if isinstance(img, Image.Image))
+
+
+@dataclass
+class ShootRefs:
+    """Reference images for a shoot, in VISUAL MAPPING order."""
+    face: Optional[Image.Image] = None
+    body: Optional[Image.Image] = None
+    apparel: Optional[Image.Image] = None
+    location: Optional[Image.Image] = None
+
+    @classmethod
+    def from_assets(cls, model: Optional[Dict], apparel: Optional[Dict], location: Optional[Dict] = None,
+                    max_size=REF_MAX_SIZE) -> "ShootRefs":
+        refs = cls()
+        with tracing.span("ref_decode"):
+            if model:
+                if 'face_base64' in model and 'body_base64' in model:
+                    refs.face = load_and_resize(model['face_base64'], max_size)
+                    refs.body = load_and_resize(model['body_base64'], max_size)
+                elif 'image_base64' in model:
+                    # Legacy fallback
+                    refs.body = load_and_resize(model['image_base64'], max_size)
+            if apparel:
+                refs.apparel = load_and_resize(apparel['image_base64'], max_size)
+            if location:
+                refs.location = load_and_resize(location['image_base64'], max_size)
+        return refs
+
+    def images(self) -> List[Image.Image]:
+        return [img for img in (self.face, self.body, self.apparel, self.location) if img]
+
+
+@dataclass
+class GenerationRequest:
+    prompt: str
+    images: List[Any] = field(default_factory=list)
+    aspect_ratio: Optional[str] = None
+    image_size: Optional[str] = None
+    model: str = IMAGE_MODEL
+    candidate_count: int = 1
+    flow: str = "shoot"  # shoot / remix / accessory
+    history: List[Dict] = field(default_factory=list)  # Earlier conversation turns sent along (remix sessions)
+
+    @property
+    def contents(self) -> List[Any]:
+        return [self.prompt] + list(self.images)
+
+
+@dataclass
+class GenerationResult:
+    images: List[Image.Image] = field(default_factory=list)
+    latency: float = 0.0
+    notes: List[str] = field(default_factory=list)
+    output_bytes: int = 0  # Payload bytes received, when the backend knows them
+    rejected: int = 0  # Frames dropped by the quality gate
+
+    @property
+    def image(self) -> Optional[Image.Image]:
+        return self.images[0] if self.images else None
+
+
+@dataclass
+class RemixSession:
+    """A chain of edits on one gallery item, persisted so a reopened dialog continues it."""
+    id: int
+    user_id: Any
+    category: str
+    base_item_id: Optional[int]
+    head_item_id: Optional[int]
+    original_prompt: str
+    model: str = IMAGE_MODEL
+    turns: List[Dict] = field(default_factory=list)  # {"instruction", "item_id"}
+    context: Dict = field(default_factory=dict)  # Backend conversation state
+
+    @classmethod
+    def from_row(cls, row: Dict) -> "RemixSession":
+        return cls(id=row['id'], user_id=row['user_id'], category=row['category'], base_item_id=row['base_item_id'],
+                   head_item_id=row['head_item_id'], original_prompt=row['original_prompt'] or "",
+                   model=row['model'] or IMAGE_MODEL, turns=row['turns'], context=row['context'])
+
+
+class ImageBackend:
+    """Model access used by the engine. Subclasses implement generate() and plan()."""
+    name = "base"
+
+    def generate(self, request: GenerationRequest) -> GenerationResult:
+        raise NotImplementedError
+
+    def plan(self, user_prompt: str, image=None, min_count: int = 3) -> List[Dict[str, str]]:
+        raise NotImplementedError
+
+    def supports_candidates(self, model: str) -> bool:
+        return False
+
+    def upload_ref(self, image: Image.Image) -> Any:
+        """Prepare a reference shared by many requests. Local backends use the image as-is."""
+        return image
+
+    def count_tokens(self, model: str, text: str) -> Optional[int]:
+        """Exact input tokens of `text` for `model`, or None where only estimates exist."""
+        return None
+
+    def remix_turn(self, context: Dict, current_image, original_prompt: str, instruction: str, ref_image=None,
+                   model: str = IMAGE_MODEL) -> GenerationResult:
+        """
+        One edit in a remix session. `context` is the backend's JSON-serialisable conversation
+        state, updated in place. Default: stateless, re-send the current image with a fresh edit payload.
+        """
+        prompt = PromptGenerator.generate_edit_payload(base_desc=original_prompt, edit_instruction=instruction)
+        images = [current_image] + ([ref_image] if ref_image else [])
+        return self.generate(GenerationRequest(prompt=prompt, images=images, model=model, flow="remix"))
+
+
+def decode_parts_image(parts):
+    """Extract the first inline image from a list of response parts. Returns (PIL image or None, warnings)."""
+    generated_pil = None
+    notes = []
+    if parts:
+        for part in parts:
+            if part.inline_data:
+                try:
+                    if isinstance(part.inline_data.data, bytes):
+                        generated_pil = Image.open(BytesIO(part.inline_data.data))
+                    else:
+                        # Decode base64 if needed
+                        generated_pil = Image.open(BytesIO(base64.b64decode(part.inline_data.data)))
+                    # Force the decode here: a truncated payload fails now, not when it is displayed
+                    generated_pil.load()
+                    break
+                except Exception as img_err:
+                    notes.append(f"Failed to decode output: {img_err}")
+            elif hasattr(part, 'text') and part.text and "http" in part.text:
+                notes.append("Received link instead of image: " + part.text)
+    return generated_pil, notes
+
+
+class GeminiBackend(ImageBackend):
+    name = "gemini"
+
+    def __init__(self, client):
+        self.client = client
+        # Models that rejected candidate_count > 1 for image output (learned at runtime); a short
+        # but successful response (e.g. one candidate safety-filtered) is topped up, not a rejection
+        self._candidate_support = {}
+
+    def _config(self, request: GenerationRequest):
+        from google.genai import types
+        config = {
+            'safety_settings': [types.SafetySetting(
+                category="HARM_CATEGORY_DANGEROUS_CONTENT",
+                threshold="BLOCK_ONLY_HIGH"
+            )]
+        }
+        if request.aspect_ratio:
+            image_config = {'aspect_ratio': request.aspect_ratio}
+            if request.image_size:
+                image_config['image_size'] = request.image_size
+            config['image_config'] = types.ImageConfig(**image_config)
+        if request.candidate_count > 1:
+            config['candidate_count'] = request.candidate_count
+        return types.GenerateContentConfig(**config)
+
+    def generate(self, request: GenerationRequest) -> GenerationResult:
+        start = time.perf_counter()
+        try:
+            with tracing.span("api", model=request.model):
+                response = self.client.models.generate_content(
+                    model=request.model,
+                    contents=request.contents,
+                    config=self._config(request)
+                )
+        except Exception as e:
+            if request.candidate_count > 1:
+                # Backend rejected candidate_count -> remember and let the engine go parallel
+                logger.warning(f"Multi-candidate unsupported for {request.model}: {e}")
+                self._candidate_support[request.model] = False
+                return GenerationResult(latency=time.perf_counter() - start)
+            raise
+
+        result = GenerationResult()
+        with tracing.span("response_decode", model=request.model):
+            for candidate in (response.candidates or []):
+                parts = candidate.content.parts if candidate.content else None
+                result.output_bytes += sum(len(p.inline_data.data) for p in (parts or []) if p.inline_data and p.inline_data.data)
+                img, notes = decode_parts_image(parts)
+                result.notes.extend(notes)
+                if img:
+                    result.images.append(img)
+        result.latency = time.perf_counter() - start
+        return result
+
+    def plan(self, user_prompt: str, image=None, min_count: int = 3) -> List[Dict[str, str]]:
+        return ShotListGenerator.generate_shot_list(self.client, user_prompt, image=image, min_count=min_count, fallback=False)
+
+    def supports_candidates(self, model: str) -> bool:
+        return self._candidate_support.get(model, True)
+
+    def count_tokens(self, model: str, text: str) -> Optional[int]:
+        return self.client.models.count_tokens(model=model, contents=text).total_tokens
+
+    def upload_ref(self, image: Image.Image) -> Any:
+        """Upload once through the Files API; the returned File is referenced by URI in every request."""
+        return self.client.files.upload(file=BytesIO(pil_to_png_bytes(image)), config={'mime_type': 'image/png'})
+
+    SESSION_FILE_TTL_S = 46 * 3600  # Files API uploads expire after 48h
+
+    def _file_part(self, data: bytes, mime_type: str = 'image/png') -> Dict:
+        uploaded = self.client.files.upload(file=BytesIO(data), config={'mime_type': mime_type})
+        return {"file_data": {"file_uri": uploaded.uri, "mime_type": mime_type}}
+
+    @staticmethod
+    def _content(turn: Dict) -> Dict:
+        """Stored turn -> SDK content (thought signatures are kept base64 in JSON)."""
+        parts = []
+        for part in turn["parts"]:
+            part = dict(part)
+            if "thought_signature" in part:
+                part["thought_signature"] = base64.b64decode(part["thought_signature"])
+            parts.append(part)
+        return {"role": turn["role"], "parts": parts}
+
+    def remix_turn(self, context: Dict, current_image, original_prompt: str, instruction: str, ref_image=None,
+                   model: str = IMAGE_MODEL) -> GenerationResult:
+        """
+        Multi-turn edit. The conversation lives in `context["history"]` with every image as a
+        Files API reference, so a follow-up sends only the new instruction (plus an optional ref).
+        """
+        if context.get("history") and time.time() - context.get("started_at", 0) > self.SESSION_FILE_TTL_S:
+            context.clear()  # Uploads expired: restart the conversation from the current image
+        if not context.get("history"):
+            context.update({"history": [], "started_at": time.time()})
+            with tracing.span("ref_upload"):
+                base_part = self._file_part(pil_to_png_bytes(current_image))
+            parts = [base_part, {"text": PromptGenerator.generate_edit_payload(base_desc=original_prompt, edit_instruction=instruction)}]
+        else:
+            parts = [{"text": instruction}]
+        if ref_image is not None:
+            with tracing.span("ref_upload"):
+                parts += [{"text": "Texture/style reference for this edit:"}, self._file_part(pil_to_png_bytes(ref_image))]
+        turn = {"role": "user", "parts": parts}
+
+        start = time.perf_counter()
+        request = GenerationRequest(prompt=instruction, model=model, flow="remix")
+        with tracing.span("api", model=model):
+            response = self.client.models.generate_content(
+                model=model,
+                contents=[self._content(t) for t in context["history"] + [turn]],
+                config=self._config(request)
+            )
+
+        result = GenerationResult()
+        candidate = response.candidates[0] if response.candidates else None
+        out_parts = (candidate.content.parts if candidate and candidate.content else None) or []
+        with tracing.span("response_decode", model=model):
+            img, notes = decode_parts_image(out_parts)
+            result.notes.extend(notes)
+            if img:
+                img.load()
+                result.images.append(img)
+        if img:
+            # Keep the model turn in the conversation, its image re-referenced by URI instead of inline bytes
+            model_parts = []
+            with tracing.span("ref_upload"):
+                for p in out_parts:
+                    if getattr(p, "thought", False):
+                        continue
+                    if p.inline_data and p.inline_data.data:
+                        data = p.inline_data.data
+                        data = data if isinstance(data, bytes) else base64.b64decode(data)
+                        result.output_bytes += len(data)
+                        entry = self._file_part(data, p.inline_data.mime_type or 'image/png')
+                    elif p.text:
+                        entry = {"text": p.text}
+                    else:
+                        continue
+                    if getattr(p, "thought_signature", None):
+                        entry["thought_signature"] = base64.b64encode(p.thought_signature).decode("ascii")
+                    model_parts.append(entry)
+            context["history"] += [turn, {"role": "model", "parts": model_parts}]
+        result.latency = time.perf_counter() - start
+        return result
+
+
+class FakeBackend(ImageBackend):
+    """
+    Deterministic stand-in: returns a solid frame whose colour is derived from the prompt
+    and whose shape follows the requested aspect ratio. No network, optional fixed latency.
+    """
+    name = "fake"
+
+    def __init__(self, latency_s: float = 0.0, edge: int = 256):
+        self.latency_s = latency_s
+        self.edge = edge
+
+    def _frame(self, request: GenerationRequest, n: int) -> Image.Image:
+        w, h = (int(x) for x in (request.aspect_ratio or "1:1").split(":"))
+        scale = self.edge / max(w, h)
+        color = tuple(hashlib.md5(f"{request.prompt}|{n}".encode()).digest()[:3])
+        return Image.new("RGB", (int(w * scale), int(h * scale)), color)
+
+    def generate(self, request: GenerationRequest) -> GenerationResult:
+        start = time.perf_counter()
+        with tracing.span("api", model=request.model):
+            if self.latency_s:
+                time.sleep(self.latency_s)
+            images = [self._frame(request, n) for n in range(max(1, request.candidate_count))]
+        return GenerationResult(images=images, latency=time.perf_counter() - start)
+
+    def plan(self, user_prompt: str, image=None, min_count: int = 3) -> List[Dict[str, str]]:
+        views = [("Standard Front", "Standard front view."), ("Side Profile", "Side profile view."),
+                 ("Detail Shot", "Close up detail shot.")]
+        shots = []
+        for n in range(max(1, min_count)):
+            title, view = views[n % len(views)]
+            take = n // len(views) + 1  # Repeated views are numbered, so their prompts (and frames) differ
+            if take > 1:
+                title, view = f"{title} {take}", f"{view} Take {take}."
+            shots.append({"title": title, "description": f"{view} {user_prompt}"})
+        return shots
+
+    def supports_candidates(self, model: str) -> bool:
+        return True
+
+
+class LatencyProfileBackend(FakeBackend):
+    """
+    Fake backend that behaves like the real API under load: per-flow latencies are replayed
+    from recorded samples or drawn from a lognormal distribution, and outputs have realistic
+    pixel sizes (and therefore realistic PNG encode / base64 / DB costs).
+
+    Profile format (JSON-compatible):
+        {"shoot": {"samples": [21.3, 25.9, ...]},             # replay recorded latencies
+         "remix": {"median_s": 18, "sigma": 0.3},              # or a lognormal distribution
+         "plan":  {"median_s": 8,  "sigma": 0.4},
+         "image_sizes": {"default": 1024, "1K": 1024, "2K": 2048, "4K": 4096}}
+    """
+    name = "latency_profile"
+
+    DEFAULT_PROFILE = {
+        "shoot": {"median_s": 22.0, "sigma": 0.35},
+        "remix": {"median_s": 18.0, "sigma": 0.3},
+        "accessory": {"median_s": 18.0, "sigma": 0.3},
+        "plan": {"median_s": 8.0, "sigma": 0.4},
+        "image_sizes": {"default": 1024, "1K": 1024, "2K": 2048, "4K": 4096},
+    }
+
+    def __init__(self, profile: Optional[Dict] = None, time_scale: float = 1.0, seed: Optional[int] = None):
+        super().__init__()
+        self.profile = {**self.DEFAULT_PROFILE, **(profile or {})}
+        self.time_scale = time_scale
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _latency(self, flow: str) -> float:
+        spec = self.profile.get(flow) or self.profile["shoot"]
+        with self._lock:
+            if spec.get("samples"):
+                value = self._rng.choice(spec["samples"])
+            else:
+                value = self._rng.lognormvariate(math.log(spec["median_s"]), spec.get("sigma", 0.3))
+        return value * self.time_scale
+
+    def _frame(self, request: GenerationRequest, n: int) -> Image.Image:
+        sizes = self.profile["image_sizes"]
+        edge = sizes.get(request.image_size or "default", sizes["default"])
+        w, h = (int(x) for x in (request.aspect_ratio or "1:1").split(":"))
+        scale = edge / max(w, h)
+        size = (int(w * scale), int(h * scale))
+        # Low-frequency noise upscaled: compresses roughly like a photo, unlike a solid fill
+        small = (max(1, size[0] // 8), max(1, size[1] // 8))
+        bands = [Image.effect_noise(small, 48 + 16 * c).resize(size, Image.BILINEAR) for c in range(3)]
+        return Image.merge("RGB", bands)
+
+    def generate(self, request: GenerationRequest) -> GenerationResult:
+        start = time.perf_counter()
+        with tracing.span("api", model=request.model):
+            time.sleep(self._latency(request.flow))
+        with tracing.span("response_decode", model=request.model):
+            images = [self._frame(request, n) for n in range(max(1, request.candidate_count))]
+        return GenerationResult(images=images, latency=time.perf_counter() - start)
+
+    def plan(self, user_prompt: str, image=None, min_count: int = 3) -> List[Dict[str, str]]:
+        time.sleep(self._latency("plan"))
+        return super().plan(user_prompt, image=image, min_count=min_count)
+
+
+class StudioEngine:
+    def __init__(self, backend: ImageBackend, gate: Optional[QualityGate] = None):
+        self.backend = backend
+        self.gate = gate
+        self.tokens = prompt_budget.COUNTER
+        if prompt_budget.TOKEN_COUNT == "api" and type(backend).count_tokens is not ImageBackend.count_tokens:
+            self.tokens = prompt_budget.TokenCounter(remote=backend.count_tokens)
+
+    # --- Requests ---
+    @staticmethod
+    def shoot_request(brief: str, style: BrandStyle, aspect_ratio: str, refs: ShootRefs, image_size: Optional[str] = None,
+                      model: str = IMAGE_MODEL, candidate_count: int = 1) -> GenerationRequest:
+        with tracing.span("prompt_build"):
+            def build(text):
+                return PromptGenerator.generate_shoot_payload(
+                    text, style, aspect_ratio,
+                    has_face=refs.face is not None,
+                    has_body=refs.body is not None,
+                    has_apparel=refs.apparel is not None,
+                    has_location=refs.location is not None,
+                    compact=prompt_budget.COMPACT
+                )
+            if prompt_budget.COMPACT and prompt_budget.TOKEN_BUDGET:
+                # Cut from what survives compaction, not from the planner's boilerplate
+                brief = PromptGenerator.compact_brief(brief, PromptGenerator.MASTER_BASE_PROMPT)
+                prompt = prompt_budget.fit_brief(build, brief, prompt_budget.TOKEN_BUDGET)
+            else:
+                prompt = build(brief)
+        return GenerationRequest(prompt=prompt, images=refs.images(), aspect_ratio=aspect_ratio,
+                                 image_size=image_size, model=model, candidate_count=candidate_count, flow="shoot")
+
+    @staticmethod
+    def remix_request(image, original_prompt: str, edit_instruction: str, ref_image=None) -> GenerationRequest:
+        with tracing.span("prompt_build"):
+            prompt = PromptGenerator.generate_edit_payload(base_desc=original_prompt, edit_instruction=edit_instruction)
+        images = [image] + ([ref_image] if ref_image else [])
+        return GenerationRequest(prompt=prompt, images=images, flow="remix")
+
+    @staticmethod
+    def accessory_request(base_image, accessory_image, accessory_desc: str) -> GenerationRequest:
+        with tracing.span("prompt_build"):
+            prompt = PromptGenerator.generate_accessory_payload(base_desc="Existing fashion shoot", accessory_desc=accessory_desc)
+        return GenerationRequest(prompt=prompt, images=[base_image, accessory_image], flow="accessory")
+
+    # --- Execution ---
+    def generate(self, request: GenerationRequest, user_id=None, budget: Optional[RetryBudget] = None) -> GenerationResult:
+        """
+        Run one request. For candidate_count > 1 all candidates are asked for in one call when
+        the backend supports it; any shortfall is topped up with parallel single calls.
+        With a quality gate, rejected frames are re-generated with single calls while `budget`
+        allows (default: the gate's per-request budget; pass one budget to share it across a campaign).
+        Every backend call is written to the generations ledger.
+        """
+        if request.candidate_count <= 1 and self.gate is None:
+            return self._call(request, user_id)
+
+        start = time.perf_counter()
+        result = GenerationResult()
+        wanted = max(1, request.candidate_count)
+        attempts = 0
+        if wanted == 1 or self.backend.supports_candidates(request.model):
+            first = self._call(request, user_id)
+            attempts = 1
+            result.images.extend(first.images[:wanted])
+            result.notes.extend(first.notes)
+            result.rejected = first.rejected
+
+        if budget is None:
+            budget = self.gate.budget() if self.gate else RetryBudget(0)
+        single = replace(request, candidate_count=1)
+        # Frames the backend never returned are topped up for free; gate rejections spend the budget
+        shortfall = wanted - len(result.images) - result.rejected
+        while True:
+            missing = wanted - len(result.images)
+            calls = min(missing, max(shortfall, 0))
+            shortfall = 0
+            calls += budget.take(missing - calls)
+            if calls <= 0:
+                break
+            self._fan_out(result, single, user_id, attempts, calls)
+            attempts += 1
+
+        result.images = result.images[:wanted]
+        result.latency = time.perf_counter() - start
+        return result
+
+    def _fan_out(self, result: GenerationResult, request: GenerationRequest, user_id, retries: int, calls: int):
+        """Run `calls` copies of a single-frame request in parallel and merge them into `result`."""
+        with ThreadPoolExecutor(max_workers=calls) as pool:
+            # Copy the context so spans in worker threads land in the caller's trace
+            futures = [pool.submit(contextvars.copy_context().run, self._call, request, user_id, retries) for _ in range(calls)]
+            for future in futures:
+                try:
+                    r = future.result()
+                    result.images.extend(r.images)
+                    result.notes.extend(r.notes)
+                    result.rejected += r.rejected
+                except Exception as e:
+                    result.notes.append(f"Candidate failed: {e}")
+
+    def _call(self, request: GenerationRequest, user_id=None, retries: int = 0, call=None) -> GenerationResult:
+        """
+        One backend call (backend.generate(request) unless `call` is given), recorded in the
+        ledger whatever the outcome. `request` describes what is sent over the wire.
+        Frames failing the quality gate are dropped here; they are still billed in the ledger.
+        """
+        start = time.perf_counter()
+        result, outcome, generated = None, "error", []
+        input_tokens = self._input_tokens(request)
+        try:
+            result = call() if call else self.backend.generate(request)
+            generated = list(result.images)
+            if self.gate and generated:
+                self._apply_gate(request, result)
+            outcome = "ok" if result.images else ("rejected" if generated else "empty")
+            return result
+        finally:
+            self._record(user_id, request.flow, request.model, request.image_size, request.aspect_ratio,
+                         pixel_bytes(request.images), (result.output_bytes if result else 0) or pixel_bytes(generated),
+                         time.perf_counter() - start, retries, outcome,
+                         estimate_cost(request.model, request.image_size, len(generated)), input_tokens())
+
+    def _input_tokens(self, request: GenerationRequest):
+        """Token count of everything sent (prompt, images, earlier turns); call the result for the total."""
+        texts, images = [request.prompt], list(request.images)
+        for turn in request.history:
+            for part in turn.get("parts", []):
+                if part.get("text"):
+                    texts.append(part["text"])
+                elif "file_data" in part or "inline_data" in part:
+                    images.append(part)
+        return self.tokens.count_later(request.model, texts, images)
+
+    def _apply_gate(self, request: GenerationRequest, result: GenerationResult):
+        with tracing.span("quality_gate", model=request.model):
+            passed = []
+            for img in result.images:
+                report = self.gate.check(img, request.aspect_ratio, request.image_size)
+                if report.ok:
+                    passed.append(img)
+                else:
+                    result.notes.append(f"Quality gate rejected a frame: {'; '.join(report.reasons)}")
+        result.rejected += len(result.images) - len(passed)
+        result.images = passed
+
+    @staticmethod
+    def _record(*row):
+        try:
+            with tracing.span("ledger_write"):
+                db.add_generation(*row)
+        except Exception as e:
+            # The ledger must never cost the user a frame
+            print(f"Ledger write failed: {e}")
+
+    def accessory_batch(self, bases, accessory_image: Image.Image, accessory_desc: str, user_id=None, workers: int = 4):
+        """
+        Apply one accessory to many shots concurrently. `bases` is a list of (key, PIL image).
+        The accessory reference is downscaled and uploaded once and shared by every call.
+        Yields (key, GenerationResult or None, error or None) in completion order.
+        """
+        with tracing.span("ref_decode"):
+            acc = accessory_image.convert("RGB") if accessory_image.mode != "RGB" else accessory_image.copy()
+            acc.thumbnail(REF_MAX_SIZE)
+        with tracing.span("ref_upload"):
+            acc_ref = self.backend.upload_ref(acc)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {
+                pool.submit(contextvars.copy_context().run, self.generate,
+                            self.accessory_request(base, acc_ref, accessory_desc), user_id): key
+                for key, base in bases
+            }
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, str(e)
+
+    # --- Remix sessions ---
+    @staticmethod
+    def open_remix_session(user_id, category: str, item_id: int, original_prompt: str, new: bool = False) -> RemixSession:
+        """Continue the session whose latest output is `item_id`, or start one from it."""
+        row = None if new else db.find_remix_session(user_id, item_id)
+        if row is None:
+            row = db.get_remix_session(db.create_remix_session(user_id, category, item_id, original_prompt, IMAGE_MODEL))
+        return RemixSession.from_row(row)
+
+    def remix_turn(self, session: RemixSession, current_image, instruction: str, ref_image=None, user_id=None) -> GenerationResult:
+        """Run one edit in the session; on success the frame is saved and becomes the session head."""
+        history = list(session.context.get("history") or [])
+        sent = ([] if history else [current_image]) + ([ref_image] if ref_image else [])
+        # A session's first turn sends the full edit payload; follow-ups the instruction plus the history
+        prompt = instruction if history else PromptGenerator.generate_edit_payload(session.original_prompt, instruction)
+        request = GenerationRequest(prompt=prompt, images=sent, model=session.model, flow="remix", history=history)
+        snapshot = {**session.context, "history": history}
+        result = None
+        try:
+            result = self._call(request, user_id, call=lambda: self.backend.remix_turn(
+                session.context, current_image, session.original_prompt, instruction, ref_image=ref_image, model=session.model))
+        finally:
+            if result is None or not result.image:
+                # The backend appends the turn before the gate sees it; a failed or rejected turn must not stay
+                session.context.clear()
+                session.context.update(snapshot)
+        if result.image:
+            item_id = self.save(session.user_id, session.category, f"Remix: {instruction}", result.image)
+            session.turns.append({"instruction": instruction, "item_id": item_id})
+            session.head_item_id = item_id
+            with tracing.span("db_write"):
+                db.update_remix_session(session.id, item_id, session.turns, session.context)
+        return result
+
+    def plan(self, user_prompt: str, image=None, min_count: int = 3, user_id=None) -> List[Dict[str, str]]:
+        """
+        Shot list for a brief. A failed planner call is logged as an error in the ledger and
+        the generic fallback coverage is returned, so callers always get shots.
+        """
+        start = time.perf_counter()
+        shots, outcome = None, "error"
+        input_tokens = self.tokens.count_later(PLAN_MODEL, [ShotListGenerator.system_instruction(min_count), user_prompt],
+                                               [image] if image else [])
+        try:
+            with tracing.span("api"):
+                shots = self.backend.plan(user_prompt, image=image, min_count=min_count)
+            outcome = "ok"
+        except Exception as e:
+            print(f"Planner failed, using fallback shots: {e}")
+            shots = ShotListGenerator.fallback_shots(user_prompt, min_count)
+        finally:
+            tokens_in = input_tokens()
+            output = json.dumps(shots) if outcome == "ok" else ""
+            cost = estimate_text_cost(tokens_in, prompt_budget.estimate_text_tokens(output)) if output else 0.0
+            self._record(user_id, "plan", PLAN_MODEL, None, None, pixel_bytes([image]) if image else 0, len(output),
+                         time.perf_counter() - start, 0, outcome, cost, tokens_in)
+        return shots
+
+    # --- Persistence ---
+    @staticmethod
+    def save(user_id, category: str, prompt: str, image: Image.Image, campaign_id=None) -> int:
+        """
+        PNG-encode and store a result in the gallery. Returns the gallery item id. With the
+        dedupe-on-save policy on, a near-duplicate of an existing frame is not stored and the
+        existing item's id is returned instead.
+        """
+        with tracing.span("phash"):
+            phash = image_index.dhash(image)
+            if image_index.DEDUPE_ON_SAVE:
+                duplicate_id = image_index.find_duplicate(user_id, category, phash)
+                if duplicate_id is not None:
+                    print(f"Skipped near-duplicate of gallery item {duplicate_id}")
+                    return duplicate_id
+        with tracing.span("png_encode"):
+            b64 = pil_to_base64(image)
+        with tracing.span("db_write"):
+            return db.add_gallery_item(user_id, category, prompt, b64, campaign_id=campaign_id, phash=phash)
+
+    @staticmethod
+    def save_batch(user_id, category: str, items, campaign_id=None) -> List[int]:
+        """
+        Encode [(prompt, image)] in parallel and store them in a single transaction. Returns the
+        ids in order. With the dedupe-on-save policy on, a frame that near-duplicates a stored one
+        (or an earlier frame of the batch) is not stored and gets that item's id, as in save().
+        """
+        items = list(items)
+        with tracing.span("phash"):
+            hashes = [image_index.dhash(img) for _, img in items]
+            duplicate_of = {}  # Batch position -> gallery id, or -(earlier batch position + 1)
+            if image_index.DEDUPE_ON_SAVE:
+                rows = db.get_gallery_hashes(user_id, category)
+                index = image_index.HashIndex([r['id'] for r in rows], [r['phash'] for r in rows])
+                for n, phash in enumerate(hashes):
+                    matches = index.similar(phash, image_index.DUPLICATE_DISTANCE)
+                    if matches:
+                        duplicate_of[n] = matches[0][0]
+                    else:
+                        index.add(-(n + 1), phash)
+        fresh = [n for n in range(len(items)) if n not in duplicate_of]
+        with tracing.span("png_encode"), ThreadPoolExecutor(max_workers=4) as pool:
+            encoded = list(pool.map(lambda n: (items[n][0], pil_to_base64(items[n][1]), hashes[n]), fresh))
+        with tracing.span("db_write"):
+            new_ids = dict(zip(fresh, db.add_gallery_items_bulk(user_id, category, encoded, campaign_id=campaign_id)))
+        if duplicate_of:
+            print(f"Skipped {len(duplicate_of)} near-duplicate frames")
+        ids = []
+        for n in range(len(items)):
+            match = duplicate_of.get(n)
+            ids.append(new_ids[n] if match is None else new_ids[-match - 1] if match < 0 else match)
+        return ids
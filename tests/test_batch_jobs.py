@@ -0,0 +1,63 @@
+"""Batch submit / poll / ingest against the local stand-in batch endpoint."""
+import pytest
+from PIL import Image
+
+import batch_jobs
+import db_manager as db
+from image_utils import pil_to_base64
+from prompt_engine import BrandStyle
+
+
+@pytest.fixture
+def studio(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, "DB_FILE", str(tmp_path / "studio.db"))
+    db.init_db()
+    db.create_user("atelier", "secret")
+    user_id = db.get_user_id("atelier")
+    ref = pil_to_base64(Image.new("RGB", (64, 64), "white"))
+    db.add_model(user_id, "Mara", ref, ref)
+    for name in ("dress", "coat", "skirt"):
+        db.add_asset(user_id, "closet", name, ref)
+    specs = batch_jobs.expand_combinations([db.get_models(user_id)[0]['id']],
+                                           [a['id'] for a in db.get_assets(user_id, "closet")], [],
+                                           "Red silk, golden hour", BrandStyle.LUXURY, "9:16")
+    backend = batch_jobs.LocalBatchBackend(root=str(tmp_path / "local"))
+    job_id = batch_jobs.submit_batch(user_id, specs, backend)
+    return user_id, job_id, backend
+
+
+def _job(job_id):
+    return next(job for job in db.get_batch_jobs() if job['id'] == job_id)
+
+
+def test_poll_ingests_every_render(studio):
+    user_id, job_id, backend = studio
+    assert batch_jobs.poll_batches(backend) == [{"id": job_id, "status": "SUCCEEDED", "ingested": 3, "failed": 0}]
+    assert len(db.get_gallery(user_id, 'apparel')) == 3
+    assert batch_jobs.poll_batches(backend) == []  # Closed jobs are not polled again
+
+
+def test_interrupted_ingest_resumes_without_duplicates(studio, monkeypatch):
+    user_id, job_id, backend = studio
+    store = db.ingest_batch_item
+    calls = []
+
+    def crash_on_second(*args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise RuntimeError("killed")
+        return store(*args)
+
+    monkeypatch.setattr(db, "ingest_batch_item", crash_on_second)
+    with pytest.raises(RuntimeError):
+        batch_jobs.poll_batches(backend)
+    job = _job(job_id)
+    assert (job['status'], job['ingested_count']) == ("INGESTING", 1)
+    assert len(db.get_gallery(user_id, 'apparel')) == 1
+
+    monkeypatch.setattr(db, "ingest_batch_item", store)
+    batch_jobs.poll_batches(backend)
+    job = _job(job_id)
+    assert (job['status'], job['ingested_count'], job['failed_count']) == ("SUCCEEDED", 3, 0)
+    assert len(db.get_gallery(user_id, 'apparel')) == 3
@@ -0,0 +1,84 @@
+"""Manifest runner crash/resume against FakeBackend."""
+import pytest
+from PIL import Image
+
+import batch_runner
+import db_manager as db
+from image_utils import pil_to_base64
+from studio_engine import FakeBackend, StudioEngine
+
+
+class Crash(BaseException):
+    """Process death: not caught by the runner's per-shot or per-item error handling."""
+
+
+@pytest.fixture
+def manifest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, "DB_FILE", str(tmp_path / "studio.db"))
+    db.init_db()
+    db.create_user("atelier", "secret")
+    user_id = db.get_user_id("atelier")
+    ref = pil_to_base64(Image.new("RGB", (64, 64), "white"))
+    db.add_model(user_id, "Mara", ref, ref)
+    db.add_asset(user_id, "closet", "dress", ref)
+    item = {"id": "look-01", "studio": "atelier", "model_id": db.get_models(user_id)[0]['id'],
+            "apparel_id": db.get_assets(user_id, "closet")[0]['id'], "brief": "Red silk dress",
+            "shots": ["Front view, red silk dress", "Side profile, red silk dress", "Detail of the hem"]}
+    return [item], str(tmp_path / "shoots.checkpoint.jsonl")
+
+
+def _runner(checkpoint):
+    return batch_runner.ManifestRunner(StudioEngine(FakeBackend()), checkpoint, workers=1)
+
+
+def _campaigns():
+    conn = db.get_db_connection()
+    rows = [dict(r) for r in conn.execute(
+        "SELECT c.id, (SELECT COUNT(*) FROM gallery g WHERE g.campaign_id = c.id) AS frames FROM campaigns c")]
+    conn.close()
+    return rows
+
+
+def test_crash_after_save_does_not_regenerate_the_frame(manifest, monkeypatch):
+    items, checkpoint = manifest
+    save, saves = StudioEngine.save, []
+
+    def save_then_die(*args, **kwargs):
+        saves.append(save(*args, **kwargs))
+        if len(saves) == 2:
+            raise Crash()  # Stored, but never checkpointed
+        return saves[-1]
+
+    monkeypatch.setattr(StudioEngine, "save", staticmethod(save_then_die))
+    with pytest.raises(Crash):
+        _runner(checkpoint).run(items)
+
+    monkeypatch.setattr(StudioEngine, "save", staticmethod(save))
+    generate = FakeBackend.generate
+    calls = []
+    monkeypatch.setattr(FakeBackend, "generate", lambda self, request: calls.append(request) or generate(self, request))
+    summary = _runner(checkpoint).run(items)
+    assert summary["ok"] == 1 and summary["images"] == 3
+    assert len(calls) == 1  # Only the third shot is generated again
+    assert [c["frames"] for c in _campaigns()] == [3]
+    assert _runner(checkpoint).run(items)["shoots"] == 0
+
+
+def test_crash_after_campaign_is_created_reuses_it(manifest, monkeypatch):
+    items, checkpoint = manifest
+    create = db.create_campaign
+
+    def create_then_die(*args, **kwargs):
+        create(*args, **kwargs)
+        raise Crash()
+
+    monkeypatch.setattr(db, "create_campaign", create_then_die)
+    with pytest.raises(Crash):
+        _runner(checkpoint).run(items)
+    assert [c["frames"] for c in _campaigns()] == [0]
+
+    monkeypatch.setattr(db, "create_campaign", create)
+    summary = _runner(checkpoint).run(items)
+    assert summary["ok"] == 1 and summary["images"] == 3
+    assert [c["frames"] for c in _campaigns()] == [3]
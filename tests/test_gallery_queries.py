@@ -0,0 +1,18 @@
+import db_manager as db
+
+
+def test_listed_rows_leave_the_image_behind(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, "DB_FILE", str(tmp_path / "studio.db"))
+    db.init_db()
+    db.create_user("atelier", "secret")
+    user_id = db.get_user_id("atelier")
+    item_id = db.add_gallery_item(user_id, "apparel", "red silk dress", "aGVsbG8=")
+
+    listed = db.get_gallery(user_id, "apparel")
+    found, total = db.search_gallery(user_id, "silk")
+    assert [row["id"] for row in listed] == [item_id]
+    assert total == 1 and found[0]["prompt"] == "red silk dress"
+    assert "image_base64" not in listed[0] and "image_base64" not in found[0]
+    assert db.get_stored_image("gallery", item_id) == "aGVsbG8="
+    assert db.get_gallery_items([item_id])[0]["image_base64"] == "aGVsbG8="
@@ -0,0 +1,102 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+import db_manager as db
+import image_index
+from studio_engine import StudioEngine
+
+
+def _scene(seed=0, size=(640, 480)):
+    """Smooth synthetic frame: a few soft blobs over a gradient, like a lit subject on a backdrop."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size[1], 0:size[0]] / max(size)
+    luma = 80 * x + 40 * y
+    for cx, cy, r, amp in rng.uniform([0, 0, 0.05, -120], [1, 0.75, 0.25, 120], (6, 4)):
+        luma += amp * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * r ** 2))
+    rgb = np.clip(np.stack([luma, luma * 0.8 + 30, luma * 0.6 + 50], axis=-1), 0, 255)
+    return Image.fromarray(rgb.astype(np.uint8))
+
+
+def _palette(*colours):
+    """Palette of an image split into equal vertical bands of the given colours."""
+    img = Image.new("RGB", (64 * len(colours), 64))
+    for i, colour in enumerate(colours):
+        img.paste(colour, (64 * i, 0, 64 * (i + 1), 64))
+    return image_index.palette(img)
+
+
+def test_empty_palette_index():
+    index = image_index.PaletteIndex([], [])
+    assert len(index) == 0
+    assert not index
+    assert index.rank(_palette("red")) == []
+    assert len(image_index.PaletteIndex.from_rows([{'id': 1, 'palette': None}])) == 0
+
+
+def test_palette_rank_orders_by_similarity():
+    rows = [{'id': 1, 'palette': _palette("navy")},
+            {'id': 2, 'palette': _palette("red", "navy")},
+            {'id': 3, 'palette': _palette("red")}]
+    index = image_index.PaletteIndex.from_rows(rows)
+    assert len(index) == 3
+
+    ranked = index.rank(_palette("red"))
+    assert [item_id for item_id, _ in ranked] == [3, 2, 1]
+    scores = [score for _, score in ranked]
+    assert abs(scores[0] - 1.0) < 0.01  # Same palette: Bhattacharyya coefficient of 1
+    assert 0.5 < scores[1] < 0.9  # Half the frame shares the colour
+    assert scores[2] < 0.1
+    assert index.rank(_palette("red"), limit=1) == ranked[:1]
+    assert np.allclose([s for _, s in index.rank(_palette("navy"))][:1], 1.0, atol=0.01)
+
+
+def test_reencoded_and_resized_frames_stay_duplicates():
+    original = _scene()
+    buffer = BytesIO()
+    original.save(buffer, "JPEG", quality=70)
+    jpeg = Image.open(BytesIO(buffer.getvalue()))
+    resized = original.resize((320, 240), Image.LANCZOS)
+    index = image_index.HashIndex([1], [image_index.dhash(original)])
+    for copy in (jpeg, resized):
+        assert index.similar(image_index.dhash(copy), image_index.DUPLICATE_DISTANCE) != []
+    other = image_index.dhash(_scene(seed=1))
+    assert index.similar(other, image_index.DUPLICATE_DISTANCE) == []
+
+
+def test_collapse_keeps_the_newest_of_each_group():
+    a, b = image_index.dhash(_scene(0)), image_index.dhash(_scene(1))
+    near_a = a ^ 0b101  # Two bits off
+    # Loaded newest first: 5 is the latest re-roll of a, 3 and 1 earlier takes
+    index = image_index.HashIndex([5, 4, 3, 2, 1], [near_a, b, a, b ^ (1 << 40), a])
+    assert index.collapse() == {5: [3, 1], 4: [2]}
+    assert image_index.HashIndex([], []).collapse() == {}
+
+
+def test_add_grows_past_the_initial_capacity():
+    index = image_index.HashIndex([100, 101, 102], [0, -1, 1 << 62])
+    values = [int(h) for h in np.random.default_rng(7).integers(-(1 << 63), (1 << 63) - 1, 40, dtype=np.int64)]
+    for n, value in enumerate(values):
+        index.add(n, value)
+    assert len(index) == 43
+    assert index.ids.tolist() == [100, 101, 102] + list(range(40))
+    assert index.hashes.tolist() == [h & 0xFFFFFFFFFFFFFFFF for h in [0, -1, 1 << 62] + values]
+    assert all(index.similar(value, 0)[0] == (n, 0) for n, value in enumerate(values))
+
+
+def test_dedupe_on_save_returns_the_stored_item(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, "DB_FILE", str(tmp_path / "studio.db"))
+    monkeypatch.setattr(image_index, "DEDUPE_ON_SAVE", True)
+    db.init_db()
+    db.create_user("atelier", "secret")
+    user_id = db.get_user_id("atelier")
+
+    first = StudioEngine.save(user_id, "apparel", "take 1", _scene())
+    assert StudioEngine.save(user_id, "apparel", "take 2", _scene().resize((320, 240))) == first
+    other = StudioEngine.save(user_id, "apparel", "new look", _scene(seed=1))
+    batch = StudioEngine.save_batch(user_id, "apparel", [("a", _scene(2)), ("b", _scene()), ("c", _scene(2))])
+    assert other != first
+    assert batch[1] == first and batch[0] == batch[2] not in (first, other)
+    assert len(db.get_gallery(user_id, "apparel")) == 3
@@ -0,0 +1,56 @@
+import base64
+import os
+
+import db_manager as db
+import maintenance
+import static_assets
+import storage
+
+
+def _old_blob(store, payload=b"png bytes"):
+    ref = store.put_b64(base64.b64encode(payload).decode("utf-8"))
+    key = ref[len(storage.BLOB_REF_PREFIX):]
+    os.utime(store._path(key), (0, 0))
+    return ref, key
+
+
+def _sweep(tmp_path, monkeypatch, refs_seen):
+    store = storage.FileBlobStore(str(tmp_path / "blobs"))
+    monkeypatch.setattr(storage, "BLOBS", store)
+    monkeypatch.setattr(static_assets, "prune", lambda: (0, 0))
+    monkeypatch.setattr(db, "get_blob_refs", lambda: refs_seen.pop(0))
+    return store
+
+
+def test_dedupe_hit_refreshes_mtime(tmp_path):
+    store = storage.FileBlobStore(str(tmp_path / "blobs"))
+    ref, key = _old_blob(store)
+    assert store.put_b64(base64.b64encode(b"png bytes").decode("utf-8")) == ref
+    assert os.stat(store._path(key)).st_mtime > 0
+
+
+def test_sweep_rechecks_refs_before_deleting(tmp_path, monkeypatch):
+    refs_seen = []
+    store = _sweep(tmp_path, monkeypatch, refs_seen)
+    _, kept = _old_blob(store, b"saved while the sweep listed")
+    _, orphan = _old_blob(store, b"really orphaned")
+    refs_seen.extend([set(), {kept}])  # A row referencing `kept` commits between the two reads
+
+    report = maintenance.MaintenanceReport()
+    maintenance.sweep_orphan_blobs(report, grace_s=60)
+
+    assert report.orphan_blobs == 1
+    assert store.exists(kept)
+    assert not store.exists(orphan)
+
+
+def test_sweep_respects_grace_period(tmp_path, monkeypatch):
+    refs_seen = [set()]
+    store = _sweep(tmp_path, monkeypatch, refs_seen)
+    ref = store.put_b64(base64.b64encode(b"just written").decode("utf-8"))
+
+    report = maintenance.MaintenanceReport()
+    maintenance.sweep_orphan_blobs(report, grace_s=60)
+
+    assert report.orphan_blobs == 0
+    assert store.exists(ref[len(storage.BLOB_REF_PREFIX):])
@@ -0,0 +1,114 @@
+"""
+storage.PgConnection / PgCursor against a stand-in Postgres: a DB-API connection that records
+the SQL it receives and runs it on SQLite after undoing the psycopg2 paramstyle.
+"""
+import sqlite3
+
+import pytest
+
+import db_manager as db
+import storage
+
+
+class StandInCursor:
+    def __init__(self, conn, log):
+        self._cur = conn.cursor()
+        self._log = log
+
+    @staticmethod
+    def _sqlite(sql):
+        return sql.replace("%s", "?").replace("%%", "%")
+
+    def execute(self, sql, params):
+        self._log.append(sql)
+        self._cur.execute(self._sqlite(sql), params)
+
+    def executemany(self, sql, seq_of_params):
+        self._log.append(sql)
+        self._cur.executemany(self._sqlite(sql), seq_of_params)
+
+    @property
+    def description(self):
+        return self._cur.description
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def close(self):
+        self._cur.close()
+
+
+class StandInPostgres:
+    closed = False
+
+    def __init__(self, path, log):
+        self._conn = sqlite3.connect(path)
+        self._log = log
+
+    def cursor(self):
+        return StandInCursor(self._conn, self._log)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+
+class StandInPool:
+    def release(self, raw):
+        raw._conn.close()
+
+
+@pytest.fixture
+def pg(tmp_path, monkeypatch):
+    """db_manager on a fresh SQLite schema, with every connection going through the Postgres adapter."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, "DB_FILE", str(tmp_path / "studio.db"))
+    db.init_db()
+    log = []
+    monkeypatch.setattr(db, "get_db_connection",
+                        lambda: storage.PgConnection(StandInPool(), StandInPostgres(db.DB_FILE, log)))
+    return log
+
+
+def test_translate_escapes_percent_and_keeps_quoted_placeholders():
+    assert storage._translate("SELECT x FROM t WHERE a = ? AND b LIKE 'blob:%'") == \
+        "SELECT x FROM t WHERE a = %s AND b LIKE 'blob:%%'"
+    assert storage._translate("SELECT '?' WHERE a = ?") == "SELECT '?' WHERE a = %s"
+
+
+def test_id_tables_come_from_schema():
+    assert {"users", "gallery", "campaigns", "generations"} <= storage.ID_TABLES
+    assert not {"migration_state", "retention_policies"} & storage.ID_TABLES
+
+
+def test_insert_returns_id(pg):
+    assert db.create_user("atelier", "secret")[0]
+    campaign_id = db.create_campaign(db.get_user_id("atelier"), "Red silk dress")
+    assert campaign_id == 1
+    assert any(sql.startswith("INSERT INTO campaigns") and sql.endswith(" RETURNING id") for sql in pg)
+
+
+def test_insert_without_id_column(pg):
+    db.create_user("atelier", "secret")
+    user_id = db.get_user_id("atelier")
+    db.set_retention_policy(user_id, keep_last=10)
+    db.apply_migration_chunk("renditions", "gallery", 42, (), [])
+
+    assert [(p["user_id"], p["keep_last"]) for p in db.get_retention_policies()] == [(user_id, 10)]
+    assert [(m["table_name"], m["last_id"]) for m in db.get_migration_state()] == [("gallery", 42)]
+    keyed = [sql for sql in pg if sql.startswith(("INSERT INTO retention_policies", "INSERT INTO migration_state"))]
+    assert len(keyed) == 2
+    assert not any("RETURNING" in sql for sql in keyed)
+
+
+def test_like_literal_survives_translation(pg):
+    db.create_user("atelier", "secret")
+    user_id = db.get_user_id("atelier")
+    db.add_gallery_item(user_id, "apparel", "look", "aGVsbG8=")
+    assert db.get_blob_refs() == set()  # Inline store: nothing matches 'blob:%'
+    assert any("LIKE 'blob:%%'" in sql for sql in pg)
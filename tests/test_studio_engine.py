@@ -0,0 +1,127 @@
+"""StudioEngine paths driven offline through FakeBackend."""
+import pytest
+from PIL import Image
+
+import db_manager as db
+import prompt_budget
+from prompt_engine import BrandStyle
+from quality_gate import QualityGate, RetryBudget
+from studio_engine import FakeBackend, GenerationRequest, GenerationResult, ShootRefs, StudioEngine
+
+
+class ShortBackend(FakeBackend):
+    """Returns one frame per call whatever candidate_count asks for (a safety-filtered candidate, say)."""
+
+    def generate(self, request):
+        return super().generate(GenerationRequest(request.prompt, aspect_ratio=request.aspect_ratio,
+                                                  model=request.model, flow=request.flow))
+
+
+class FailingBackend(FakeBackend):
+    def generate(self, request):
+        raise RuntimeError("backend down")
+
+    def plan(self, user_prompt, image=None, min_count=3):
+        raise RuntimeError("planner down")
+
+
+class ChatBackend(FakeBackend):
+    """Appends every turn to the conversation, then answers with the scripted outcome."""
+
+    def __init__(self, outcomes):
+        super().__init__()
+        self.outcomes = list(outcomes)
+
+    def remix_turn(self, context, current_image, original_prompt, instruction, ref_image=None, model=None):
+        context.setdefault("history", []).append({"role": "user", "parts": [{"text": instruction}]})
+        outcome = self.outcomes.pop(0)
+        if outcome == "raise":
+            raise RuntimeError("turn failed")
+        return GenerationResult(images=[Image.new("RGB", (64, 64), "red")] if outcome == "image" else [])
+
+
+@pytest.fixture
+def user_id(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, "DB_FILE", str(tmp_path / "studio.db"))
+    db.init_db()
+    db.create_user("atelier", "secret")
+    return db.get_user_id("atelier")
+
+
+def _ledger():
+    conn = db.get_db_connection()
+    rows = [dict(r) for r in conn.execute("SELECT flow, outcome, retries, cost FROM generations ORDER BY id")]
+    conn.close()
+    return rows
+
+
+def test_generate_tops_up_a_short_multi_candidate_call(user_id):
+    engine = StudioEngine(ShortBackend())
+    result = engine.generate(GenerationRequest("red silk", aspect_ratio="1:1", candidate_count=3), user_id)
+    assert len(result.images) == 3
+    assert [row["retries"] for row in _ledger()] == [0, 1, 1]  # One call, then two parallel top-ups
+
+
+def test_gate_rejections_spend_the_retry_budget(user_id):
+    engine = StudioEngine(FakeBackend(), gate=QualityGate())  # Fake frames are solid fills: always rejected
+    budget = RetryBudget(2)
+    result = engine.generate(GenerationRequest("red silk", aspect_ratio="1:1"), user_id, budget=budget)
+    assert result.images == [] and result.rejected == 3
+    assert budget.remaining == 0
+    assert [row["outcome"] for row in _ledger()] == ["rejected"] * 3
+
+
+def test_failed_call_is_written_to_the_ledger(user_id):
+    engine = StudioEngine(FailingBackend())
+    with pytest.raises(RuntimeError):
+        engine.generate(GenerationRequest("red silk", aspect_ratio="1:1"), user_id)
+    shots = engine.plan("red silk", min_count=2, user_id=user_id)
+    assert len(shots) == 2  # Fallback coverage
+    assert _ledger() == [{"flow": "shoot", "outcome": "error", "retries": 0, "cost": 0.0},
+                         {"flow": "plan", "outcome": "error", "retries": 0, "cost": 0.0}]
+
+
+def test_failed_remix_turn_rolls_back_the_conversation(user_id):
+    item_id = db.add_gallery_item(user_id, "apparel", "red silk", "aGVsbG8=")
+    engine = StudioEngine(ChatBackend(["image", "empty", "raise", "image"]))
+    session = engine.open_remix_session(user_id, "apparel", item_id, "red silk")
+    base = Image.new("RGB", (64, 64), "white")
+
+    assert engine.remix_turn(session, base, "warmer light", user_id=user_id).image
+    assert len(session.context["history"]) == 1
+    assert not engine.remix_turn(session, base, "add a hat", user_id=user_id).image
+    with pytest.raises(RuntimeError):
+        engine.remix_turn(session, base, "add a scarf", user_id=user_id)
+    assert [t["parts"][0]["text"] for t in session.context["history"]] == ["warmer light"]
+
+    engine.remix_turn(session, base, "softer shadows", user_id=user_id)
+    assert [t["instruction"] for t in session.turns] == ["warmer light", "softer shadows"]
+    stored = db.get_remix_session(session.id)
+    assert stored["head_item_id"] == session.head_item_id
+    assert len(stored["context"]["history"]) == 2
+
+
+def test_accessory_batch_yields_every_base(user_id):
+    engine = StudioEngine(FakeBackend())
+    bases = [(n, Image.new("RGB", (64, 64), "white")) for n in range(5)]
+    done = {key: (result, error) for key, result, error in
+            engine.accessory_batch(bases, Image.new("RGBA", (1200, 900)), "gold hoops", user_id=user_id)}
+    assert sorted(done) == list(range(5))
+    assert all(result.image and error is None for result, error in done.values())
+    assert [row["flow"] for row in _ledger()] == ["accessory"] * 5
+
+
+def test_compaction_fits_the_brief_to_the_token_budget(monkeypatch):
+    brief = "Red silk slip dress on a rooftop at golden hour. " + " ".join(
+        f"Extra styling note number {n} about the hem and drape." for n in range(40))
+    full = StudioEngine.shoot_request(brief, BrandStyle.LUXURY, "9:16", ShootRefs()).prompt
+    monkeypatch.setattr(prompt_budget, "COMPACT", True)
+    base = StudioEngine.shoot_request("Red silk slip dress.", BrandStyle.LUXURY, "9:16", ShootRefs()).prompt
+    budget = prompt_budget.estimate_text_tokens(base) + 40
+    monkeypatch.setattr(prompt_budget, "TOKEN_BUDGET", budget)
+
+    prompt = StudioEngine.shoot_request(brief, BrandStyle.LUXURY, "9:16", ShootRefs()).prompt
+    assert prompt_budget.estimate_text_tokens(prompt) <= budget < prompt_budget.estimate_text_tokens(full)
+    assert "Red silk slip dress on a rooftop" in prompt
+    assert "number 39" not in prompt
@@ -0,0 +1,59 @@
+import io
+import zipfile
+
+from PIL import Image
+
+import db_manager as db
+import vault_import
+from image_index import dhash
+from image_utils import pil_to_base64
+
+
+def _frame(kind, fmt="PNG"):
+    frames = {
+        "ramp": Image.linear_gradient("L"),
+        "turned": Image.linear_gradient("L").rotate(90),
+        "radial": Image.radial_gradient("L"),
+    }
+    buffer = io.BytesIO()
+    frames[kind].convert("RGB").save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def _zip(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for name, data in entries:
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_zip_import_reports_each_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(db, "DB_FILE", str(tmp_path / "studio.db"))
+    db.init_db()
+    db.create_user("atelier", "secret")
+    user_id = db.get_user_id("atelier")
+    archived = Image.radial_gradient("L").convert("RGB")
+    db.add_asset(user_id, "closet", "Archive Radial", pil_to_base64(archived), phash=dhash(archived))
+
+    archive = _zip([
+        ("fw25/red_silk-dress.png", _frame("ramp")),
+        ("fw25/red_silk-dress_copy.jpg", _frame("ramp", "JPEG")),  # Same frame, re-encoded
+        ("fw25/broken.jpg", b"\xff\xd8\xff not really a jpeg"),
+        ("fw25/coat.png", _frame("turned")),
+        ("fw25/radial.png", _frame("radial")),  # Already in the vault
+        ("fw25/notes.txt", b"shoot notes"),
+        ("fw25/names.csv", b"filename,name\ncoat.png,Camel Wool Coat\n"),
+        ("__MACOSX/fw25/._coat.png", b"resource fork"),
+    ])
+    report = vault_import.import_files(user_id, "closet", vault_import.iter_zip(archive), workers=2)
+
+    assert report.imported == ["fw25/red_silk-dress.png", "fw25/coat.png"]
+    assert report.duplicates == [("fw25/red_silk-dress_copy.jpg", "Matches fw25/red_silk-dress.png in this import"),
+                                 ("fw25/radial.png", "Matches existing 'Archive Radial'")]
+    assert [filename for filename, _ in report.errors] == ["fw25/notes.txt", "fw25/broken.jpg"]
+    assert report.errors[1][1].startswith("Could not read image")
+    assert report.summary() == "2 imported, 2 duplicates skipped, 2 errors"
+    names = sorted(a['name'] for a in db.get_assets(user_id, "closet"))
+    assert names == ["Archive Radial", "Camel Wool Coat", "Red Silk Dress"]
@@ -0,0 +1,223 @@
+"""
+Author: Steven Lansangan
+
+Lightweight per-phase tracing for the generation pipeline.
+
+    with tracing.trace("shoot", user="atelier", model=IMAGE_MODEL, shot=2):
+        with tracing.span("prompt_build"):
+            ...
+
+Every span feeds a Prometheus histogram (ella_phase_seconds{flow,phase,model}); every trace
+feeds ella_request_seconds{flow,model,status} and emits one structured JSON log line with the
+per-phase breakdown and its tags (user, model, shot, ...). User and shot index stay in the logs
+only, to keep metric cardinality bounded.
+
+Export:
+    METRICS_PORT=9464   -> serve /metrics from a local HTTP endpoint (start_metrics_server)
+    METRICS_FILE=path   -> rewrite a Prometheus text file after every trace
+    ELLA_TRACE_LOG=0    -> silence the structured log lines
+"""
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+_current = contextvars.ContextVar("ella_trace", default=None)
+
+logger = logging.getLogger("ella.trace")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.propagate = False
+logger.setLevel(logging.INFO if os.getenv("ELLA_TRACE_LOG", "1") != "0" else logging.WARNING)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}  # label tuple -> [bucket counts..., sum, count]
+
+    def observe(self, labels: Dict[str, str], value: float):
+        key = tuple(sorted(labels.items()))
+        data = self.series.get(key)
+        if data is None:
+            data = self.series[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                data[i] += 1
+        data[-2] += value
+        data[-1] += 1
+
+
+def _fmt_labels(pairs) -> str:
+    escaped = []
+    for k, v in pairs:
+        v = str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        escaped.append(f'{k}="{v}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {
+            "ella_phase_seconds": Histogram("ella_phase_seconds", "Time spent per generation pipeline phase."),
+            "ella_request_seconds": Histogram("ella_request_seconds", "End-to-end time per traced request."),
+        }
+
+    def observe(self, name: str, labels: Dict[str, str], value: float):
+        with self._lock:
+            self.histograms[name].observe(labels, value)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (0.0.4)."""
+        lines = []
+        with self._lock:
+            for hist in self.histograms.values():
+                lines.append(f"# HELP {hist.name} {hist.help_text}")
+                lines.append(f"# TYPE {hist.name} histogram")
+                for key, data in sorted(hist.series.items()):
+                    for i, bound in enumerate(BUCKETS):
+                        lines.append(f"{hist.name}_bucket{_fmt_labels(key + (('le', bound),))} {data[i]}")
+                    lines.append(f"{hist.name}_bucket{_fmt_labels(key + (('le', '+Inf'),))} {data[-1]}")
+                    lines.append(f"{hist.name}_sum{_fmt_labels(key)} {data[-2]:.6f}")
+                    lines.append(f"{hist.name}_count{_fmt_labels(key)} {data[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, name: str = "ella_phase_seconds") -> Dict[str, Dict[str, float]]:
+        """Mean seconds and count per label set, for display in the admin console."""
+        out = {}
+        with self._lock:
+            for key, data in self.histograms[name].series.items():
+                label = " / ".join(str(v) for _, v in key)
+                out[label] = {"count": data[-1], "mean_s": data[-2] / data[-1] if data[-1] else 0.0}
+        return out
+
+
+REGISTRY = MetricsRegistry()
+
+
+class Trace:
+    def __init__(self, flow: str, tags: Dict):
+        self.flow = flow
+        self.tags = tags
+        self.phases = {}
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def tag(**tags):
+    """Attach tags to the active trace (e.g. the model once it is known)."""
+    t = _current.get()
+    if t:
+        t.tags.update(tags)
+
+
+@contextmanager
+def trace(flow: str, **tags):
+    t = Trace(flow, dict(tags))
+    token = _current.set(t)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield t
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        total = time.perf_counter() - start
+        _current.reset(token)
+        REGISTRY.observe("ella_request_seconds", {"flow": flow, "model": t.tags.get("model", ""), "status": status}, total)
+        logger.info(json.dumps({
+            "event": "trace",
+            "flow": flow,
+            **{k: v for k, v in t.tags.items()},
+            "status": status,
+            "total_ms": round(total * 1000, 1),
+            "phases_ms": {k: round(v * 1000, 1) for k, v in t.phases.items()},
+        }, default=str))
+        metrics_file = os.getenv("METRICS_FILE")
+        if metrics_file:
+            write_metrics(metrics_file)
+
+
+@contextmanager
+def span(phase: str, **tags):
+    t = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        flow, model = "untraced", tags.get("model", "")
+        if t:
+            t.add(phase, elapsed)
+            flow = t.flow
+            model = model or t.tags.get("model", "")
+        REGISTRY.observe("ella_phase_seconds", {"flow": flow, "phase": phase, "model": model}, elapsed)
+
+
+def write_metrics(path: str):
+    """Atomically rewrite the metrics file. Never raises: metrics must not fail the traced request."""
+    tmp = None
+    try:
+        # Unique temp file per writer: concurrent traces must not interleave into one
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".metrics-", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(REGISTRY.render())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"Metrics file write failed: {e}")
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """Serve /metrics in a daemon thread. Safe to call on every Streamlit rerun."""
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            print(f"Metrics endpoint unavailable on {host}:{port}: {e}")
+            return None
+        threading.Thread(target=_server.serve_forever, daemon=True, name="ella-metrics").start()
+        return _server
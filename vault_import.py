@@ -0,0 +1,191 @@
+"""
+Author: Steven Lansangan
+
+Bulk Vault import from a ZIP archive (UI upload) or a directory (CLI).
+
+Images are decoded and normalised in parallel (EXIF orientation, RGB, longest side capped),
+named from an optional CSV sidecar (columns: filename,name) or else from the file name, checked
+against the studio's existing assets and each other by perceptual hash, and inserted in a
+single transaction. A bad file is reported and skipped; it never aborts the batch.
+
+Usage:
+    python vault_import.py --studio atelier --category closet ./fw25_collection [--csv names.csv] [--workers 8]
+"""
+import argparse
+import csv
+import io
+import os
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+import db_manager as db
+from image_index import HashIndex, dhash, palette, DUPLICATE_DISTANCE
+from image_utils import pil_to_base64
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
+IMPORT_MAX_SIZE = (1024, 1024)  # Matches the "~1000px on longest side" upload guidance
+CATEGORIES = ("closet", "location")
+
+
+@dataclass
+class PreparedImage:
+    filename: str
+    name: str = ""
+    image_b64: str = ""
+    phash: Optional[int] = None
+    palette: Optional[bytes] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class ImportReport:
+    imported: List[str] = field(default_factory=list)
+    duplicates: List[Tuple[str, str]] = field(default_factory=list)  # (filename, reason)
+    errors: List[Tuple[str, str]] = field(default_factory=list)  # (filename, message)
+
+    def summary(self) -> str:
+        return f"{len(self.imported)} imported, {len(self.duplicates)} duplicates skipped, {len(self.errors)} errors"
+
+
+def name_from_filename(filename: str) -> str:
+    """'fw25/red_silk-dress_01.jpg' -> 'Red Silk Dress 01'"""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return re.sub(r"[_\-\s]+", " ", stem).strip().title() or stem
+
+
+def parse_sidecar(data: bytes) -> Dict[str, str]:
+    """CSV with filename,name columns -> {basename: name}."""
+    names = {}
+    reader = csv.DictReader(io.StringIO(data.decode("utf-8-sig")))
+    for row in reader:
+        filename, name = (row.get("filename") or "").strip(), (row.get("name") or "").strip()
+        if filename and name:
+            names[os.path.basename(filename)] = name
+    return names
+
+
+def iter_zip(data: bytes) -> Iterable[Tuple[str, bytes]]:
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or info.filename.startswith("__MACOSX/") or os.path.basename(info.filename).startswith("."):
+                continue
+            yield info.filename, zf.read(info)
+
+
+def iter_directory(path: str) -> Iterable[Tuple[str, bytes]]:
+    for root, _, files in os.walk(path):
+        for filename in sorted(files):
+            if filename.startswith("."):
+                continue
+            full = os.path.join(root, filename)
+            with open(full, "rb") as f:
+                yield os.path.relpath(full, path), f.read()
+
+
+def prepare(filename: str, data: bytes, names: Dict[str, str]) -> PreparedImage:
+    """Decode, normalise and fingerprint one file (runs in a worker thread)."""
+    item = PreparedImage(filename=filename, name=names.get(os.path.basename(filename)) or name_from_filename(filename))
+    try:
+        img = Image.open(io.BytesIO(data))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail(IMPORT_MAX_SIZE)
+        item.image_b64 = pil_to_base64(img)
+        item.phash = dhash(img)
+        item.palette = palette(img)
+    except Exception as e:
+        item.error = f"Could not read image: {e}"
+    return item
+
+
+def import_files(user_id, category: str, files: Iterable[Tuple[str, bytes]], names: Optional[Dict[str, str]] = None,
+                 workers: int = 8, dedupe: bool = True) -> ImportReport:
+    """Import (filename, bytes) pairs into one Vault category. CSV files among them are used as sidecars."""
+    if category not in CATEGORIES:
+        raise ValueError(f"Unknown category: {category}")
+    names = dict(names or {})
+    report = ImportReport()
+
+    images = []
+    for filename, data in files:
+        ext = os.path.splitext(filename)[1].lower()
+        if ext == ".csv":
+            try:
+                names.update(parse_sidecar(data))
+            except Exception as e:
+                report.errors.append((filename, f"Bad CSV sidecar: {e}"))
+        elif ext in IMAGE_EXTENSIONS:
+            images.append((filename, data))
+        else:
+            report.errors.append((filename, "Not an image (png, jpg, jpeg, webp)."))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        prepared = list(pool.map(lambda f: prepare(f[0], f[1], names), images))
+
+    # Near-duplicates of the existing vault or of an earlier file in this import are skipped
+    known_labels = []
+    if dedupe:
+        existing = db.get_asset_hashes(user_id, category)
+        known = HashIndex(range(len(existing)), [row['phash'] for row in existing])
+        known_labels = [f"existing '{row['name']}'" for row in existing]
+    rows = []
+    for item in prepared:
+        if item.error:
+            report.errors.append((item.filename, item.error))
+            continue
+        if dedupe:
+            matches = known.similar(item.phash, DUPLICATE_DISTANCE)
+            if matches:
+                report.duplicates.append((item.filename, f"Matches {known_labels[matches[0][0]]}"))
+                continue
+            known.add(len(known_labels), item.phash)
+            known_labels.append(f"{item.filename} in this import")
+        rows.append((item.name, item.image_b64, item.phash, item.palette))
+        report.imported.append(item.filename)
+
+    if rows:
+        db.add_assets_bulk(user_id, category, rows)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ella Studio bulk Vault import")
+    parser.add_argument("source", help="Directory or .zip of images")
+    parser.add_argument("--studio", required=True, help="Studio (username) to import into")
+    parser.add_argument("--category", required=True, choices=CATEGORIES)
+    parser.add_argument("--csv", help="Sidecar CSV with filename,name columns")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--no-dedupe", action="store_true", help="Import near-duplicates too")
+    args = parser.parse_args()
+
+    db.init_db()
+    user_id = db.get_user_id(args.studio)
+    if not user_id:
+        raise SystemExit(f"Unknown studio: {args.studio}")
+
+    names = {}
+    if args.csv:
+        with open(args.csv, "rb") as f:
+            names = parse_sidecar(f.read())
+    if os.path.isdir(args.source):
+        files = iter_directory(args.source)
+    else:
+        with open(args.source, "rb") as f:
+            files = list(iter_zip(f.read()))
+
+    report = import_files(user_id, args.category, files, names, workers=args.workers, dedupe=not args.no_dedupe)
+    for filename, reason in report.duplicates:
+        print(f"SKIP  {filename}: {reason}")
+    for filename, message in report.errors:
+        print(f"ERROR {filename}: {message}")
+    print(report.summary())
+
+
+if __name__ == "__main__":
+    main()